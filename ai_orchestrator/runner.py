@@ -2,19 +2,41 @@
 from __future__ import annotations
 
 import argparse
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
 import dataclasses
+import difflib
 import datetime as dt
+import fcntl
+import fnmatch
+import hashlib
+import http.client
+import io
 import json
+import mmap
 import os
 from pathlib import Path
+import pstats
+import queue
 import re
+import shutil
+import signal
+import socket
+import socketserver
+import sqlite3
 import subprocess
 import sys
+import tarfile
 import tempfile
 import textwrap
-import urllib.error
-import urllib.request
-from typing import Any
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from typing import Any, Iterator, Sequence
 
 
 DEFAULT_MODEL = "gpt-4.1"
@@ -24,15 +46,145 @@ DEFAULT_MAX_ATTEMPTS_PER_SLICE = 3
 DEFAULT_MAX_FILES_PER_SLICE = 8
 DEFAULT_COMMAND_TIMEOUT_SECONDS = 1200
 RUNS_DIR = ".ai_orchestrator/runs"
+FANOUT_DIR = ".ai_orchestrator/fanout"
 MAX_FILE_CHARS = 25_000
 MAX_REPO_FILES = 600
+MANIFEST_MAX_LINES = 300
+MANIFEST_LEAF_FILES = 6
+MAX_SELECTED_DIRECTORIES = 8
+MAX_CONVERSATION_CHARS = 600_000
+FILE_CACHE_MAX_CHARS = 64_000_000
+# Files modified this close to when they were cached may change again within one mtime tick.
+FILE_CACHE_RACY_NS = 2_000_000_000
 DEFAULT_CODEX_REASONING_EFFORT = "low"
+PROFILE_DIR = "profile"
+PROFILE_TOP_FUNCTIONS = 15
+PROFILE_TOP_ALLOCATIONS = 25
+PROFILE_THREAD_NOTE = (
+    "Note: function profiles cover the main thread only. Work in worker threads (chunked reviews, "
+    "check shards, hedged model calls) is missing from them; py_cpu_s and peak_mem include it."
+)
+DEFAULT_DAEMON_SOCKET = ".ai_orchestrator/orchestrator.sock"
+DAEMON_MAX_FINISHED_JOBS = 200
+OPENAI_REQUEST_TIMEOUT_SECONDS = 180
+CODEX_TIMEOUT_SECONDS = 900
+CANCEL_POLL_SECONDS = 0.25
+DEFAULT_MAX_OUTPUT_TOKENS = 16_000
+MAX_CONTINUATIONS = 3
+CONTINUATION_PROMPT = (
+    "Your previous reply was cut off by the output limit. Continue exactly where it stopped. "
+    "Output only the remaining text: do not repeat anything, do not add fences or commentary."
+)
+CHARS_PER_TOKEN = 3.5
+OUTPUT_BUDGET_HEADROOM = 1.25
+NEW_FILE_EXPECTED_CHARS = 3_000
+MIN_OUTPUT_TOKENS = {"plan": 2_000, "select": 600, "implement": 2_000, "review": 1_000}
+TEST_DURATIONS_FILE = ".ai_orchestrator/test-durations.json"
+# Lockfiles, build output and generated code: reviewed as a one-line summary, not a diff.
+REVIEW_SKIPPED_PATTERNS = [
+    "**/package-lock.json",
+    "**/yarn.lock",
+    "**/pnpm-lock.yaml",
+    "**/bun.lockb",
+    "**/poetry.lock",
+    "**/Pipfile.lock",
+    "**/uv.lock",
+    "**/Cargo.lock",
+    "**/composer.lock",
+    "**/Gemfile.lock",
+    "**/*.min.js",
+    "**/*.min.css",
+    "**/*.map",
+    "**/dist/*",
+    "**/.next/*",
+    "**/__generated__/*",
+    "**/*.generated.*",
+    "**/*_pb2.py",
+]
+DEFAULT_SHARD_TEST_PATTERNS = ["**/*.test.ts", "**/*.test.tsx", "**/*.test.js", "**/*.test.jsx"]
+VITEST_CONFIG_FILES = ["vitest.config.ts", "vitest.config.mts", "vitest.config.js", "vitest.config.mjs"]
+NO_TEST_FILES_PATTERN = re.compile(r"No test files found", re.IGNORECASE)
+SHARD_DURATION_SMOOTHING = 0.5
+PRE_REVIEW_REWRITE_MIN_LINES = 150
+PRE_REVIEW_REWRITE_RATIO = 0.6
+SUMMARY_CACHE_DIR = ".ai_orchestrator/cache/summaries"
+SUMMARY_FORMAT_VERSION = 2
+SUMMARY_MAX_OUTLINE_ENTRIES = 80
+OUTLINE_INDEX_FILE = ".ai_orchestrator/cache/outline-index.json"
+OUTLINE_INDEX_VERSION = 2
+OUTLINE_INDEXED_SUFFIXES = {".ts", ".tsx", ".js", ".jsx", ".mjs", ".cjs", ".py"}
+OUTLINE_MIN_CHARS = 4_000
+WINDOW_HEADER_MAX_CHARS = 2_500
+WINDOW_MAX_LISTED_SYMBOLS = 200
+MODEL_PHASES = ("plan", "select", "implement", "review")
+MODEL_BACKENDS = {"auto", "openai", "codex-cli"}
+PHASE_STATS_FILE = ".ai_orchestrator/phase-stats.json"
+PHASE_STATS_WINDOW = 100
+WARM_CHECK_PRESETS: dict[str, dict[str, Any]] = {
+    "tsc": {
+        "watch_command": (
+            "npx tsc --noEmit --watch --preserveWatchOutput --incremental "
+            "--tsBuildInfoFile .ai_orchestrator/cache/tsc-watch.tsbuildinfo"
+        ),
+        "done_pattern": r"Found \d+ errors?\. Watching for file changes",
+        "fail_pattern": r"Found [1-9]\d* errors?",
+        "paths": ["**/*.ts", "**/*.tsx", "**/tsconfig*.json"],
+        # Every tsc watch cycle type-checks the whole program.
+        "full_cycles": True,
+    },
+    "vitest": {
+        "watch_command": "npx vitest --watch",
+        "done_pattern": r"(Waiting|Watching) for file changes",
+        "fail_pattern": r"Tests failed|\bFAIL\b",
+        "paths": ["**/*.ts", "**/*.tsx", "**/*.js", "**/*.jsx", "**/*.mjs", "**/vitest.config.*"],
+        # Watch cycles rerun only tests related to the changed files: a failure is final,
+        # a pass is confirmed by the cold full command.
+        "full_cycles": False,
+    },
+}
+WARM_MAX_CYCLES = 5
+CHECK_SLOTS_DIR = "ai_orchestrator-check-slots"
+ADMISSION_POLL_SECONDS = 0.5
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+CGROUP_CPU_PERIOD_MICROSECONDS = 100_000
+FLAKY_TESTS_FILE = ".ai_orchestrator/flaky-tests.json"
+FLAKY_MAX_INPUTS_PER_COMMAND = 50
+FLAKY_RUNNERS = ("auto", "vitest", "pytest", "generic")
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+VITEST_FAIL_PATTERN = re.compile(
+    r"^\s*(?:FAIL|×|✗|❯)\s+(\S+\.(?:test|spec)\.[cm]?[jt]sx?)(?:\s+>\s+(.+?))?(?:\s+\d+m?s)?\s*$",
+    re.MULTILINE,
+)
+PYTEST_FAIL_PATTERN = re.compile(r"^(?:FAILED|ERROR)\s+(\S+?::\S+?)(?:\s+-\s.*)?$", re.MULTILINE)
+REPLAYS_DIR = ".ai_orchestrator/replays"
+REPLAY_SHARED_DIRS = ("node_modules",)
+REPLAY_PHASE_PROMPTS = {
+    "planning": "plan",
+    "selecting files": "select",
+    "selecting directories": "select",
+    "implementing a software slice": "implement",
+    "code reviewer": "review",
+}
+REPLAY_CHUNK_PATTERN = re.compile(r"^Diff \(chunk (\d+)/(\d+)\):", re.MULTILINE)
+HISTORY_DB_FILE = ".ai_orchestrator/history.sqlite"
+ARCHIVE_DIR = ".ai_orchestrator/archive"
+ARCHIVE_MIN_IDLE_SECONDS = 3600
+HTTP_ROUTE_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+TEST_PATH_PATTERN = re.compile(r"(^|/)(tests?|__tests__|e2e)/|\.(test|spec)\.[cm]?[jt]sx?$|(^|/)test_[^/]*\.py$|_test\.py$")
 
 
 class OrchestratorError(RuntimeError):
     pass
 
 
+class ChangeRefused(OrchestratorError):
+    # A change to a file the model did not see in full; fails the attempt, not the run.
+    def __init__(self, path: str, view: str, message: str):
+        super().__init__(message)
+        self.path = path
+        self.view = view
+
+
 @dataclasses.dataclass
 class SlicePlan:
     id: str
@@ -43,6 +195,81 @@ class SlicePlan:
     files_hint: list[str]
 
 
+@dataclasses.dataclass
+class ShardConfig:
+    shards: int
+    runner: str
+    test_patterns: list[str]
+
+
+@dataclasses.dataclass
+class PhaseModel:
+    backend: str
+    model: str
+
+
+@dataclasses.dataclass
+class AutoRouteConfig:
+    fast_backend: str
+    fast_model: str
+    phases: list[str]
+    min_pass_rate: float
+    min_samples: int
+    probe_every: int
+
+
+@dataclasses.dataclass
+class HedgeConfig:
+    phases: list[str]
+    percentile: float
+    min_samples: int
+    min_delay_seconds: float
+    secondary_backend: str | None
+    secondary_model: str | None
+
+
+@dataclasses.dataclass
+class WarmCheckConfig:
+    watch_command: str
+    done_pattern: str
+    fail_pattern: str
+    paths: list[str]
+    cycle_timeout_seconds: int
+    settle_seconds: float
+    full_cycles: bool
+
+
+@dataclasses.dataclass
+class CheckResourceConfig:
+    max_concurrent_checks: int
+    cpus_per_check: int
+    memory_mb: int
+    cpu_seconds: int
+    nice: int
+    min_free_memory_mb: int
+    max_load_per_cpu: float
+    admission_timeout_seconds: int
+    use_cgroups: bool
+    admission: bool
+
+
+@dataclasses.dataclass
+class FlakyCheckConfig:
+    reruns: int
+    quarantine_after: int
+    runners: dict[str, str]
+    quarantine: list[str]
+    quarantine_days: int
+
+
+@dataclasses.dataclass
+class RetentionPolicy:
+    max_age_days: int | None
+    max_runs: int | None
+    max_bytes: int | None
+    keep_recent: int
+
+
 @dataclasses.dataclass
 class Spec:
     goal: str
@@ -61,11 +288,28 @@ class Spec:
     planner_notes: str
     implementer_notes: str
     reviewer_notes: str
+    sharded_checks: dict[str, ShardConfig]
+    summarize_context_files: bool
+    phase_models: dict[str, PhaseModel]
+    auto_route: AutoRouteConfig | None
+    hedging: HedgeConfig | None
+    max_output_tokens: int
+    retention: RetentionPolicy | None
+    flaky_checks: FlakyCheckConfig
+    check_resources: CheckResourceConfig
+    warm_checks: dict[str, WarmCheckConfig]
+    review_chunk_tokens: int
+    max_parallel_reviews: int
+    max_review_chunks: int
+    multi_turn_retries: bool
+    working_directories: list[Path]
+    spec_path: str
 
 
 def spec_to_payload(spec: Spec) -> dict[str, Any]:
     payload = dataclasses.asdict(spec)
     payload["working_directory"] = str(spec.working_directory)
+    payload["working_directories"] = [str(path) for path in spec.working_directories]
     return payload
 
 
@@ -74,6 +318,10 @@ class CheckResult:
     command: str
     exit_code: int
     output: str
+    reruns: int = 0
+    flaky_tests: list[str] = dataclasses.field(default_factory=list)
+    quarantined_tests: list[str] = dataclasses.field(default_factory=list)
+    usage: dict[str, Any] = dataclasses.field(default_factory=dict)
 
     @property
     def passed(self) -> bool:
@@ -102,6 +350,120 @@ class RunLogger:
         self.write_text(relative_path, json.dumps(payload, indent=2, ensure_ascii=False))
 
 
+class PhaseProfiler:
+    # Wall/CPU time is always recorded per phase; cProfile + tracemalloc only with --profile.
+    # Phases must not be nested: cProfile supports one active profiler per thread.
+    def __init__(self, logger: RunLogger, enabled: bool):
+        self.logger = logger
+        self.enabled = enabled
+        self.phases: list[dict[str, Any]] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        index = len(self.phases) + 1
+        record: dict[str, Any] = {"index": index, "phase": name}
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        if not self.enabled:
+            try:
+                yield
+            finally:
+                record["wall_seconds"] = round(time.perf_counter() - wall_started, 4)
+                record["python_cpu_seconds"] = round(time.process_time() - cpu_started, 4)
+                self.phases.append(record)
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        memory_before, _ = tracemalloc.get_traced_memory()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _, memory_peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            record["wall_seconds"] = round(time.perf_counter() - wall_started, 4)
+            record["python_cpu_seconds"] = round(time.process_time() - cpu_started, 4)
+            record["peak_memory_bytes"] = max(0, memory_peak - memory_before)
+            self._write_phase_reports(record, profiler, snapshot)
+            self.phases.append(record)
+
+    def _write_phase_reports(
+        self,
+        record: dict[str, Any],
+        profiler: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot,
+    ) -> None:
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", record["phase"]).strip("_") or "phase"
+        base = f"{PROFILE_DIR}/{record['index']:03d}-{slug}"
+
+        pstats_path = self.logger.run_dir / f"{base}.pstats"
+        pstats_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(pstats_path))
+        record["pstats_file"] = f"{base}.pstats"
+
+        stats = pstats.Stats(profiler)
+        hottest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)  # type: ignore[attr-defined]
+        record["hottest_functions"] = [
+            {
+                "function": f"{Path(filename).name}:{line}({func})",
+                "calls": calls,
+                "self_seconds": round(self_time, 4),
+                "cumulative_seconds": round(cumulative, 4),
+            }
+            for (filename, line, func), (_, calls, self_time, cumulative, _) in hottest[:PROFILE_TOP_FUNCTIONS]
+        ]
+
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        allocations = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")]
+        ).statistics("lineno")
+        lines = [
+            f"phase: {record['phase']}",
+            f"wall_seconds: {record['wall_seconds']}",
+            f"python_cpu_seconds: {record['python_cpu_seconds']}",
+            f"peak_memory_bytes: {record['peak_memory_bytes']}",
+            "",
+            f"Top {PROFILE_TOP_ALLOCATIONS} allocations (live at end of phase):",
+        ]
+        lines.extend(str(stat) for stat in allocations[:PROFILE_TOP_ALLOCATIONS])
+        lines += ["", "Top functions by cumulative time:", stats_text.getvalue().strip()]
+        self.logger.write_text(f"{base}-alloc.txt", "\n".join(lines) + "\n")
+        record["alloc_file"] = f"{base}-alloc.txt"
+
+    def write_summary(self) -> None:
+        if not self.enabled:
+            return
+        self.logger.write_json(f"{PROFILE_DIR}/summary.json", {"phases": self.phases, "note": PROFILE_THREAD_NOTE})
+        lines = [PROFILE_THREAD_NOTE, "", f"{'phase':<48} {'wall_s':>9} {'py_cpu_s':>9} {'peak_mem':>12}"]
+        for record in self.phases:
+            lines.append(
+                f"{record['phase']:<48} {record['wall_seconds']:>9.3f} "
+                f"{record['python_cpu_seconds']:>9.3f} {format_bytes(record.get('peak_memory_bytes', 0)):>12}"
+            )
+            for hot in record.get("hottest_functions", [])[:3]:
+                lines.append(f"    {hot['self_seconds']:>8.4f}s self  {hot['function']}")
+        self.logger.write_text(f"{PROFILE_DIR}/summary.txt", "\n".join(lines) + "\n")
+
+
+def format_bytes(size: int) -> str:
+    if size < 1024:
+        return f"{size}B"
+    value = float(size)
+    for unit in ("KiB", "MiB", "GiB"):
+        value /= 1024
+        if value < 1024 or unit == "GiB":
+            break
+    return f"{value:.1f}{unit}"
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="AI orchestrator that decomposes a goal into slices and enforces checks per slice."
@@ -110,6 +472,20 @@ def parse_args() -> argparse.Namespace:
 
     plan_parser = subparsers.add_parser("plan", help="Generate and print the slice plan only.")
     plan_parser.add_argument("--spec", required=True, help="Path to the JSON spec file.")
+    add_profile_argument(plan_parser)
+
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="Re-run a logged run offline, feeding its recorded model responses, and report phase timings.",
+    )
+    replay_parser.add_argument("run_dir", help="Run directory under .ai_orchestrator/runs/.")
+    replay_parser.add_argument(
+        "--continue-on-failure",
+        action="store_true",
+        help="Continue to next slice even if current slice fails all attempts.",
+    )
+    replay_parser.add_argument("--keep-worktree", action="store_true", help="Keep the scratch git worktree after replay.")
+    add_profile_argument(replay_parser)
 
     run_parser = subparsers.add_parser("run", help="Plan, implement, test, and review each slice.")
     run_parser.add_argument("--spec", required=True, help="Path to the JSON spec file.")
@@ -118,15 +494,81 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Continue to next slice even if current slice fails all attempts.",
     )
+    add_profile_argument(run_parser)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Keep a warm orchestrator resident on a Unix socket and execute submitted jobs.",
+    )
+    add_socket_argument(serve_parser)
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a plan/run job to a running `serve` daemon.")
+    add_socket_argument(submit_parser)
+    submit_parser.add_argument("job", choices=["plan", "run"], help="Job type to execute in the daemon.")
+    submit_parser.add_argument("--spec", required=True, help="Path to the JSON spec file.")
+    submit_parser.add_argument(
+        "--continue-on-failure",
+        action="store_true",
+        help="Continue to next slice even if current slice fails all attempts (run jobs only).",
+    )
+    add_profile_argument(submit_parser)
+
+    history_parser = subparsers.add_parser("history", help="Query the run history index.")
+    history_parser.add_argument("--cwd", default=".", help="Working directory that holds .ai_orchestrator/ (default: .).")
+    history_parser.add_argument("--days", type=int, default=30, help="Only include runs started in the last N days.")
+    history_parser.add_argument("--group-by", choices=["spec", "day"], default="spec", help="Aggregate per spec or per day.")
+    history_parser.add_argument("--json", action="store_true", help="Print JSON instead of a table.")
+    history_parser.add_argument("--reindex", action="store_true", help="Re-read run directories into the index first.")
+
+    archive_parser = subparsers.add_parser("archive", help="Pack old run directories into compressed archives.")
+    archive_parser.add_argument("--cwd", default=".", help="Working directory that holds .ai_orchestrator/ (default: .).")
+    archive_parser.add_argument("--max-age-days", type=int, help="Archive runs older than N days.")
+    archive_parser.add_argument("--max-runs", type=int, help="Keep at most N unarchived runs.")
+    archive_parser.add_argument("--max-bytes", type=int, help="Keep unarchived runs under N bytes in total.")
+    archive_parser.add_argument("--keep-recent", type=int, default=5, help="Never archive the N newest runs (default: 5).")
+
+    status_parser = subparsers.add_parser("status", help="Show job status from a running `serve` daemon.")
+    add_socket_argument(status_parser)
+    status_parser.add_argument("--job", help="Job id to show, including its captured output.")
+    status_parser.add_argument("--shutdown", action="store_true", help="Stop the daemon once queued jobs finish.")
 
     return parser.parse_args()
 
 
+def add_socket_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--socket",
+        default=DEFAULT_DAEMON_SOCKET,
+        help=f"Unix socket path for the daemon (default: {DEFAULT_DAEMON_SOCKET}).",
+    )
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile each phase with cProfile/tracemalloc and write reports to the run directory.",
+    )
+
+
 def now_stamp() -> str:
     return dt.datetime.now().strftime("%Y%m%d-%H%M%S")
 
 
-def load_spec(path: Path) -> Spec:
+def new_run_dir(cwd: Path, runs_dir: str = RUNS_DIR) -> Path:
+    # Jobs submitted back-to-back to the daemon can start within the same second.
+    base = cwd / runs_dir / now_stamp()
+    candidate = base
+    suffix = 2
+    while candidate.exists():
+        candidate = base.with_name(f"{base.name}-{suffix}")
+        suffix += 1
+    return candidate
+
+
+def load_spec(path: Path, base_dir: Path | None = None) -> Spec:
+    # Relative directories resolve against base_dir (the daemon passes the submitter's cwd).
+    base_dir = base_dir or Path.cwd()
     try:
         raw = json.loads(path.read_text(encoding="utf-8"))
     except FileNotFoundError as exc:
@@ -142,7 +584,7 @@ def load_spec(path: Path) -> Spec:
     acceptance_criteria = require_string_list(raw, "acceptance_criteria", default=[])
     check_commands = require_string_list(raw, "check_commands", default=[])
     model_backend = optional_string(raw, "model_backend", "auto").strip().lower()
-    if model_backend not in {"auto", "openai", "codex-cli"}:
+    if model_backend not in MODEL_BACKENDS:
         raise OrchestratorError("Spec field 'model_backend' must be one of: auto, openai, codex-cli.")
     model = optional_string(raw, "model", DEFAULT_MODEL)
     api_base_url = optional_string(raw, "api_base_url", DEFAULT_API_BASE_URL)
@@ -168,11 +610,35 @@ def load_spec(path: Path) -> Spec:
         min_value=60,
         max_value=10_000,
     )
-    working_directory = Path(optional_string(raw, "working_directory", ".")).resolve()
+    working_directory = (base_dir / optional_string(raw, "working_directory", ".")).resolve()
     context_files = require_string_list(raw, "context_files", default=[])
     planner_notes = optional_string(raw, "planner_notes", "")
     implementer_notes = optional_string(raw, "implementer_notes", "")
     reviewer_notes = optional_string(raw, "reviewer_notes", "")
+    sharded_checks = parse_sharded_checks(raw)
+    summarize_context_files = optional_bool(raw, "summarize_context_files", True)
+    phase_models = parse_phase_models(raw, model_backend, model)
+    auto_route = parse_auto_route(raw, model_backend)
+    hedging = parse_hedging(raw)
+    max_output_tokens = require_int(
+        raw,
+        "max_output_tokens",
+        DEFAULT_MAX_OUTPUT_TOKENS,
+        min_value=1_000,
+        max_value=128_000,
+    )
+    retention = parse_retention(raw.get("retention"), "retention")
+    flaky_checks = parse_flaky_checks(raw)
+    check_resources = parse_check_resources(raw)
+    warm_checks = parse_warm_checks(raw)
+    review_chunk_tokens = require_int(raw, "review_chunk_tokens", 20_000, min_value=2_000, max_value=200_000)
+    max_parallel_reviews = require_int(raw, "max_parallel_reviews", 4, min_value=1, max_value=32)
+    max_review_chunks = require_int(raw, "max_review_chunks", 8, min_value=1, max_value=256)
+    multi_turn_retries = optional_bool(raw, "multi_turn_retries", True)
+    # Repos sharing one layout: plan once against working_directory, then run every repo.
+    working_directories = list(
+        dict.fromkeys((base_dir / value).resolve() for value in require_string_list(raw, "working_directories", default=[]))
+    )
 
     return Spec(
         goal=goal,
@@ -191,6 +657,200 @@ def load_spec(path: Path) -> Spec:
         planner_notes=planner_notes,
         implementer_notes=implementer_notes,
         reviewer_notes=reviewer_notes,
+        sharded_checks=sharded_checks,
+        summarize_context_files=summarize_context_files,
+        phase_models=phase_models,
+        auto_route=auto_route,
+        hedging=hedging,
+        max_output_tokens=max_output_tokens,
+        retention=retention,
+        flaky_checks=flaky_checks,
+        check_resources=check_resources,
+        warm_checks=warm_checks,
+        review_chunk_tokens=review_chunk_tokens,
+        max_parallel_reviews=max_parallel_reviews,
+        max_review_chunks=max_review_chunks,
+        multi_turn_retries=multi_turn_retries,
+        working_directories=working_directories,
+        spec_path=str(path.resolve()),
+    )
+
+
+def parse_phase_models(raw: dict[str, Any], default_backend: str, default_model: str) -> dict[str, PhaseModel]:
+    value = raw.get("phase_models", {})
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'phase_models' must be an object keyed by phase.")
+    phase_models: dict[str, PhaseModel] = {}
+    for phase, options in value.items():
+        if phase not in MODEL_PHASES:
+            raise OrchestratorError(f"Spec field 'phase_models' has unknown phase {phase!r}; use one of: {', '.join(MODEL_PHASES)}.")
+        if not isinstance(options, dict):
+            raise OrchestratorError(f"Spec field 'phase_models.{phase}' must be an object.")
+        backend = optional_string(options, "backend", default_backend).strip().lower()
+        if backend not in MODEL_BACKENDS:
+            raise OrchestratorError(f"Spec field 'phase_models.{phase}.backend' must be one of: auto, openai, codex-cli.")
+        phase_models[phase] = PhaseModel(backend=backend, model=optional_string(options, "model", default_model))
+    return phase_models
+
+
+def parse_auto_route(raw: dict[str, Any], default_backend: str) -> AutoRouteConfig | None:
+    value = raw.get("auto_route")
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'auto_route' must be an object.")
+    fast_backend = optional_string(value, "fast_backend", default_backend).strip().lower()
+    if fast_backend not in MODEL_BACKENDS:
+        raise OrchestratorError("Spec field 'auto_route.fast_backend' must be one of: auto, openai, codex-cli.")
+    # Review is not routed by default: its only recorded signal is "returned valid JSON".
+    phases = require_string_list(value, "phases", default=["select"])
+    unknown = [phase for phase in phases if phase not in MODEL_PHASES]
+    if unknown:
+        raise OrchestratorError(f"Spec field 'auto_route.phases' has unknown phases: {', '.join(unknown)}.")
+    return AutoRouteConfig(
+        fast_backend=fast_backend,
+        fast_model=require_string(value, "fast_model"),
+        phases=phases,
+        min_pass_rate=require_number(value, "min_pass_rate", 0.9, min_value=0.0, max_value=1.0),
+        min_samples=require_int(value, "min_samples", 10, min_value=1, max_value=1000),
+        probe_every=require_int(value, "probe_every", 10, min_value=2, max_value=1000),
+    )
+
+
+def parse_sharded_checks(raw: dict[str, Any]) -> dict[str, ShardConfig]:
+    value = raw.get("sharded_checks", {})
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'sharded_checks' must be an object keyed by check command.")
+    configs: dict[str, ShardConfig] = {}
+    for command, options in value.items():
+        key = f"sharded_checks[{command!r}]"
+        if not isinstance(options, dict):
+            raise OrchestratorError(f"Spec field '{key}' must be an object.")
+        shards = require_int(options, "shards", 0, min_value=0, max_value=64)
+        runner = optional_string(options, "runner", "vitest").strip().lower()
+        if runner not in {"vitest", "generic"}:
+            raise OrchestratorError(f"Spec field '{key}.runner' must be one of: vitest, generic.")
+        test_patterns = require_string_list(options, "test_patterns", default=DEFAULT_SHARD_TEST_PATTERNS)
+        configs[command.strip()] = ShardConfig(shards=shards, runner=runner, test_patterns=test_patterns)
+    return configs
+
+
+def parse_flaky_checks(raw: dict[str, Any]) -> FlakyCheckConfig:
+    value = raw.get("flaky_checks", {})
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'flaky_checks' must be an object.")
+    runners = value.get("runners", {})
+    if not isinstance(runners, dict) or any(runner not in FLAKY_RUNNERS for runner in runners.values()):
+        raise OrchestratorError(
+            f"Spec field 'flaky_checks.runners' must map check commands to one of: {', '.join(FLAKY_RUNNERS)}."
+        )
+    return FlakyCheckConfig(
+        reruns=require_int(value, "reruns", 1, min_value=0, max_value=5),
+        quarantine_after=require_int(value, "quarantine_after", 2, min_value=1, max_value=100),
+        runners={command.strip(): runner for command, runner in runners.items()},
+        quarantine=require_string_list(value, "quarantine", default=[]),
+        quarantine_days=require_int(value, "quarantine_days", 7, min_value=0, max_value=365),
+    )
+
+
+def parse_warm_checks(raw: dict[str, Any]) -> dict[str, WarmCheckConfig]:
+    value = raw.get("warm_checks", {})
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'warm_checks' must be an object keyed by check command.")
+    configs: dict[str, WarmCheckConfig] = {}
+    for command, options in value.items():
+        key = f"warm_checks[{command!r}]"
+        if not isinstance(options, dict):
+            raise OrchestratorError(f"Spec field '{key}' must be an object.")
+        preset_name = options.get("preset")
+        if preset_name is not None and preset_name not in WARM_CHECK_PRESETS:
+            raise OrchestratorError(f"Spec field '{key}.preset' must be one of: {', '.join(WARM_CHECK_PRESETS)}.")
+        preset = WARM_CHECK_PRESETS.get(preset_name, {})
+        fields = {}
+        for name in ("watch_command", "done_pattern", "fail_pattern"):
+            field_value = options.get(name, preset.get(name))
+            if not isinstance(field_value, str) or not field_value.strip():
+                raise OrchestratorError(f"Spec field '{key}.{name}' is required without a preset.")
+            fields[name] = field_value.strip()
+        for name in ("done_pattern", "fail_pattern"):
+            try:
+                re.compile(fields[name])
+            except re.error as exc:
+                raise OrchestratorError(f"Spec field '{key}.{name}' is not a valid regex: {exc}") from exc
+        configs[command.strip()] = WarmCheckConfig(
+            watch_command=fields["watch_command"],
+            done_pattern=fields["done_pattern"],
+            fail_pattern=fields["fail_pattern"],
+            paths=require_string_list(options, "paths", default=preset.get("paths", ["**/*"])),
+            cycle_timeout_seconds=require_int(options, "cycle_timeout_seconds", 300, min_value=1, max_value=86_400),
+            settle_seconds=require_number(options, "settle_seconds", 0.5, min_value=0, max_value=60),
+            full_cycles=optional_bool(options, "full_cycles", preset.get("full_cycles", False)),
+        )
+    return configs
+
+
+def parse_check_resources(raw: dict[str, Any]) -> CheckResourceConfig:
+    value = raw.get("check_resources", {})
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'check_resources' must be an object.")
+    return CheckResourceConfig(
+        max_concurrent_checks=require_int(value, "max_concurrent_checks", 0, min_value=0, max_value=1024),
+        cpus_per_check=require_int(value, "cpus_per_check", 1, min_value=1, max_value=1024),
+        memory_mb=require_int(value, "memory_mb", 0, min_value=0, max_value=1_048_576),
+        cpu_seconds=require_int(value, "cpu_seconds", 0, min_value=0, max_value=86_400),
+        nice=require_int(value, "nice", 0, min_value=0, max_value=19),
+        min_free_memory_mb=require_int(value, "min_free_memory_mb", 256, min_value=0, max_value=1_048_576),
+        max_load_per_cpu=require_number(value, "max_load_per_cpu", 2.0, min_value=0, max_value=100),
+        admission_timeout_seconds=require_int(value, "admission_timeout_seconds", 600, min_value=0, max_value=86_400),
+        use_cgroups=optional_bool(value, "use_cgroups", True),
+        # Waiting for slots, memory and load is opt-in: only a spec that sets check_resources gets it.
+        admission=optional_bool(value, "admission", "check_resources" in raw),
+    )
+
+
+def parse_hedging(raw: dict[str, Any]) -> HedgeConfig | None:
+    value = raw.get("hedging")
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise OrchestratorError("Spec field 'hedging' must be an object.")
+    phases = require_string_list(value, "phases", default=list(MODEL_PHASES))
+    unknown = [phase for phase in phases if phase not in MODEL_PHASES]
+    if unknown:
+        raise OrchestratorError(f"Spec field 'hedging.phases' has unknown phases: {', '.join(unknown)}.")
+    secondary_backend = value.get("secondary_backend")
+    if secondary_backend is not None and (not isinstance(secondary_backend, str) or secondary_backend not in MODEL_BACKENDS):
+        raise OrchestratorError("Spec field 'hedging.secondary_backend' must be one of: auto, openai, codex-cli.")
+    secondary_model = value.get("secondary_model")
+    if secondary_model is not None and (not isinstance(secondary_model, str) or not secondary_model.strip()):
+        raise OrchestratorError("Spec field 'hedging.secondary_model' must be a non-empty string.")
+    return HedgeConfig(
+        phases=phases,
+        percentile=require_number(value, "percentile", 90, min_value=50, max_value=99.9),
+        min_samples=require_int(value, "min_samples", 10, min_value=1, max_value=1000),
+        min_delay_seconds=require_number(value, "min_delay_seconds", 5, min_value=0, max_value=3600),
+        secondary_backend=secondary_backend,
+        secondary_model=secondary_model.strip() if secondary_model else None,
+    )
+
+
+def parse_retention(value: Any, field: str) -> RetentionPolicy | None:
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise OrchestratorError(f"Spec field '{field}' must be an object.")
+    # A null limit (as spec_to_payload writes unset ones) means the limit is not set.
+    limits = {
+        key: require_int(value, key, 0, min_value=0, max_value=2**62) if value.get(key) is not None else None
+        for key in ("max_age_days", "max_runs", "max_bytes")
+    }
+    if all(limit is None for limit in limits.values()):
+        raise OrchestratorError(f"Spec field '{field}' needs at least one of max_age_days, max_runs, max_bytes.")
+    return RetentionPolicy(
+        max_age_days=limits["max_age_days"],
+        max_runs=limits["max_runs"],
+        max_bytes=limits["max_bytes"],
+        keep_recent=require_int(value, "keep_recent", 5, min_value=0, max_value=10_000),
     )
 
 
@@ -208,6 +868,13 @@ def optional_string(raw: dict[str, Any], key: str, default: str) -> str:
     return value
 
 
+def optional_bool(raw: dict[str, Any], key: str, default: bool) -> bool:
+    value = raw.get(key, default)
+    if not isinstance(value, bool):
+        raise OrchestratorError(f"Spec field '{key}' must be a boolean.")
+    return value
+
+
 def require_string_list(raw: dict[str, Any], key: str, default: list[str]) -> list[str]:
     value = raw.get(key, default)
     if not isinstance(value, list) or any(not isinstance(item, str) for item in value):
@@ -215,6 +882,22 @@ def require_string_list(raw: dict[str, Any], key: str, default: list[str]) -> li
     return [item.strip() for item in value if item.strip()]
 
 
+def require_number(
+    raw: dict[str, Any],
+    key: str,
+    default: float,
+    *,
+    min_value: float,
+    max_value: float,
+) -> float:
+    value = raw.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise OrchestratorError(f"Spec field '{key}' must be a number.")
+    if value < min_value or value > max_value:
+        raise OrchestratorError(f"Spec field '{key}' must be between {min_value} and {max_value}.")
+    return float(value)
+
+
 def require_int(
     raw: dict[str, Any],
     key: str,
@@ -247,13 +930,250 @@ def run_cmd(command: str, cwd: Path, timeout_seconds: int) -> tuple[int, str]:
         return 124, f"Command timed out after {timeout_seconds}s: {command}\n{exc}"
 
 
+# Process-wide caches. They only pay off in the resident `serve` daemon, but are cheap to keep
+# in one-shot runs too: each entry is validated against file stats before reuse.
+_GIT_INDEX_PATHS: dict[Path, Path] = {}
+_REPO_FILE_CACHE: dict[Path, tuple[tuple[int, int], list[str]]] = {}
+_MANIFEST_CACHE: dict[Path, tuple[tuple[int, int] | None, int, RepoManifest]] = {}
+
+
+@dataclasses.dataclass
+class FileCacheEntry:
+    mtime_ns: int
+    size: int
+    content: str
+    # Set only for racily-clean entries, whose (mtime_ns, size) cannot prove the file unchanged.
+    digest: bytes | None = None
+
+
+class FileCache:
+    # Decoded file contents keyed by path, validated by (mtime_ns, size) on every read and by
+    # content hash while the entry is racily clean. LRU-evicted past max_chars.
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.entries: collections.OrderedDict[Path, FileCacheEntry] = collections.OrderedDict()
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def read_text(self, path: Path) -> str:
+        stat = path.stat()
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is not None and (entry.mtime_ns, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                if entry.digest is None:
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    return entry.content
+        data = path.read_bytes()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            if entry is not None and entry.digest == digest and self.entries.get(path) is entry:
+                entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+                if time.time_ns() - stat.st_mtime_ns > FILE_CACHE_RACY_NS:
+                    entry.digest = None
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry.content
+        content = data.decode("utf-8")
+        racy = time.time_ns() - stat.st_mtime_ns <= FILE_CACHE_RACY_NS
+        with self._lock:
+            self.misses += 1
+            self._drop(path)
+            if len(content) <= self.max_chars:
+                self.entries[path] = FileCacheEntry(stat.st_mtime_ns, stat.st_size, content, digest if racy else None)
+                self.chars += len(content)
+                while self.chars > self.max_chars:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.chars -= len(evicted.content)
+                    self.evictions += 1
+        return content
+
+    def invalidate(self, path: Path) -> None:
+        with self._lock:
+            if self._drop(path):
+                self.invalidations += 1
+
+    def _drop(self, path: Path) -> bool:
+        entry = self.entries.pop(path, None)
+        if entry is None:
+            return False
+        self.chars -= len(entry.content)
+        return True
+
+    def counters(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def stats(self, since: dict[str, int] | None = None) -> dict[str, Any]:
+        # Counters are process-wide (shared by serve jobs); `since` narrows them to one run.
+        counts = self.counters()
+        if since is not None:
+            counts = {key: value - since.get(key, 0) for key, value in counts.items()}
+        lookups = counts["hits"] + counts["misses"]
+        with self._lock:
+            return {
+                **counts,
+                "hit_rate": round(counts["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+                "cached_chars": self.chars,
+            }
+
+
+FILE_CACHE = FileCache(FILE_CACHE_MAX_CHARS)
+
+
+def git_index_signature(cwd: Path) -> tuple[int, int] | None:
+    index_path = _GIT_INDEX_PATHS.get(cwd)
+    if index_path is None:
+        code, output = run_cmd("git rev-parse --git-path index", cwd=cwd, timeout_seconds=30)
+        if code != 0:
+            return None
+        index_path = (cwd / output.strip()).resolve()
+        _GIT_INDEX_PATHS[cwd] = index_path
+    try:
+        stat = index_path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
 def git_file_list(cwd: Path) -> list[str]:
+    # `git ls-files` only changes when the index does, so a stat of the index file validates the cache.
+    signature = git_index_signature(cwd)
+    cached = _REPO_FILE_CACHE.get(cwd)
+    if signature is not None and cached is not None and cached[0] == signature:
+        return list(cached[1])
+
     code, output = run_cmd("git ls-files", cwd=cwd, timeout_seconds=30)
     if code != 0:
         raise OrchestratorError(f"Failed to list tracked files with git ls-files:\n{output}")
     paths = [line.strip() for line in output.splitlines() if line.strip()]
+    # Not truncated: repos above MAX_REPO_FILES are shown to the model as a RepoManifest.
     filtered = [p for p in paths if not p.startswith(RUNS_DIR)]
-    return filtered[:MAX_REPO_FILES]
+    if signature is not None:
+        _REPO_FILE_CACHE[cwd] = (signature, filtered)
+    return list(filtered)
+
+
+def git_file_sizes(cwd: Path) -> dict[str, int]:
+    # Blob sizes from HEAD in one call; files not in HEAD yet are stat'ed by the caller.
+    completed = subprocess.run(
+        ["git", "ls-tree", "-r", "-l", "-z", "HEAD"],
+        cwd=str(cwd),
+        capture_output=True,
+        timeout=60,
+    )
+    sizes: dict[str, int] = {}
+    if completed.returncode != 0:
+        return sizes
+    for entry in completed.stdout.decode("utf-8", errors="replace").split("\0"):
+        meta, _, path = entry.partition("\t")
+        fields = meta.split()
+        if len(fields) == 4 and fields[3].isdigit():
+            sizes[path] = int(fields[3])
+    return sizes
+
+
+class RepoManifest:
+    # Directory tree with recursive file counts and sizes, rendered within a line budget.
+    def __init__(self, files: list[str], sizes: dict[str, int]):
+        self.files = files
+        self.file_set = set(files)
+        self.counts: dict[str, int] = {}
+        self.bytes: dict[str, int] = {}
+        self.subdirs: dict[str, set[str]] = {}
+        self.direct_files: dict[str, list[str]] = {}
+        for path in files:
+            parent = path.rsplit("/", 1)[0] if "/" in path else ""
+            self.direct_files.setdefault(parent, []).append(path)
+            directory = parent
+            while True:
+                self.counts[directory] = self.counts.get(directory, 0) + 1
+                self.bytes[directory] = self.bytes.get(directory, 0) + sizes.get(path, 0)
+                if not directory:
+                    break
+                up = directory.rsplit("/", 1)[0] if "/" in directory else ""
+                self.subdirs.setdefault(up, set()).add(directory)
+                directory = up
+
+    def expansion_cost(self, directory: str) -> int:
+        direct = len(self.direct_files.get(directory, []))
+        return len(self.subdirs.get(directory, ())) + min(direct, MANIFEST_LEAF_FILES) + (1 if direct > MANIFEST_LEAF_FILES else 0)
+
+    def render(self, max_lines: int = MANIFEST_MAX_LINES) -> str:
+        # Breadth-first expansion until the line budget is used; deterministic for a given file list.
+        expanded: set[str] = set()
+        lines = 0
+        pending = [""]
+        while pending:
+            directory = pending.pop(0)
+            cost = self.expansion_cost(directory)
+            if lines + cost > max_lines:
+                continue
+            expanded.add(directory)
+            lines += cost
+            pending.extend(sorted(self.subdirs.get(directory, ())))
+
+        out = [f"./  ({self.counts.get('', 0)} files, {format_bytes(self.bytes.get('', 0))})"]
+
+        def walk(directory: str, depth: int) -> None:
+            indent = "  " * depth
+            for child in sorted(self.subdirs.get(directory, ())):
+                name = child.rsplit("/", 1)[-1]
+                marker = "" if child in expanded else " …"
+                out.append(f"{indent}{name}/  ({self.counts[child]} files, {format_bytes(self.bytes[child])}){marker}")
+                if child in expanded:
+                    walk(child, depth + 1)
+            direct = sorted(self.direct_files.get(directory, []))
+            for path in direct[:MANIFEST_LEAF_FILES]:
+                out.append(f"{indent}{path.rsplit('/', 1)[-1]}")
+            if len(direct) > MANIFEST_LEAF_FILES:
+                rest = direct[MANIFEST_LEAF_FILES:]
+                extensions: dict[str, int] = {}
+                for path in rest:
+                    name = path.rsplit("/", 1)[-1]
+                    extension = "." + name.rsplit(".", 1)[1] if "." in name.lstrip(".") else "(none)"
+                    extensions[extension] = extensions.get(extension, 0) + 1
+                summary = ", ".join(f"{count} {ext}" for ext, count in sorted(extensions.items(), key=lambda item: (-item[1], item[0])))
+                out.append(f"{indent}… {len(rest)} more files: {summary}")
+
+        if "" in expanded:
+            walk("", 1)
+        return "\n".join(out)
+
+    def files_under(self, directories: list[str]) -> list[str]:
+        prefixes = tuple(f"{directory}/" for directory in directories if directory)
+        return [path for path in self.files if path.startswith(prefixes)]
+
+
+def repo_manifest(cwd: Path, files: list[str]) -> RepoManifest:
+    signature = git_index_signature(cwd)
+    cached = _MANIFEST_CACHE.get(cwd)
+    if cached is not None and signature is not None and cached[0] == signature and cached[1] == len(files):
+        return cached[2]
+    sizes = git_file_sizes(cwd)
+    for path in files:
+        if path not in sizes:
+            with contextlib.suppress(OSError):
+                sizes[path] = (cwd / path).stat().st_size
+    manifest = RepoManifest(files, sizes)
+    _MANIFEST_CACHE[cwd] = (signature, len(files), manifest)
+    return manifest
+
+
+def repository_listing(cwd: Path, files: list[str]) -> str:
+    if len(files) <= MAX_REPO_FILES:
+        return stable_json(files)
+    return repo_manifest(cwd, files).render()
 
 
 def current_changed_paths(cwd: Path) -> set[str]:
@@ -291,13 +1211,33 @@ def read_context_files(spec: Spec, cwd: Path) -> str:
         if not target.exists():
             parts.append(f"## {rel_norm}\n[missing file]")
             continue
-        content = target.read_text(encoding="utf-8")
+        excerpt = windowed_excerpt_for(cwd, rel_norm, f"{spec.goal}\n{spec.planner_notes}")
+        if excerpt is not None:
+            parts.append(f"## {rel_norm}\n{excerpt}")
+            continue
+        content = FILE_CACHE.read_text(target)
         if len(content) > MAX_FILE_CHARS:
             content = content[:MAX_FILE_CHARS] + "\n\n[TRUNCATED]"
         parts.append(f"## {rel_norm}\n{content}")
     return "\n\n".join(parts)
 
 
+def stable_json(value: Any) -> str:
+    # Byte-stable across runs and processes: sorted keys, fixed separators, no ASCII escaping.
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(", ", ": "))
+
+
+def prompt_section(title: str, body: Any) -> str:
+    text = body if isinstance(body, str) else stable_json(body)
+    return f"{title}:\n{text.strip() or '[none]'}"
+
+
+def assemble_prompt(static: Sequence[str], per_slice: Sequence[str] = (), per_attempt: Sequence[str] = ()) -> str:
+    # Static content first, then per-slice, then per-attempt: consecutive calls of a phase then
+    # share the longest byte-identical prefix, which provider-side prompt caching can reuse.
+    return "\n\n".join(part.strip() for part in [*static, *per_slice, *per_attempt] if part.strip())
+
+
 def extract_json_object(text: str) -> dict[str, Any]:
     stripped = text.strip()
     if not stripped:
@@ -331,11 +1271,108 @@ def extract_json_object(text: str) -> dict[str, Any]:
     raise OrchestratorError(f"Could not parse JSON object from model output:\n{text}")
 
 
+class HTTPConnectionPool:
+    # Keep-alive connections to one host, so repeated model calls skip TCP/TLS setup.
+    def __init__(self, base_url: str, timeout: float, max_idle: int = 4):
+        parsed = urllib.parse.urlsplit(base_url)
+        if parsed.scheme not in {"http", "https"} or not parsed.hostname:
+            raise OrchestratorError(f"Unsupported API base URL: {base_url}")
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _release(self, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def post(
+        self,
+        path: str,
+        body: bytes,
+        headers: dict[str, str],
+        cancel_event: threading.Event | None = None,
+    ) -> tuple[int, bytes]:
+        for _ in range(2):
+            connection, reused = self._acquire()
+            finished = threading.Event()
+            if cancel_event is not None:
+                threading.Thread(
+                    target=abort_connection_on_cancel,
+                    args=(connection, cancel_event, finished),
+                    daemon=True,
+                ).start()
+            try:
+                connection.request("POST", f"{self.base_path}{path}", body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and not (cancel_event is not None and cancel_event.is_set()):
+                    # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            finally:
+                finished.set()
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, data
+        raise http.client.RemoteDisconnected("Connection closed by remote host")
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def abort_connection_on_cancel(
+    connection: http.client.HTTPConnection,
+    cancel_event: threading.Event,
+    finished: threading.Event,
+) -> None:
+    while not finished.is_set():
+        if cancel_event.wait(CANCEL_POLL_SECONDS):
+            sock = connection.sock
+            if sock is not None and not finished.is_set():
+                with contextlib.suppress(OSError):
+                    sock.shutdown(socket.SHUT_RDWR)
+            return
+
+
 class OpenAIChatClient:
+    supports_cancel = True
+    reports_usage = True
+    supports_history = True
+
     def __init__(self, api_key: str, model: str, api_base_url: str):
         self.api_key = api_key
         self.model = model
         self.api_base_url = api_base_url.rstrip("/")
+        self.pool = HTTPConnectionPool(self.api_base_url, timeout=OPENAI_REQUEST_TIMEOUT_SECONDS)
 
     def complete(
         self,
@@ -344,48 +1381,106 @@ class OpenAIChatClient:
         user_prompt: str,
         temperature: float = 0.1,
         max_tokens: int = 3000,
+        cancel_event: threading.Event | None = None,
+        usage: dict[str, int] | None = None,
+        history: list[dict[str, str]] | None = None,
     ) -> str:
-        url = f"{self.api_base_url}/chat/completions"
-        payload = {
-            "model": self.model,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        }
-        request = urllib.request.Request(
-            url,
-            data=json.dumps(payload).encode("utf-8"),
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            },
-            method="POST",
-        )
+        messages = [
+            {"role": "system", "content": system_prompt},
+            *(history or []),
+            {"role": "user", "content": user_prompt},
+        ]
+        parts: list[str] = []
+        for continuation in range(MAX_CONTINUATIONS + 1):
+            data = self._post_chat(
+                {"model": self.model, "temperature": temperature, "max_tokens": max_tokens, "messages": messages},
+                cancel_event,
+            )
+            content, finish_reason = parse_chat_choice(data)
+            parts.append(content)
+            if usage is not None:
+                add_usage(usage, data.get("usage"), continued=continuation > 0)
+            if finish_reason != "length":
+                break
+            # Truncated by max_tokens: ask for the rest and stitch it on instead of failing the parse.
+            messages = [
+                *messages,
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUATION_PROMPT},
+            ]
+        return "".join(parts)
+
+    def _post_chat(self, payload: dict[str, Any], cancel_event: threading.Event | None) -> dict[str, Any]:
         try:
-            with urllib.request.urlopen(request, timeout=180) as response:
-                data = json.loads(response.read().decode("utf-8"))
-        except urllib.error.HTTPError as exc:
-            body = exc.read().decode("utf-8", errors="replace")
-            raise OrchestratorError(
-                f"OpenAI API request failed ({exc.code}): {body}"
-            ) from exc
-        except urllib.error.URLError as exc:
+            status, body = self.pool.post(
+                "/chat/completions",
+                json.dumps(payload).encode("utf-8"),
+                {
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+                cancel_event=cancel_event,
+            )
+        except (OSError, http.client.HTTPException) as exc:
+            if cancel_event is not None and cancel_event.is_set():
+                raise OrchestratorError("OpenAI API request cancelled.") from exc
             raise OrchestratorError(f"OpenAI API network failure: {exc}") from exc
-
-        choices = data.get("choices")
-        if not isinstance(choices, list) or not choices:
+        if status >= 400:
+            raise OrchestratorError(
+                f"OpenAI API request failed ({status}): {body.decode('utf-8', errors='replace')}"
+            )
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except json.JSONDecodeError as exc:
+            raise OrchestratorError(f"OpenAI API returned invalid JSON: {exc}") from exc
+        if not isinstance(data, dict):
             raise OrchestratorError(f"Unexpected OpenAI response: {data}")
-        message = choices[0].get("message", {})
-        content = message.get("content")
-        if not isinstance(content, str):
-            raise OrchestratorError(f"Unexpected OpenAI response content: {data}")
-        return content
+        return data
+
+
+def parse_chat_choice(data: dict[str, Any]) -> tuple[str, str | None]:
+    choices = data.get("choices")
+    if not isinstance(choices, list) or not choices:
+        raise OrchestratorError(f"Unexpected OpenAI response: {data}")
+    message = choices[0].get("message", {})
+    content = message.get("content")
+    if not isinstance(content, str):
+        raise OrchestratorError(f"Unexpected OpenAI response content: {data}")
+    return content, choices[0].get("finish_reason")
+
+
+_USAGE_LOCK = threading.Lock()
+
+
+def add_usage(totals: dict[str, int], usage: Any, *, continued: bool) -> None:
+    # Chunked reviews call the same phase client from several threads.
+    with _USAGE_LOCK:
+        totals["requests"] = totals.get("requests", 0) + 1
+        if continued:
+            totals["continuations"] = totals.get("continuations", 0) + 1
+        if not isinstance(usage, dict):
+            return
+        for key in ("prompt_tokens", "completion_tokens"):
+            if isinstance(usage.get(key), int):
+                totals[key] = totals.get(key, 0) + usage[key]
+        details = usage.get("prompt_tokens_details")
+        if isinstance(details, dict) and isinstance(details.get("cached_tokens"), int):
+            totals["cached_prompt_tokens"] = totals.get("cached_prompt_tokens", 0) + details["cached_tokens"]
+
+
+def prompt_cache_summary(usage: dict[str, dict[str, int]]) -> dict[str, Any]:
+    prompt_tokens = sum(totals.get("prompt_tokens", 0) for totals in usage.values())
+    cached = sum(totals.get("cached_prompt_tokens", 0) for totals in usage.values())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached,
+        "cached_ratio": round(cached / prompt_tokens, 3) if prompt_tokens else 0.0,
+    }
 
 
 class CodexCliClient:
+    supports_cancel = True
+
     def __init__(self, model: str, cwd: Path):
         self.model = model
         self.cwd = cwd
@@ -402,6 +1497,7 @@ class CodexCliClient:
         user_prompt: str,
         temperature: float = 0.1,
         max_tokens: int = 3000,
+        cancel_event: threading.Event | None = None,
     ) -> str:
         del temperature, max_tokens
 
@@ -431,18 +1527,29 @@ class CodexCliClient:
             if self.model:
                 cmd += ["-m", self.model]
             cmd += ["-"]
-            completed = subprocess.run(
+            process = subprocess.Popen(
                 cmd,
-                input=prompt,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                capture_output=True,
-                timeout=900,
+                start_new_session=True,
             )
-            if completed.returncode != 0:
-                stderr = (completed.stderr or "").strip()
-                stdout = (completed.stdout or "").strip()
+            if cancel_event is not None:
+                threading.Thread(target=kill_process_on_cancel, args=(process, cancel_event), daemon=True).start()
+            try:
+                stdout, stderr = process.communicate(input=prompt, timeout=CODEX_TIMEOUT_SECONDS)
+            except subprocess.TimeoutExpired as exc:
+                kill_process_group(process)
+                process.communicate()
+                raise OrchestratorError(f"codex exec timed out after {CODEX_TIMEOUT_SECONDS}s.") from exc
+            if cancel_event is not None and cancel_event.is_set():
+                raise OrchestratorError("codex exec cancelled.")
+            if process.returncode != 0:
+                stderr = (stderr or "").strip()
+                stdout = (stdout or "").strip()
                 raise OrchestratorError(
-                    f"codex exec failed (exit {completed.returncode}).\n"
+                    f"codex exec failed (exit {process.returncode}).\n"
                     f"stderr:\n{stderr[-4000:]}\n\nstdout:\n{stdout[-4000:]}"
                 )
             if not out_file.exists():
@@ -450,18 +1557,319 @@ class CodexCliClient:
             return out_file.read_text(encoding="utf-8")
 
 
-def create_client(spec: Spec) -> Any:
-    backend = spec.model_backend
+def kill_process_on_cancel(process: subprocess.Popen[str], cancel_event: threading.Event) -> None:
+    while process.poll() is None:
+        if cancel_event.wait(CANCEL_POLL_SECONDS):
+            kill_process_group(process)
+            return
+
+
+def kill_process_group(process: subprocess.Popen[str]) -> None:
+    # The process runs in its own session; kill the group so grandchildren release the pipes.
+    with contextlib.suppress(OSError):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def create_client(spec: Spec, backend: str | None = None, model: str | None = None) -> Any:
+    backend = backend or spec.model_backend
+    model = model or spec.model
     api_key = os.getenv("OPENAI_API_KEY")
     if backend in {"openai", "auto"} and api_key:
-        return OpenAIChatClient(api_key=api_key, model=spec.model, api_base_url=spec.api_base_url)
+        return OpenAIChatClient(api_key=api_key, model=model, api_base_url=spec.api_base_url)
     if backend in {"codex-cli", "auto"}:
-        return CodexCliClient(model=spec.model, cwd=spec.working_directory)
+        return CodexCliClient(model=model, cwd=spec.working_directory)
     if backend == "openai" and not api_key:
         raise OrchestratorError("OPENAI_API_KEY is required when model_backend=openai.")
     raise OrchestratorError(f"Unable to initialize model backend: {backend}")
 
 
+class PhaseStats:
+    # Rolling per-(phase, backend, model) latency and success samples, persisted across runs.
+    def __init__(self, cwd: Path):
+        self.path = cwd / PHASE_STATS_FILE
+        self.lock = threading.Lock()
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+            self.entries: dict[str, dict[str, list[Any]]] = payload if isinstance(payload, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            self.entries = {}
+
+    @staticmethod
+    def key(phase: str, backend: str, model: str) -> str:
+        return f"{phase}|{backend}|{model}"
+
+    def _entry(self, key: str) -> dict[str, list[Any]]:
+        entry = self.entries.setdefault(key, {})
+        entry.setdefault("calls", [])
+        entry.setdefault("outcomes", [])
+        return entry
+
+    def record_call(self, key: str, latency_seconds: float, valid: bool) -> None:
+        with self.lock:
+            calls = self._entry(key)["calls"]
+            calls.append([round(latency_seconds, 3), valid])
+            del calls[:-PHASE_STATS_WINDOW]
+
+    def record_outcome(self, key: str, passed: bool) -> None:
+        with self.lock:
+            outcomes = self._entry(key)["outcomes"]
+            outcomes.append(passed)
+            del outcomes[:-PHASE_STATS_WINDOW]
+
+    def pass_rate(self, key: str) -> tuple[float, int]:
+        # Phases with recorded outcomes (implement, select) use them; others use "returned valid JSON".
+        with self.lock:
+            entry = self.entries.get(key, {})
+            samples = entry.get("outcomes") or [valid for _, valid in entry.get("calls", [])]
+        if not samples:
+            return 0.0, 0
+        return sum(1 for sample in samples if sample) / len(samples), len(samples)
+
+    def latencies(self, phase: str) -> list[float]:
+        with self.lock:
+            return [
+                latency
+                for key, entry in self.entries.items()
+                if key.split("|", 1)[0] == phase
+                for latency, _ in entry.get("calls", [])
+            ]
+
+    def summary(self) -> dict[str, Any]:
+        out: dict[str, Any] = {}
+        for key in sorted(self.entries):
+            latencies = sorted(latency for latency, _ in self.entries[key].get("calls", []))
+            rate, samples = self.pass_rate(key)
+            out[key] = {
+                "samples": samples,
+                "pass_rate": round(rate, 3),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p90": percentile(latencies, 90),
+            }
+        return out
+
+    def save(self) -> None:
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries, sort_keys=True), encoding="utf-8")
+
+
+def percentile(sorted_values: list[float], pct: float) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class PhaseClient:
+    # Wraps a model client for one phase and records latency, JSON validity and token usage of each call.
+    def __init__(self, inner: Any, phase: str, stats_key: str, stats: PhaseStats, usage: dict[str, int]):
+        self.inner = inner
+        self.phase = phase
+        self.stats_key = stats_key
+        self.stats = stats
+        self.usage = usage
+        self.supports_history = bool(getattr(inner, "supports_history", False))
+
+    def complete(self, **kwargs: Any) -> str:
+        if getattr(self.inner, "reports_usage", False):
+            kwargs["usage"] = self.usage
+        started = time.perf_counter()
+        try:
+            raw = self.inner.complete(**kwargs)
+        except OrchestratorError:
+            self.stats.record_call(self.stats_key, time.perf_counter() - started, False)
+            raise
+        self.stats.record_call(self.stats_key, time.perf_counter() - started, is_json_object(raw))
+        return raw
+
+
+class HedgeStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.phases: dict[str, dict[str, int]] = {}
+
+    def record(self, phase: str, event: str) -> None:
+        with self.lock:
+            counters = self.phases.setdefault(phase, {"calls": 0, "hedged": 0, "secondary_won": 0, "cancelled": 0})
+            counters[event] += 1
+
+    def summary(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                phase: {**counters, "hedge_rate": round(counters["hedged"] / counters["calls"], 3) if counters["calls"] else 0.0}
+                for phase, counters in self.phases.items()
+            }
+
+
+class HedgedClient:
+    # Sends a duplicate request once the primary exceeds the phase's latency percentile;
+    # the first response that parses as JSON wins and the other request is cancelled.
+    def __init__(self, primary: Any, secondary: Any, delay_seconds: float, phase: str, stats: HedgeStats):
+        self.primary = primary
+        self.secondary = secondary
+        self.delay_seconds = delay_seconds
+        self.phase = phase
+        self.stats = stats
+        # Both legs may add to the same usage totals: a hedge really does spend both requests' tokens.
+        self.reports_usage = bool(getattr(primary, "reports_usage", False) or getattr(secondary, "reports_usage", False))
+        self.supports_history = bool(getattr(primary, "supports_history", False) and getattr(secondary, "supports_history", False))
+
+    def complete(self, **kwargs: Any) -> str:
+        self.stats.record(self.phase, "calls")
+        results: queue.Queue[tuple[int, str | None, OrchestratorError | None]] = queue.Queue()
+        cancel_events: list[threading.Event] = []
+
+        def start_leg(client: Any) -> None:
+            leg = len(cancel_events)
+            cancel_event = threading.Event()
+            cancel_events.append(cancel_event)
+            leg_kwargs = dict(kwargs)
+            if not getattr(client, "reports_usage", False):
+                leg_kwargs.pop("usage", None)
+            if getattr(client, "supports_cancel", False):
+                leg_kwargs["cancel_event"] = cancel_event
+
+            def call() -> None:
+                try:
+                    results.put((leg, client.complete(**leg_kwargs), None))
+                except OrchestratorError as exc:
+                    results.put((leg, None, exc))
+                except Exception as exc:
+                    results.put((leg, None, OrchestratorError(f"{type(exc).__name__}: {exc}")))
+
+            threading.Thread(target=call, name=f"hedge-{self.phase}-{leg}", daemon=True).start()
+
+        start_leg(self.primary)
+        try:
+            first = results.get(timeout=self.delay_seconds)
+        except queue.Empty:
+            first = None
+        if first is not None:
+            # Answered before the hedge deadline: behave exactly like an unhedged call.
+            _, raw, error = first
+            if error is not None:
+                raise error
+            return raw or ""
+
+        self.stats.record(self.phase, "hedged")
+        start_leg(self.secondary)
+        fallback: tuple[int, str | None, OrchestratorError | None] | None = None
+        finished: set[int] = set()
+        for _ in range(2):
+            leg, raw, error = results.get()
+            finished.add(leg)
+            if raw is not None and is_json_object(raw):
+                for index, cancel_event in enumerate(cancel_events):
+                    if index not in finished:
+                        cancel_event.set()
+                        self.stats.record(self.phase, "cancelled")
+                if leg == 1:
+                    self.stats.record(self.phase, "secondary_won")
+                return raw
+            fallback = fallback or (leg, raw, error)
+        assert fallback is not None
+        _, raw, error = fallback
+        if raw is not None:
+            return raw
+        raise error or OrchestratorError("Hedged request failed without a response.")
+
+
+def is_json_object(text: str) -> bool:
+    try:
+        extract_json_object(text)
+    except OrchestratorError:
+        return False
+    return True
+
+
+# Routed (non-default) clients are process-wide so the `serve` daemon keeps them warm across jobs.
+_ROUTED_CLIENTS: dict[tuple[str, str, str, str], Any] = {}
+
+
+class ModelRouter:
+    def __init__(self, spec: Spec, default_client: Any, stats: PhaseStats):
+        self.spec = spec
+        self.default_client = default_client
+        self.stats = stats
+        self.hedge_stats = HedgeStats()
+        self.usage: dict[str, dict[str, int]] = {}
+        self.calls: dict[str, int] = {}
+        self.routes_used: dict[str, dict[str, int]] = {}
+        self.last_key: dict[str, str] = {}
+
+    def route(self, phase: str) -> tuple[str, str]:
+        override = self.spec.phase_models.get(phase)
+        primary = (override.backend, override.model) if override else (self.spec.model_backend, self.spec.model)
+        auto = self.spec.auto_route
+        if auto is None or phase not in auto.phases:
+            return primary
+        fast = (auto.fast_backend, auto.fast_model)
+        rate, samples = self.stats.pass_rate(PhaseStats.key(phase, *fast))
+        # Stay on the fast model while it performs; re-probe it periodically after falling back.
+        if samples < auto.min_samples or rate >= auto.min_pass_rate or self.calls.get(phase, 0) % auto.probe_every == 0:
+            return fast
+        return primary
+
+    def client(self, phase: str) -> PhaseClient:
+        backend, model = self.route(phase)
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        inner = self._client_for(backend, model)
+        hedging = self.spec.hedging
+        if hedging is not None and phase in hedging.phases:
+            delay = self.hedge_delay(phase, hedging)
+            if delay is not None:
+                secondary = self._client_for(
+                    hedging.secondary_backend or backend,
+                    hedging.secondary_model or model,
+                )
+                inner = HedgedClient(inner, secondary, delay, phase, self.hedge_stats)
+        key = PhaseStats.key(phase, backend, model)
+        self.last_key[phase] = key
+        used = self.routes_used.setdefault(phase, {})
+        used[f"{backend}/{model}"] = used.get(f"{backend}/{model}", 0) + 1
+        return PhaseClient(inner, phase, key, self.stats, self.usage.setdefault(phase, {}))
+
+    def _client_for(self, backend: str, model: str) -> Any:
+        if (backend, model) == (self.spec.model_backend, self.spec.model):
+            return self.default_client
+        cache_key = (backend, model, self.spec.api_base_url, str(self.spec.working_directory))
+        client = _ROUTED_CLIENTS.get(cache_key)
+        if client is None:
+            client = create_client(self.spec, backend=backend, model=model)
+            _ROUTED_CLIENTS[cache_key] = client
+        return client
+
+    def hedge_delay(self, phase: str, hedging: HedgeConfig) -> float | None:
+        # No hedging until the phase has enough latency history to estimate its tail.
+        latencies = sorted(self.stats.latencies(phase))
+        if len(latencies) < hedging.min_samples:
+            return None
+        return max(hedging.min_delay_seconds, percentile(latencies, hedging.percentile) or 0.0)
+
+    def record_outcome(self, phase: str, passed: bool) -> None:
+        key = self.last_key.get(phase)
+        if key is not None:
+            self.stats.record_outcome(key, passed)
+
+
+def output_token_budget(spec: Spec, phase: str, expected_chars: int) -> int:
+    # Size max_tokens from the expected output; continuation covers underestimates.
+    estimate = int(expected_chars / CHARS_PER_TOKEN * OUTPUT_BUDGET_HEADROOM) + 256
+    return max(MIN_OUTPUT_TOKENS[phase], min(estimate, spec.max_output_tokens))
+
+
+def expected_implementation_chars(cwd: Path, files_to_edit: list[str], files_to_create: list[str]) -> int:
+    total = NEW_FILE_EXPECTED_CHARS * len(files_to_create)
+    for rel in files_to_edit:
+        try:
+            size = (cwd / rel).stat().st_size
+        except OSError:
+            continue
+        # Windowed files are edited with replace_lines, so only a window's worth comes back.
+        total += min(size, MAX_FILE_CHARS)
+    return total
+
+
 def build_plan(
     *,
     client: OpenAIChatClient,
@@ -474,31 +1882,10 @@ def build_plan(
         "You are a principal engineer planning a large implementation into testable slices. "
         "Return strict JSON only. No markdown fences."
     )
-    user_prompt = textwrap.dedent(
+    instructions = textwrap.dedent(
         f"""
         Build a sequential implementation plan for this software goal.
 
-        Goal:
-        {spec.goal}
-
-        Constraints:
-        {json.dumps(spec.constraints, ensure_ascii=False)}
-
-        Global acceptance criteria:
-        {json.dumps(spec.acceptance_criteria, ensure_ascii=False)}
-
-        Global check commands that run after each slice:
-        {json.dumps(spec.check_commands, ensure_ascii=False)}
-
-        Repository files (truncated):
-        {json.dumps(repo_files, ensure_ascii=False)}
-
-        Additional context files:
-        {context_text or "[none]"}
-
-        Planner notes:
-        {spec.planner_notes or "[none]"}
-
         Return this JSON shape exactly:
         {{
           "slices": [
@@ -520,12 +1907,43 @@ def build_plan(
         - Do not include exploratory or documentation-only slices unless needed for implementation.
         - Use concrete acceptance criteria, not vague language.
         """
-    ).strip()
-    raw = client.complete(system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=4500)
+    )
+    listing_title = f"Repository files ({len(repo_files)})"
+    if len(repo_files) > MAX_REPO_FILES:
+        listing_title = f"Repository files ({len(repo_files)}, as a directory tree with file counts; … marks collapsed directories)"
+    user_prompt = assemble_prompt(
+        static=[
+            instructions,
+            prompt_section("Goal", spec.goal),
+            prompt_section("Constraints", spec.constraints),
+            prompt_section("Global acceptance criteria", spec.acceptance_criteria),
+            prompt_section("Global check commands that run after each slice", spec.check_commands),
+            prompt_section(listing_title, repository_listing(spec.working_directory, repo_files)),
+            prompt_section("Additional context files", context_text),
+            prompt_section("Planner notes", spec.planner_notes),
+        ],
+    )
+    raw = client.complete(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_tokens=output_token_budget(spec, "plan", 700 * spec.max_slices),
+    )
+    logger.write_text("01-plan/raw_response.txt", raw)
+    payload = extract_json_object(raw)
+    logger.write_json("01-plan/parsed_plan.json", payload)
+    return parse_plan(payload, spec)
+
+
+def shared_plan(plan_dir: Path, spec: Spec, logger: RunLogger) -> list[SlicePlan]:
+    # A plan made once for a fan-out; copied into the run so `replay` still finds it.
+    raw = (plan_dir / "01-plan" / "raw_response.txt").read_text(encoding="utf-8")
     logger.write_text("01-plan/raw_response.txt", raw)
     payload = extract_json_object(raw)
     logger.write_json("01-plan/parsed_plan.json", payload)
+    return parse_plan(payload, spec)
+
 
+def parse_plan(payload: dict[str, Any], spec: Spec) -> list[SlicePlan]:
     slices_raw = payload.get("slices")
     if not isinstance(slices_raw, list) or not slices_raw:
         raise OrchestratorError("Planner returned no slices.")
@@ -573,38 +1991,54 @@ def choose_files_for_slice(
     repo_files: list[str],
     logger: RunLogger,
     slice_dir: str,
-) -> tuple[list[str], list[str]]:
+) -> tuple[list[str], list[str], list[str] | None]:
+    known_files = set(repo_files)
+    candidate_files = repo_files
+    two_stage = len(repo_files) > MAX_REPO_FILES
+    if two_stage:
+        # Two stages: pick directories from the manifest, then files from those directories.
+        candidate_files = choose_directories_for_slice(
+            client=client,
+            spec=spec,
+            slice_plan=slice_plan,
+            manifest=repo_manifest(spec.working_directory, repo_files),
+            logger=logger,
+            slice_dir=slice_dir,
+        )
     system_prompt = (
         "You are selecting files required to implement one software slice. "
         "Return strict JSON only."
     )
-    user_prompt = textwrap.dedent(
+    instructions = textwrap.dedent(
         f"""
-        Select files for this slice.
-
-        Slice ID: {slice_plan.id}
-        Title: {slice_plan.title}
-        Objective: {slice_plan.objective}
-        Acceptance: {json.dumps(slice_plan.acceptance, ensure_ascii=False)}
-        File hints from planner: {json.dumps(slice_plan.files_hint, ensure_ascii=False)}
-
-        Repository files:
-        {json.dumps(repo_files, ensure_ascii=False)}
+        Select files for one slice.
 
         Return JSON:
         {{
           "files_to_read": ["existing file paths only"],
-          "files_to_create": ["new file paths if needed"]
+          "files_to_create": ["new file paths if needed"],
+          "files_to_modify": ["subset of files_to_read that will be edited"]
         }}
 
         Rules:
         - Choose at most {spec.max_files_per_slice} files_to_read.
+        - files_to_read that are only needed for reference (types, call sites, patterns) must not be in files_to_modify.
         - Keep file set minimal.
         - Prefer explicit existing files from repository list.
         - Use repository-relative paths.
         """
-    ).strip()
-    raw = client.complete(system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=1200)
+    )
+    listing = prompt_section("Repository files (from the selected directories)", candidate_files)
+    user_prompt = assemble_prompt(
+        # The full list is the same for every slice; the two-stage candidates are per slice.
+        static=[instructions, "" if two_stage else prompt_section("Repository files", candidate_files)],
+        per_slice=[slice_prompt_section(slice_plan), listing if two_stage else ""],
+    )
+    raw = client.complete(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_tokens=output_token_budget(spec, "select", 150 * (spec.max_files_per_slice + len(slice_plan.files_hint))),
+    )
     logger.write_text(f"{slice_dir}/01-file-selection/raw_response.txt", raw)
     payload = extract_json_object(raw)
     logger.write_json(f"{slice_dir}/01-file-selection/parsed_selection.json", payload)
@@ -615,7 +2049,7 @@ def choose_files_for_slice(
             safe = normalize_rel_path(path)
         except OrchestratorError:
             continue
-        if safe in repo_files:
+        if safe in known_files:
             files_to_read.append(safe)
 
     files_to_create = []
@@ -632,12 +2066,102 @@ def choose_files_for_slice(
             safe_hint = normalize_rel_path(hint)
         except OrchestratorError:
             continue
-        if safe_hint in repo_files and safe_hint not in files_to_read:
+        if safe_hint in known_files and safe_hint not in files_to_read:
             files_to_read.append(safe_hint)
 
     files_to_read = files_to_read[: spec.max_files_per_slice]
     files_to_create = dedupe(files_to_create)
-    return files_to_read, files_to_create
+
+    # None means "unknown": the caller then sends full content for every selected file.
+    files_to_modify: list[str] | None = None
+    if isinstance(payload.get("files_to_modify"), list):
+        files_to_modify = []
+        for path in [*ensure_str_array(payload["files_to_modify"]), *slice_plan.files_hint]:
+            try:
+                safe = normalize_rel_path(path)
+            except OrchestratorError:
+                continue
+            if safe in files_to_read and safe not in files_to_modify:
+                files_to_modify.append(safe)
+    return files_to_read, files_to_create, files_to_modify
+
+
+def choose_directories_for_slice(
+    *,
+    client: OpenAIChatClient,
+    spec: Spec,
+    slice_plan: SlicePlan,
+    manifest: RepoManifest,
+    logger: RunLogger,
+    slice_dir: str,
+) -> list[str]:
+    system_prompt = (
+        "You are selecting directories relevant to one software slice in a large repository. "
+        "Return strict JSON only."
+    )
+    instructions = textwrap.dedent(
+        f"""
+        Select the directories that contain the files one slice needs to read or change.
+
+        Return JSON:
+        {{
+          "directories": ["repository-relative directory paths"]
+        }}
+
+        Rules:
+        - Choose at most {MAX_SELECTED_DIRECTORIES} directories, as deep as possible.
+        - Collapsed directories may be chosen; all files below a chosen directory are listed next.
+        """
+    )
+    user_prompt = assemble_prompt(
+        static=[
+            instructions,
+            prompt_section("Repository tree (file counts and sizes; … marks collapsed directories)", manifest.render()),
+        ],
+        per_slice=[slice_prompt_section(slice_plan)],
+    )
+    raw = client.complete(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_tokens=output_token_budget(spec, "select", 100 * MAX_SELECTED_DIRECTORIES),
+    )
+    logger.write_text(f"{slice_dir}/01-file-selection/raw_directory_response.txt", raw)
+    try:
+        payload = extract_json_object(raw)
+    except OrchestratorError:
+        payload = {}
+    directories = []
+    for path in [*ensure_str_array(payload.get("directories", [])), *(hint.rsplit("/", 1)[0] for hint in slice_plan.files_hint if "/" in hint)]:
+        directory = path.strip().strip("/")
+        if directory.startswith("./"):
+            directory = directory[2:]
+        if directory and directory in manifest.counts and directory not in directories:
+            directories.append(directory)
+    directories = directories[: MAX_SELECTED_DIRECTORIES + len(slice_plan.files_hint)]
+    logger.write_json(f"{slice_dir}/01-file-selection/selected_directories.json", directories)
+
+    hints = [hint for hint in slice_plan.files_hint if hint in manifest.file_set]
+    candidates = dedupe([*hints, *manifest.files_under(directories)])
+    if len(candidates) > MAX_REPO_FILES:
+        # Prefer shallow files: a deep subtree is less likely to matter than its entry points.
+        candidates = [*hints, *sorted(candidates[len(hints):], key=lambda path: (path.count("/"), path))]
+        candidates = sorted(dedupe(candidates)[:MAX_REPO_FILES])
+    return candidates
+
+
+def slice_prompt_section(slice_plan: SlicePlan) -> str:
+    return prompt_section(
+        "Slice",
+        "\n".join(
+            [
+                f"- id: {slice_plan.id}",
+                f"- title: {slice_plan.title}",
+                f"- objective: {slice_plan.objective}",
+                f"- acceptance: {stable_json(slice_plan.acceptance)}",
+                f"- file hints from planner: {stable_json(slice_plan.files_hint)}",
+            ]
+        ),
+    )
 
 
 def dedupe(values: list[str]) -> list[str]:
@@ -651,22 +2175,356 @@ def dedupe(values: list[str]) -> list[str]:
     return out
 
 
-def load_file_context(cwd: Path, files: list[str]) -> str:
+OUTLINE_PATTERNS: list[tuple[str, re.Pattern[str]]] = [
+    ("function", re.compile(r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?function\*?\s+(\w+)")),
+    ("class", re.compile(r"^(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+(\w+)")),
+    ("interface", re.compile(r"^(?:export\s+)?interface\s+(\w+)")),
+    ("type", re.compile(r"^(?:export\s+)?type\s+(\w+)")),
+    ("enum", re.compile(r"^(?:export\s+)?(?:const\s+)?enum\s+(\w+)")),
+    ("const", re.compile(r"^(?:export\s+)?(?:const|let|var)\s+(\w+)")),
+    ("export", re.compile(r"^export\s+(?:default\s+)?\{?\s*(\w+)")),
+    ("def", re.compile(r"^(?:async\s+)?def\s+(\w+)")),
+    ("method", re.compile(r"^\s{2,4}(?:async\s+)?def\s+(\w+)")),
+    ("class", re.compile(r"^class\s+(\w+)")),
+]
+IMPORT_PATTERN = re.compile(
+    r"""^(?:import\s+(?:type\s+)?(?:[\w*\s,]*\{[^}]*\}|[\w*\s,]+?)\s*from\s+["']([^"']+)["']"""
+    r"""|import\s+["']([^"']+)["']|from\s+([\w.]+)\s+import\b|import\s+([\w.]+)(?:\s+as\s+\w+)?$)""",
+    re.MULTILINE,
+)
+
+
+def split_text_lines(text: str, keepends: bool = False) -> list[str]:
+    # Lines end at "\n" only, as in git and editors. str.splitlines also breaks on \f, \v, \x85
+    # and U+2028/U+2029, which would shift every line number shown to the model after them.
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    if keepends:
+        last = len(lines) - 1
+        lines = [line + "\n" if index < last or text.endswith("\n") else line for index, line in enumerate(lines)]
+    return lines
+
+
+def extract_outline(text: str) -> list[dict[str, Any]]:
+    entries: list[dict[str, Any]] = []
+    for line_number, line in enumerate(split_text_lines(text), start=1):
+        if not line or line[0] in " \t}])" and not line.startswith(("  def ", "    def ", "  async def ", "    async def ")):
+            continue
+        for kind, pattern in OUTLINE_PATTERNS:
+            match = pattern.match(line)
+            if match:
+                signature = line.rstrip().rstrip("{").rstrip()
+                if len(signature) > 160:
+                    signature = signature[:157] + "..."
+                entries.append({"line": line_number, "kind": kind, "name": match.group(1), "signature": signature})
+                break
+    return entries
+
+
+def summarize_file_text(rel: str, text: str) -> str:
+    imports = [next(group for group in match.groups() if group) for match in IMPORT_PATTERN.finditer(text)]
+    outline = extract_outline(text)
+    lines = [f"{len(split_text_lines(text))} lines, {len(text)} chars."]
+    if imports:
+        lines.append("Imports: " + ", ".join(dedupe(imports)))
+    if outline:
+        lines.append("Outline (line: declaration):")
+        lines.extend(f"  {entry['line']}: {entry['signature']}" for entry in outline[:SUMMARY_MAX_OUTLINE_ENTRIES])
+        if len(outline) > SUMMARY_MAX_OUTLINE_ENTRIES:
+            lines.append(f"  ... {len(outline) - SUMMARY_MAX_OUTLINE_ENTRIES} more declarations")
+    else:
+        lines.append("No top-level declarations found.")
+    return "\n".join(lines)
+
+
+def git_blob_hashes(cwd: Path, paths: list[str]) -> dict[str, str]:
+    existing = [path for path in paths if (cwd / path).is_file()]
+    if not existing:
+        return {}
+    completed = subprocess.run(
+        ["git", "hash-object", "--stdin-paths"],
+        cwd=str(cwd),
+        input="\n".join(existing) + "\n",
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    hashes = completed.stdout.split()
+    if completed.returncode != 0 or len(hashes) != len(existing):
+        return {}
+    return dict(zip(existing, hashes))
+
+
+class SummaryCache:
+    # Compact file outlines keyed by git blob hash, shared across slices, attempts and runs.
+    def __init__(self, cwd: Path):
+        self.cwd = cwd
+        self.root = cwd / SUMMARY_CACHE_DIR
+        self.hits = 0
+        self.misses = 0
+
+    def summaries(self, paths: list[str]) -> dict[str, str]:
+        out: dict[str, str] = {}
+        for path, blob in git_blob_hashes(self.cwd, paths).items():
+            target = self.root / blob[:2] / f"{blob}-v{SUMMARY_FORMAT_VERSION}.txt"
+            if target.exists():
+                self.hits += 1
+                out[path] = target.read_text(encoding="utf-8")
+                continue
+            self.misses += 1
+            try:
+                text = FILE_CACHE.read_text(self.cwd / path)
+            except UnicodeDecodeError:
+                continue
+            summary = summarize_file_text(path, text)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(summary, encoding="utf-8")
+            out[path] = summary
+        return out
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def build_file_symbols(rel: str, path: Path) -> list[dict[str, Any]]:
+    if path.stat().st_size == 0:
+        return []
+    with path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        # Byte offsets and line numbers both count "\n" only, read straight from the mapping.
+        line_offsets = [0, *(match.end() for match in re.finditer(rb"\n", mapped))]
+        if line_offsets[-1] != len(mapped):
+            line_offsets.append(len(mapped))
+        text = str(mapped, "utf-8", errors="replace")
+    lines = split_text_lines(text)
+    total_lines = len(lines)
+
+    def region_end(start: int, next_start: int) -> int:
+        end = next_start - 1
+        while end > start and not lines[end - 1].strip():
+            end -= 1
+        return end
+
+    entries = extract_outline(text)
+    top_level = [entry for entry in entries if entry["kind"] != "method"]
+    is_route_file = Path(rel).stem == "route"
+    symbols: list[dict[str, Any]] = []
+    for index, entry in enumerate(top_level):
+        next_start = top_level[index + 1]["line"] if index + 1 < len(top_level) else total_lines + 1
+        kind = entry["kind"]
+        if is_route_file and kind == "function" and entry["name"] in HTTP_ROUTE_METHODS:
+            kind = "route"
+        symbols.append(
+            {
+                "name": entry["name"],
+                "kind": kind,
+                "exported": entry["signature"].startswith("export"),
+                "line": entry["line"],
+                "end_line": region_end(entry["line"], next_start),
+            }
+        )
+    methods = [entry for entry in entries if entry["kind"] == "method"]
+    for index, entry in enumerate(methods):
+        parent = next((item for item in symbols if item["line"] < entry["line"] <= item["end_line"]), None)
+        if parent is None:
+            continue
+        next_start = methods[index + 1]["line"] if index + 1 < len(methods) else parent["end_line"] + 1
+        symbols.append(
+            {
+                "name": f"{parent['name']}.{entry['name']}",
+                "kind": "method",
+                "exported": parent["exported"],
+                "line": entry["line"],
+                "end_line": region_end(entry["line"], min(next_start, parent["end_line"] + 1)),
+            }
+        )
+    for symbol in symbols:
+        symbol["start_byte"] = line_offsets[symbol["line"] - 1]
+        symbol["end_byte"] = line_offsets[min(symbol["end_line"], total_lines)]
+    return sorted(symbols, key=lambda item: (item["line"], item["kind"] == "method"))
+
+
+class OutlineIndex:
+    # Persistent symbol index (functions, classes, exports, routes) with line and byte ranges,
+    # refreshed per file when its (mtime_ns, size) changes.
+    def __init__(self, cwd: Path):
+        self.cwd = cwd
+        self.path = cwd / OUTLINE_INDEX_FILE
+        self.files: dict[str, dict[str, Any]] = {}
+        self.dirty = False
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+            if payload.get("version") == OUTLINE_INDEX_VERSION and isinstance(payload.get("files"), dict):
+                self.files = payload["files"]
+        except (OSError, json.JSONDecodeError, AttributeError):
+            pass
+
+    def symbols(self, rel: str) -> list[dict[str, Any]]:
+        path = self.cwd / rel
+        if path.suffix not in OUTLINE_INDEXED_SUFFIXES:
+            return []
+        try:
+            stat = path.stat()
+        except OSError:
+            self.files.pop(rel, None)
+            return []
+        entry = self.files.get(rel)
+        if entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            return entry["symbols"]
+        symbols = build_file_symbols(rel, path)
+        self.files[rel] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "symbols": symbols}
+        self.dirty = True
+        return symbols
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"version": OUTLINE_INDEX_VERSION, "files": self.files}
+        self.path.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+        self.dirty = False
+
+
+_OUTLINE_INDEXES: dict[Path, OutlineIndex] = {}
+
+
+def outline_index_for(cwd: Path) -> OutlineIndex:
+    index = _OUTLINE_INDEXES.get(cwd)
+    if index is None:
+        index = OutlineIndex(cwd)
+        _OUTLINE_INDEXES[cwd] = index
+    return index
+
+
+def focus_terms(text: str) -> set[str]:
+    terms: set[str] = set()
+    for word in re.findall(r"[A-Za-z_][A-Za-z0-9_]{2,}", text):
+        terms.add(word.lower())
+        for part in re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", word):
+            if len(part) > 2:
+                terms.add(part.lower())
+    return terms
+
+
+def symbol_score(symbol: dict[str, Any], terms: set[str]) -> int:
+    name = symbol["name"].split(".")[-1]
+    if name.lower() in terms:
+        return 10
+    parts = {part.lower() for part in re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", name) if len(part) > 2}
+    return len(parts & terms)
+
+
+def windowed_file_excerpt(path: Path, symbols: list[dict[str, Any]], terms: set[str], budget: int) -> str:
+    top_level = [symbol for symbol in symbols if symbol["kind"] != "method"]
+    ranked = sorted(
+        (symbol for symbol in symbols if symbol_score(symbol, terms) > 0),
+        key=lambda symbol: (-symbol_score(symbol, terms), symbol["line"]),
+    )
+    with path.open("rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end = top_level[0]["start_byte"] if top_level else 0
+        header = mapped[: min(header_end, WINDOW_HEADER_MAX_CHARS)].decode("utf-8", errors="replace").rstrip()
+        used = len(header)
+        chosen: list[tuple[dict[str, Any], str]] = []
+        for symbol in ranked:
+            if any(item["line"] <= symbol["line"] and symbol["end_line"] <= item["end_line"] for item, _ in chosen):
+                continue  # Already covered by an enclosing region (e.g. a method inside a chosen class).
+            region = mapped[symbol["start_byte"] : symbol["end_byte"]].decode("utf-8", errors="replace").rstrip()
+            if used + len(region) > budget:
+                continue
+            chosen = [(item, text) for item, text in chosen if not (symbol["line"] <= item["line"] and item["end_line"] <= symbol["end_line"])]
+            chosen.append((symbol, region))
+            used += len(region)
+
+    parts = [
+        "[WINDOWED EXCERPT: file exceeds the context limit; only regions relevant to this slice are shown. "
+        "Edit it with replace_lines using the line anchors below, never with upsert.]"
+    ]
+    if header:
+        parts.append(f"[lines 1-{header.count(chr(10)) + 1}: file header]\n{header}")
+    for symbol, region in sorted(chosen, key=lambda item: item[0]["line"]):
+        parts.append(f"[lines {symbol['line']}-{symbol['end_line']}: {symbol['kind']} {symbol['name']}]\n{region}")
+    shown = {id(symbol) for symbol, _ in chosen}
+    omitted = [symbol for symbol in top_level if id(symbol) not in shown]
+    if omitted:
+        listed = [f"  lines {item['line']}-{item['end_line']}: {item['kind']} {item['name']}" for item in omitted[:WINDOW_MAX_LISTED_SYMBOLS]]
+        if len(omitted) > WINDOW_MAX_LISTED_SYMBOLS:
+            listed.append(f"  ... {len(omitted) - WINDOW_MAX_LISTED_SYMBOLS} more")
+        parts.append("[other symbols, not shown]\n" + "\n".join(listed))
+    return "\n\n".join(parts)
+
+
+def load_file_context(
+    cwd: Path,
+    files: list[str],
+    full_content_files: set[str] | None = None,
+    summary_cache: SummaryCache | None = None,
+    focus_text: str = "",
+    shown_as: dict[str, str] | None = None,
+) -> str:
+    # shown_as (if given) records how each file was sent, so apply_changes can refuse blind writes.
+    shown_as = {} if shown_as is None else shown_as
     if not files:
         return "[no existing files selected]"
+    summarized: dict[str, str] = {}
+    if full_content_files is not None and summary_cache is not None:
+        summarized = summary_cache.summaries(
+            [rel for rel in files if rel not in full_content_files and worth_outlining(cwd / rel)]
+        )
     blocks: list[str] = []
     for rel in files:
         path = cwd / rel
         if not path.exists():
             blocks.append(f"### FILE: {rel}\n[MISSING]")
             continue
-        content = path.read_text(encoding="utf-8")
+        if rel in summarized:
+            shown_as[rel] = "outline"
+            blocks.append(
+                f"### FILE (reference outline only, full content omitted; do not rewrite this file): {rel}\n"
+                f"{summarized[rel]}"
+            )
+            continue
+        excerpt = windowed_excerpt_for(cwd, rel, focus_text)
+        if excerpt is not None:
+            shown_as[rel] = "windowed"
+            blocks.append(f"### FILE: {rel}\n{excerpt}")
+            continue
+        content = FILE_CACHE.read_text(path)
         if len(content) > MAX_FILE_CHARS:
+            shown_as[rel] = "truncated"
             content = content[:MAX_FILE_CHARS] + "\n\n[TRUNCATED]"
         blocks.append(f"### FILE: {rel}\n{content}")
     return "\n\n".join(blocks)
 
 
+def worth_outlining(path: Path) -> bool:
+    # Small files and config/data/docs cost little in full and say little as an outline.
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return False
+    return size >= OUTLINE_MIN_CHARS and path.suffix in OUTLINE_INDEXED_SUFFIXES
+
+
+def windowed_excerpt_for(cwd: Path, rel: str, focus_text: str) -> str | None:
+    # Only oversized, indexable files are windowed; everything else is sent whole (or truncated).
+    path = cwd / rel
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return None
+    if size <= MAX_FILE_CHARS or path.suffix not in OUTLINE_INDEXED_SUFFIXES:
+        return None
+    # Multi-byte text (e.g. Arabic dictionaries) can exceed the byte limit but not the char limit.
+    if size <= 4 * MAX_FILE_CHARS and len(FILE_CACHE.read_text(path)) <= MAX_FILE_CHARS:
+        return None
+    index = outline_index_for(cwd)
+    symbols = index.symbols(rel)
+    index.save()
+    if not symbols:
+        return None
+    return windowed_file_excerpt(path, symbols, focus_terms(focus_text), MAX_FILE_CHARS)
+
+
 def ask_for_changes(
     *,
     client: OpenAIChatClient,
@@ -679,83 +2537,192 @@ def ask_for_changes(
     logger: RunLogger,
     slice_dir: str,
     attempt: int,
+    files_to_edit: list[str] | None = None,
+    conversation: SliceConversation | None = None,
 ) -> dict[str, Any]:
+    if files_to_edit is None:
+        files_to_edit = files_to_read
     system_prompt = (
         "You are implementing a software slice. "
         "Return strict JSON only, no markdown fences. "
         "When updating a file, return the complete final content."
     )
-    user_prompt = textwrap.dedent(
-        f"""
-        Implement this slice.
-
-        Goal:
-        {spec.goal}
-
-        Global constraints:
-        {json.dumps(spec.constraints, ensure_ascii=False)}
-
-        Global acceptance criteria:
-        {json.dumps(spec.acceptance_criteria, ensure_ascii=False)}
-
-        Slice:
-        - id: {slice_plan.id}
-        - title: {slice_plan.title}
-        - objective: {slice_plan.objective}
-        - acceptance: {json.dumps(slice_plan.acceptance, ensure_ascii=False)}
-
-        Files selected to read:
-        {json.dumps(files_to_read, ensure_ascii=False)}
-
-        Candidate files to create:
-        {json.dumps(files_to_create, ensure_ascii=False)}
-
-        Current file context:
-        {file_context}
-
-        Feedback from previous attempt (if any):
-        {feedback or "[none]"}
-
-        Implementer notes:
-        {spec.implementer_notes or "[none]"}
+    instructions = textwrap.dedent(
+        """
+        Implement one slice.
 
         Return JSON exactly with this shape:
-        {{
+        {
           "summary": "short summary",
           "changes": [
-            {{
+            {
               "path": "relative/path.ext",
               "action": "upsert",
               "content": "full file content"
-            }},
-            {{
+            },
+            {
               "path": "relative/path.ext",
               "action": "delete"
-            }}
+            },
+            {
+              "path": "relative/path.ext",
+              "action": "replace_lines",
+              "start_line": 10,
+              "end_line": 20,
+              "content": "replacement text for lines 10-20 inclusive"
+            }
           ]
-        }}
+        }
 
         Rules:
+        - Use replace_lines only for files shown as WINDOWED EXCERPT, with line numbers from their anchors.
         - Return only files needed for this slice.
         - Keep untouched files out of changes.
         - Use repository-relative paths only.
         - Do not include partial diffs.
         - Keep existing behavior unless required by the slice objective.
         """
-    ).strip()
-    raw = client.complete(system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=7000)
+    )
+    user_prompt = assemble_prompt(
+        static=[
+            instructions,
+            prompt_section("Goal", spec.goal),
+            prompt_section("Global constraints", spec.constraints),
+            prompt_section("Global acceptance criteria", spec.acceptance_criteria),
+            prompt_section("Implementer notes", spec.implementer_notes),
+        ],
+        per_slice=[
+            slice_prompt_section(slice_plan),
+            prompt_section("Files selected to read", files_to_read),
+            prompt_section("Candidate files to create", files_to_create),
+        ],
+        per_attempt=[
+            prompt_section("Current file context", file_context),
+            prompt_section("Feedback from previous attempt (if any)", feedback),
+        ],
+    )
+    history: list[dict[str, str]] = []
+    conversation_paths = sorted({*files_to_read, *files_to_create, *files_to_edit})
+    if conversation is not None and conversation.active:
+        # Retry turn: the full context is already in the conversation.
+        history = list(conversation.messages)
+        user_prompt = assemble_prompt(
+            static=[],
+            per_attempt=[
+                "Your previous changes were applied. The files below changed since your last response "
+                "(unified diffs against the content you last saw); all other files are as before.",
+                prompt_section("Changes since your last response", conversation.changes_since_last_turn(conversation_paths)),
+                prompt_section("Feedback from previous attempt", feedback),
+                "Return the same JSON shape with the changes still needed for this slice. "
+                "Line numbers for replace_lines refer to the current file content shown in the diffs.",
+            ],
+        )
+    expected_chars = expected_implementation_chars(spec.working_directory, files_to_edit, files_to_create)
+    extra: dict[str, Any] = {"history": history} if history else {}
+    raw = client.complete(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_tokens=output_token_budget(spec, "implement", expected_chars),
+        **extra,
+    )
+    if conversation is not None:
+        request_chars = len(system_prompt) + len(user_prompt) + sum(len(message["content"]) for message in history)
+        conversation.record(user_prompt, raw, conversation_paths, request_chars)
     logger.write_text(f"{slice_dir}/02-attempt-{attempt}/raw_implementer_response.txt", raw)
     payload = extract_json_object(raw)
     logger.write_json(f"{slice_dir}/02-attempt-{attempt}/parsed_implementer_response.json", payload)
     return payload
 
 
-def apply_changes(cwd: Path, changes_payload: dict[str, Any]) -> list[str]:
+def read_optional_text(path: Path) -> str | None:
+    try:
+        return FILE_CACHE.read_text(path)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def compact_response(raw: str) -> str:
+    # Earlier responses stay in the history only as a stub: the snapshots are taken before the
+    # changes are applied, so the next turn's diffs already show their full effect on disk.
+    try:
+        payload = extract_json_object(raw)
+    except OrchestratorError:
+        return "[Previous response could not be parsed; no changes were applied from it.]"
+    changes = payload.get("changes") if isinstance(payload.get("changes"), list) else []
+    paths = dedupe([str(change.get("path")) for change in changes if isinstance(change, dict) and change.get("path")])
+    return stable_json(
+        {
+            "summary": payload.get("summary", ""),
+            "changes": f"[omitted; {len(changes)} change(s) to {', '.join(paths) or 'no files'}, shown as diffs in the next message]",
+        }
+    )
+
+
+class SliceConversation:
+    # Implementer conversation for one slice: the first attempt sends the full context, later
+    # attempts only feedback plus what changed on disk since the previous turn.
+    def __init__(self, cwd: Path):
+        self.cwd = cwd
+        self.messages: list[dict[str, str]] = []
+        self.snapshots: dict[str, str | None] = {}
+        self.last_prompt_chars = 0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.messages)
+
+    def changes_since_last_turn(self, paths: list[str]) -> str:
+        sections: list[str] = []
+        for path in sorted(set(self.snapshots) | set(paths)):
+            before = self.snapshots.get(path)
+            after = read_optional_text(self.cwd / path)
+            if before == after:
+                continue
+            if after is None:
+                sections.append(f"### DELETED: {path}")
+            elif before is None:
+                sections.append(f"### NEW FILE: {path}\n{after}")
+            else:
+                diff = difflib.unified_diff(
+                    split_text_lines(before, keepends=True),
+                    split_text_lines(after, keepends=True),
+                    fromfile=f"a/{path}",
+                    tofile=f"b/{path}",
+                )
+                sections.append(f"### DIFF: {path}\n{''.join(diff)}")
+        return "\n\n".join(sections) or "[no file changes since your last response]"
+
+    def record(self, user_prompt: str, raw: str, paths: list[str], request_chars: int) -> None:
+        # request_chars is everything sent for this turn: system prompt, history and new prompt.
+        self.last_prompt_chars = request_chars
+        self.messages += [{"role": "user", "content": user_prompt}, {"role": "assistant", "content": compact_response(raw)}]
+        for path in set(self.snapshots) | set(paths):
+            self.snapshots[path] = read_optional_text(self.cwd / path)
+        if sum(len(message["content"]) for message in self.messages) > MAX_CONVERSATION_CHARS:
+            # Too long to keep resending: the next attempt starts over with a full prompt.
+            self.messages = []
+            self.snapshots = {}
+
+
+def apply_changes(cwd: Path, changes_payload: dict[str, Any], shown_as: dict[str, str] | None = None) -> list[str]:
     changes = changes_payload.get("changes")
     if not isinstance(changes, list):
         raise OrchestratorError("Implementer response missing 'changes' array.")
+    # Checked before any write so a rejected change never leaves the attempt half-applied.
+    for change in changes:
+        if isinstance(change, dict) and isinstance(change.get("path"), str):
+            rel_path = normalize_rel_path(change["path"])
+            view = (shown_as or {}).get(rel_path)
+            if view == "outline":
+                raise ChangeRefused(rel_path, view, f"Refusing to change {rel_path}: it was only shown as an outline")
+            # An upsert would replace the whole file with the part the model saw.
+            if view in {"windowed", "truncated"} and str(change.get("action", "")).strip().lower() == "upsert":
+                raise ChangeRefused(
+                    rel_path, view, f"Refusing to upsert {rel_path}: it was only shown {view}; use replace_lines"
+                )
 
     touched: list[str] = []
+    line_edits: dict[str, list[tuple[int, int, str]]] = {}
     for change in changes:
         if not isinstance(change, dict):
             continue
@@ -766,6 +2733,7 @@ def apply_changes(cwd: Path, changes_payload: dict[str, Any]) -> list[str]:
         rel_path = normalize_rel_path(path_value)
         action = action_value.strip().lower()
         target = cwd / rel_path
+        FILE_CACHE.invalidate(target)
         if action == "upsert":
             content = change.get("content")
             if not isinstance(content, str):
@@ -779,24 +2747,935 @@ def apply_changes(cwd: Path, changes_payload: dict[str, Any]) -> list[str]:
                     raise OrchestratorError(f"Refusing to delete directory path: {rel_path}")
                 target.unlink()
             touched.append(rel_path)
+        elif action == "replace_lines":
+            start_line, end_line, content = change.get("start_line"), change.get("end_line"), change.get("content")
+            if not isinstance(start_line, int) or not isinstance(end_line, int) or not isinstance(content, str):
+                raise OrchestratorError(f"replace_lines on {rel_path} needs integer start_line/end_line and content")
+            line_edits.setdefault(rel_path, []).append((start_line, end_line, content))
+            touched.append(rel_path)
         else:
             raise OrchestratorError(f"Unknown change action '{action}' for {rel_path}")
+
+    for rel_path, edits in line_edits.items():
+        apply_line_edits(cwd / rel_path, rel_path, edits)
+        FILE_CACHE.invalidate(cwd / rel_path)
     return dedupe(touched)
 
 
-def run_checks(commands: list[str], cwd: Path, timeout_seconds: int, logger: RunLogger, log_prefix: str) -> list[CheckResult]:
+def snapshot_changed_files(cwd: Path, changes_payload: dict[str, Any]) -> dict[str, bytes | None]:
+    # Content of every file an attempt names, taken before and after apply_changes so a
+    # rewrite with identical content is told apart from a real edit. None means missing.
+    snapshot: dict[str, bytes | None] = {}
+    changes = changes_payload.get("changes")
+    for change in changes if isinstance(changes, list) else []:
+        if not isinstance(change, dict) or not isinstance(change.get("path"), str):
+            continue
+        try:
+            rel_path = normalize_rel_path(change["path"])
+        except OrchestratorError:
+            continue
+        target = cwd / rel_path
+        snapshot[rel_path] = target.read_bytes() if target.is_file() else None
+    return snapshot
+
+
+def apply_line_edits(target: Path, rel_path: str, edits: list[tuple[int, int, str]]) -> None:
+    # Line numbers refer to the file as shown to the model, so apply bottom-up.
+    if not target.is_file():
+        raise OrchestratorError(f"replace_lines target does not exist: {rel_path}")
+    lines = split_text_lines(target.read_text(encoding="utf-8"), keepends=True)
+    previous_start = len(lines) + 1
+    for start_line, end_line, content in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        if start_line < 1 or end_line < start_line - 1 or end_line > len(lines) or end_line >= previous_start:
+            raise OrchestratorError(f"Invalid or overlapping replace_lines range {start_line}-{end_line} for {rel_path}")
+        replacement = split_text_lines(content, keepends=True)
+        if replacement and not replacement[-1].endswith("\n") and end_line < len(lines):
+            replacement[-1] += "\n"
+        lines[start_line - 1 : end_line] = replacement
+        previous_start = start_line
+    target.write_text("".join(lines), encoding="utf-8")
+
+
+def run_checks(
+    commands: list[str],
+    cwd: Path,
+    timeout_seconds: int,
+    logger: RunLogger,
+    log_prefix: str,
+    sharded_checks: dict[str, ShardConfig] | None = None,
+    flaky: FlakyTracker | None = None,
+    scheduler: CheckScheduler | None = None,
+    warm_checks: dict[str, WarmCheckConfig] | None = None,
+    changed_paths: list[str] | None = None,
+    changed_since: float | None = None,
+) -> list[CheckResult]:
     results: list[CheckResult] = []
+    input_hash: str | None = None
     for index, command in enumerate(commands, start=1):
-        exit_code, output = run_cmd(command, cwd=cwd, timeout_seconds=timeout_seconds)
+        first_record = len(scheduler.records) if scheduler is not None else 0
+        shard_config = (sharded_checks or {}).get(command)
+        warm_config = (warm_checks or {}).get(command)
+        warm_result = None
+        if warm_config is not None:
+            warm_started = time.perf_counter()
+            warm_result = run_warm_check(command, warm_config, cwd, changed_paths, changed_since)
+        if warm_result is not None:
+            exit_code, output = warm_result
+        elif shard_config is not None:
+            exit_code, output = run_sharded_check(
+                command,
+                shard_config,
+                cwd=cwd,
+                timeout_seconds=timeout_seconds,
+                logger=logger,
+                log_prefix=f"{log_prefix}/check-{index:02d}-shards",
+                scheduler=scheduler,
+            )
+        else:
+            exit_code, output = run_check_command(command, cwd, timeout_seconds, scheduler)
         result = CheckResult(command=command, exit_code=exit_code, output=output)
+        if flaky is not None:
+            if input_hash is None:
+                input_hash = working_tree_hash(cwd)
+            result = recheck_failed(
+                result,
+                flaky,
+                input_hash,
+                cwd=cwd,
+                timeout_seconds=timeout_seconds,
+                scheduler=scheduler,
+            )
+        if scheduler is not None:
+            # Shards and reruns of this check each left a record; report them as one.
+            result.usage = merge_usage(scheduler.records[first_record:])
+        if warm_result is not None:
+            result.usage = {**result.usage, "warm_worker": True, "warm_wait_seconds": round(time.perf_counter() - warm_started, 3)}
+        usage_lines = "".join(f"{key}={value}\n" for key, value in result.usage.items())
         logger.write_text(
             f"{log_prefix}/check-{index:02d}.txt",
-            f"$ {command}\n\nexit_code={exit_code}\n\n{output}",
+            f"$ {command}\n\nexit_code={result.exit_code}\nreruns={result.reruns}\n"
+            f"flaky_tests={result.flaky_tests}\nquarantined_tests={result.quarantined_tests}\n"
+            f"{usage_lines}\n{result.output}",
         )
         results.append(result)
     return results
 
 
+_WARM_WORKERS: dict[tuple[Path, str], WarmWorker] = {}
+
+
+class WarmWorker:
+    # A long-lived watch-mode process; each completed cycle is delimited by done_pattern.
+    def __init__(self, cwd: Path, config: WarmCheckConfig):
+        self.config = config
+        self.done_pattern = re.compile(config.done_pattern)
+        self.fail_pattern = re.compile(config.fail_pattern)
+        self.condition = threading.Condition()
+        # (started_at, ended_at, passed, output) per completed cycle.
+        self.cycles: list[tuple[float, float, bool, str]] = []
+        self.lines: list[str] = []
+        self.cycle_started_at = time.time()
+        self.last_output_at = time.time()
+        self.last_done_at = 0.0
+        self.process = subprocess.Popen(
+            config.watch_command,
+            cwd=str(cwd),
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            start_new_session=True,
+            env={**os.environ, "NO_COLOR": "1", "FORCE_COLOR": "0"},
+        )
+        threading.Thread(target=self._read, name="warm-worker", daemon=True).start()
+
+    def _read(self) -> None:
+        assert self.process.stdout is not None
+        for raw_line in self.process.stdout:
+            line = ANSI_ESCAPE_PATTERN.sub("", raw_line).replace("\x1bc", "")
+            with self.condition:
+                self.last_output_at = time.time()
+                if not self.lines:
+                    if self.last_output_at - self.last_done_at <= self.config.settle_seconds:
+                        # Trailer printed with the done line (e.g. vitest's key help), not a new cycle.
+                        self.condition.notify_all()
+                        continue
+                    self.cycle_started_at = self.last_output_at
+                self.lines.append(line)
+                if self.done_pattern.search(line):
+                    text = "".join(self.lines).strip()
+                    self.cycles.append((self.cycle_started_at, self.last_output_at, not self.fail_pattern.search(text), text))
+                    del self.cycles[:-WARM_MAX_CYCLES]
+                    self.lines = []
+                    self.last_done_at = self.last_output_at
+                self.condition.notify_all()
+        with self.condition:
+            self.condition.notify_all()
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def latest(self) -> tuple[float, float, bool, str] | None:
+        with self.condition:
+            return self.cycles[-1] if self.cycles else None
+
+    def cycle_after(self, since: float) -> tuple[float, float, bool, str] | None:
+        # The latest cycle that started after `since`, once the worker has been quiet for
+        # settle_seconds, so a rebuild queued behind an older one is not missed. A cycle that
+        # was already running at `since` may not have seen the change, whenever it ends.
+        deadline = time.time() + self.config.cycle_timeout_seconds
+        with self.condition:
+            while True:
+                now = time.time()
+                fresh = bool(self.cycles) and self.cycles[-1][0] > since
+                if fresh and now - self.last_output_at >= self.config.settle_seconds:
+                    return self.cycles[-1]
+                if now >= deadline or not self.alive():
+                    return None
+                wait = self.config.settle_seconds if fresh else deadline - now
+                self.condition.wait(timeout=max(0.05, min(wait, deadline - now)))
+
+    def stop(self) -> None:
+        kill_process_group(self.process)
+
+
+def stop_warm_workers() -> None:
+    for worker in _WARM_WORKERS.values():
+        worker.stop()
+    _WARM_WORKERS.clear()
+
+
+atexit.register(stop_warm_workers)
+
+
+def path_matches(path: str, patterns: list[str]) -> bool:
+    # fnmatch's "*" already crosses "/", so "**/" also has to match top-level files.
+    return any(fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path, pattern.replace("**/", "")) for pattern in patterns)
+
+
+def run_warm_check(
+    command: str,
+    config: WarmCheckConfig,
+    cwd: Path,
+    changed_paths: list[str] | None,
+    changed_since: float | None,
+) -> tuple[int, str] | None:
+    key = (cwd.resolve(), command)
+    worker = _WARM_WORKERS.get(key)
+    if worker is not None and (not worker.alive() or worker.config != config):
+        worker.stop()
+        worker = None
+    if worker is None:
+        worker = WarmWorker(cwd, config)
+        _WARM_WORKERS[key] = worker
+        changed_since = 0.0
+
+    relevant = changed_paths is None or any(path_matches(path, config.paths) for path in changed_paths)
+    if not relevant and worker.latest() is not None:
+        _, _, passed, text = worker.latest()
+        source = "unchanged inputs, last watch cycle reused"
+    else:
+        cycle = worker.cycle_after(changed_since or 0.0)
+        if cycle is None:
+            # No cycle in time (dead worker, or the watcher ignored the change): run cold.
+            if not worker.alive():
+                _WARM_WORKERS.pop(key, None)
+            return None
+        _, _, passed, text = cycle
+        source = "watch cycle"
+    if passed and not config.full_cycles:
+        return None  # A partial cycle can only fail fast; the cold command decides a pass.
+    return (0 if passed else 1), f"[warm worker: {config.watch_command} ({source})]\n{text}"
+
+
+def run_check_command(
+    command: str,
+    cwd: Path,
+    timeout_seconds: int,
+    scheduler: CheckScheduler | None,
+) -> tuple[int, str]:
+    if scheduler is None:
+        return run_cmd(command, cwd=cwd, timeout_seconds=timeout_seconds)
+    return scheduler.run(command, cwd=cwd, timeout_seconds=timeout_seconds)
+
+
+def memory_available_bytes() -> int | None:
+    try:
+        for line in Path("/proc/meminfo").read_text(encoding="utf-8").splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def cgroup_v2_parent() -> Path | None:
+    # Only usable when this process sits in a delegated, writable cgroup v2 subtree.
+    if not (CGROUP_ROOT / "cgroup.controllers").exists():
+        return None
+    try:
+        lines = Path("/proc/self/cgroup").read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    entry = next((line[3:] for line in lines if line.startswith("0::")), None)
+    if entry is None:
+        return None
+    parent = CGROUP_ROOT / entry.lstrip("/")
+    try:
+        controllers = (parent / "cgroup.subtree_control").read_text(encoding="utf-8").split()
+    except OSError:
+        return None
+    if not {"cpu", "memory"} & set(controllers) or not os.access(parent, os.W_OK):
+        return None
+    return parent
+
+
+def merge_usage(records: list[dict[str, Any]]) -> dict[str, Any]:
+    if not records:
+        return {}
+    merged: dict[str, Any] = {"processes": len(records)}
+    for key in ("wall_seconds", "cpu_user_seconds", "cpu_system_seconds", "read_blocks", "write_blocks", "admission_wait_seconds"):
+        merged[key] = round(sum(record.get(key, 0) for record in records), 3)
+    merged["max_rss_bytes"] = max(record.get("max_rss_bytes", 0) for record in records)
+    merged["limits"] = ",".join(sorted({record.get("limits", "none") for record in records}))
+    return merged
+
+
+class CheckScheduler:
+    # Host-wide admission control for check commands, shared by concurrent runs through
+    # flock'd slot files, plus per-check limits and rusage accounting.
+    def __init__(self, config: CheckResourceConfig):
+        self.config = config
+        self.cpus = available_cpus()
+        self.slots = config.max_concurrent_checks or max(1, self.cpus // config.cpus_per_check)
+        self.slot_dir = self.private_slot_dir() if config.admission else None
+        self.cgroup_parent = cgroup_v2_parent() if config.use_cgroups else None
+        self.records: list[dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    @staticmethod
+    def private_slot_dir() -> Path | None:
+        # Per user and 0700: on a shared host another user's directory (or a squatted one)
+        # must not crash the run. Without a usable directory checks run without slots.
+        path = Path(tempfile.gettempdir()) / f"{CHECK_SLOTS_DIR}-{os.getuid()}"
+        try:
+            path.mkdir(mode=0o700, exist_ok=True)
+            stat = path.stat()
+        except OSError:
+            return None
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            return None
+        return path
+
+    def host_has_room(self) -> bool:
+        needed = max(self.config.memory_mb, self.config.min_free_memory_mb) * 1024 * 1024
+        available = memory_available_bytes()
+        if needed and available is not None and available < needed:
+            return False
+        if self.config.max_load_per_cpu and hasattr(os, "getloadavg"):
+            return os.getloadavg()[0] / self.cpus < self.config.max_load_per_cpu
+        return True
+
+    @contextlib.contextmanager
+    def admit(self) -> Iterator[dict[str, Any]]:
+        # Wait for free memory and load headroom, then for a slot. Past the deadline the
+        # check runs anyway, so a saturated host slows runs down instead of wedging them.
+        started = time.perf_counter()
+        if not self.config.admission:
+            yield {"slot": None, "admitted_by": "disabled", "admission_wait_seconds": 0.0}
+            return
+        deadline = started + self.config.admission_timeout_seconds
+        admission: dict[str, Any] = {"slot": None, "admitted_by": "slot"}
+        while not self.host_has_room() and time.perf_counter() < deadline:
+            time.sleep(ADMISSION_POLL_SECONDS)
+        handle = None
+        while handle is None:
+            if self.slot_dir is None:
+                admission["admitted_by"] = "no-slot-dir"
+                break
+            for slot in range(self.slots):
+                try:
+                    candidate = open(self.slot_dir / f"slot-{slot}.lock", "a+")
+                except OSError:
+                    self.slot_dir = None
+                    break
+                try:
+                    fcntl.flock(candidate, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    candidate.close()
+                    continue
+                handle, admission["slot"] = candidate, slot
+                break
+            if handle is None and self.slot_dir is not None:
+                if time.perf_counter() >= deadline:
+                    admission["admitted_by"] = "timeout"
+                    break
+                time.sleep(ADMISSION_POLL_SECONDS)
+        admission["admission_wait_seconds"] = round(time.perf_counter() - started, 3)
+        try:
+            yield admission
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def limited_command(self, command: str, memory_in_cgroup: bool) -> str:
+        limits = []
+        if self.config.cpu_seconds:
+            limits.append(f"ulimit -t {self.config.cpu_seconds}")
+        if self.config.memory_mb and not memory_in_cgroup:
+            limits.append(f"ulimit -v {self.config.memory_mb * 1024}")
+        return "; ".join([*limits, command]) if limits else command
+
+    def create_cgroup(self) -> Path | None:
+        if self.cgroup_parent is None:
+            return None
+        with self.lock:
+            self.sequence += 1
+            path = self.cgroup_parent / f"ai-orchestrator-{os.getpid()}-{self.sequence}"
+        try:
+            path.mkdir()
+            if self.config.memory_mb:
+                (path / "memory.max").write_text(str(self.config.memory_mb * 1024 * 1024), encoding="utf-8")
+            quota = self.config.cpus_per_check * CGROUP_CPU_PERIOD_MICROSECONDS
+            (path / "cpu.max").write_text(f"{quota} {CGROUP_CPU_PERIOD_MICROSECONDS}", encoding="utf-8")
+        except OSError:
+            with contextlib.suppress(OSError):
+                path.rmdir()
+            return None
+        return path
+
+    def spawn(self, command: str, cwd: Path, cgroup: Path | None, stdout: Any, stderr: Any) -> subprocess.Popen[bytes]:
+        procs_fd = os.open(cgroup / "cgroup.procs", os.O_WRONLY) if cgroup is not None else None
+        nice = self.config.nice
+
+        def before_exec() -> None:
+            # Writing "0" moves the writer itself, so the shell is in the cgroup (and niced)
+            # before it forks anything. Both are bare syscalls, safe between fork and exec.
+            if procs_fd is not None:
+                os.write(procs_fd, b"0")
+            if nice:
+                os.nice(nice)
+
+        try:
+            return subprocess.Popen(
+                self.limited_command(command, memory_in_cgroup=cgroup is not None),
+                cwd=str(cwd),
+                shell=True,
+                stdout=stdout,
+                stderr=stderr,
+                start_new_session=True,
+                preexec_fn=before_exec if procs_fd is not None or nice else None,
+            )
+        finally:
+            if procs_fd is not None:
+                os.close(procs_fd)
+
+    def run(self, command: str, cwd: Path, timeout_seconds: int) -> tuple[int, str]:
+        with self.admit() as admission:
+            cgroup = self.create_cgroup()
+            limits = "cgroup" if cgroup is not None else "rlimit" if (self.config.memory_mb or self.config.cpu_seconds) else "none"
+            with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+                started = time.perf_counter()
+                try:
+                    process = self.spawn(command, cwd, cgroup, stdout_file, stderr_file)
+                except (OSError, subprocess.SubprocessError):
+                    if cgroup is None:
+                        raise
+                    # The cgroup rejected the process; run with rlimits instead.
+                    with contextlib.suppress(OSError):
+                        cgroup.rmdir()  # type: ignore[union-attr]
+                    cgroup = None
+                    limits = "rlimit" if (self.config.memory_mb or self.config.cpu_seconds) else "none"
+                    process = self.spawn(command, cwd, None, stdout_file, stderr_file)
+                timed_out = threading.Event()
+
+                def on_timeout() -> None:
+                    timed_out.set()
+                    kill_process_group(process)
+
+                timer = threading.Timer(timeout_seconds, on_timeout)
+                timer.start()
+                try:
+                    # wait4 reports the shell's rusage including its waited-for children.
+                    _, status, rusage = os.wait4(process.pid, 0)
+                finally:
+                    timer.cancel()
+                process.returncode = os.waitstatus_to_exitcode(status)
+                elapsed = time.perf_counter() - started
+                stdout_file.seek(0)
+                stderr_file.seek(0)
+                stdout = stdout_file.read().decode("utf-8", errors="replace")
+                stderr = stderr_file.read().decode("utf-8", errors="replace")
+
+            record = {
+                "command": command,
+                "wall_seconds": round(elapsed, 3),
+                "cpu_user_seconds": round(rusage.ru_utime, 3),
+                "cpu_system_seconds": round(rusage.ru_stime, 3),
+                "max_rss_bytes": rusage.ru_maxrss * 1024,
+                "read_blocks": rusage.ru_inblock,
+                "write_blocks": rusage.ru_oublock,
+                "admission_wait_seconds": admission["admission_wait_seconds"],
+                "admitted_by": admission["admitted_by"],
+                "limits": limits,
+            }
+            if cgroup is not None:
+                with contextlib.suppress(OSError, ValueError):
+                    record["cgroup_memory_peak_bytes"] = int((cgroup / "memory.peak").read_text(encoding="utf-8"))
+                with contextlib.suppress(OSError):
+                    cgroup.rmdir()
+        with self.lock:
+            self.records.append(record)
+
+        if timed_out.is_set():
+            return 124, f"Command timed out after {timeout_seconds}s: {command}\n{stdout}{stderr}".strip()
+        output = stdout + ("\n" + stderr if stderr else "")
+        return process.returncode, output.strip()
+
+    def summary(self) -> dict[str, Any]:
+        with self.lock:
+            records = list(self.records)
+        return {
+            "cpus": self.cpus,
+            "slots": self.slots,
+            "cgroups": self.cgroup_parent is not None,
+            "admission": self.config.admission,
+            "checks": len(records),
+            "admission_timeouts": sum(1 for record in records if record.get("admitted_by") == "timeout"),
+            **{key: value for key, value in merge_usage(records).items() if key != "processes"},
+        }
+
+
+def working_tree_hash(cwd: Path) -> str:
+    # Tree hash of the working tree (tracked and untracked files) without touching the real index.
+    # The orchestrator's own state dir is excluded: run logs change on every check and would make
+    # identical inputs look different (and copy every log into .git/objects).
+    with tempfile.TemporaryDirectory(prefix="ai_orchestrator_index_") as temp_dir:
+        index_path = Path(temp_dir) / "index"
+        code, git_dir = run_cmd("git rev-parse --git-dir", cwd=cwd, timeout_seconds=30)
+        real_index = (cwd / git_dir.strip() / "index") if code == 0 else None
+        if real_index is not None and real_index.exists():
+            shutil.copyfile(real_index, index_path)
+        env = {**os.environ, "GIT_INDEX_FILE": str(index_path)}
+        for command in (["git", "add", "-A", "--", ".", ":(exclude).ai_orchestrator"], ["git", "write-tree"]):
+            completed = subprocess.run(command, cwd=str(cwd), env=env, capture_output=True, text=True, timeout=120)
+            if completed.returncode != 0:
+                return ""
+        return completed.stdout.strip()
+
+
+def failing_test_ids(output: str) -> tuple[str, list[str]]:
+    text = ANSI_ESCAPE_PATTERN.sub("", output)
+    pytest_ids = PYTEST_FAIL_PATTERN.findall(text)
+    if pytest_ids:
+        return "pytest", sorted(set(pytest_ids))
+    vitest_ids = [f"{path} > {name}" if name else path for path, name in VITEST_FAIL_PATTERN.findall(text)]
+    if vitest_ids:
+        return "vitest", sorted(set(vitest_ids))
+    return "generic", []
+
+
+def rerun_command(command: str, runner: str, test_ids: list[str]) -> str:
+    if runner == "pytest" and test_ids:
+        return command_with_args(command, [shell_quote(test_id) for test_id in test_ids])
+    if runner == "vitest" and test_ids:
+        # Vitest filters by file; rerunning whole failing files keeps setup hooks intact.
+        files = sorted({test_id.split(" > ", 1)[0] for test_id in test_ids})
+        return command_with_args(command, [shell_quote(path) for path in files])
+    return command
+
+
+def recheck_failed(
+    result: CheckResult,
+    flaky: FlakyTracker,
+    input_hash: str,
+    *,
+    cwd: Path,
+    timeout_seconds: int,
+    scheduler: CheckScheduler | None = None,
+) -> CheckResult:
+    command = result.command
+    if result.passed:
+        flaky.record_command(command, input_hash, passed=True)
+        return result
+    if result.exit_code == 124:
+        # Timeouts are not retried: a rerun would only double the wait.
+        flaky.record_command(command, input_hash, passed=False)
+        return result
+
+    detected_runner, failing = failing_test_ids(result.output)
+    runner = flaky.config.runners.get(command, "auto")
+    runner = detected_runner if runner == "auto" else runner
+    flaky.record_failures(command, failing)
+    output = result.output
+    reruns = 0
+
+    def quarantined_only() -> CheckResult | None:
+        quarantined = sorted(test_id for test_id in failing if flaky.is_quarantined(command, test_id))
+        if not failing or len(quarantined) < len(failing):
+            return None
+        return CheckResult(
+            command=command,
+            exit_code=0,
+            output=f"{output}\n\n[quarantined] Only known-flaky tests failed: {', '.join(quarantined)}",
+            reruns=reruns,
+            quarantined_tests=quarantined,
+        )
+
+    while reruns < flaky.config.reruns:
+        quarantined = quarantined_only()
+        if quarantined is not None:
+            return quarantined
+        reruns += 1
+        rerun_cmd = rerun_command(command, runner, failing)
+        code, rerun_output = run_check_command(rerun_cmd, cwd, timeout_seconds, scheduler)
+        output += f"\n\n=== rerun {reruns}/{flaky.config.reruns} exit_code={code} ===\n$ {rerun_cmd}\n{rerun_output}"
+        if code == 0 and rerun_cmd != command:
+            # The targeted rerun only clears those tests; lint, typecheck or coverage steps chained
+            # into the command can still fail, so the full command has to pass too.
+            code, rerun_output = run_check_command(command, cwd, timeout_seconds, scheduler)
+            output += f"\n\n=== full rerun {reruns}/{flaky.config.reruns} exit_code={code} ===\n$ {command}\n{rerun_output}"
+        if code == 0:
+            flaky_tests = failing or [command]
+            flaky.record_flips(command, flaky_tests)
+            return CheckResult(command=command, exit_code=0, output=output, reruns=reruns, flaky_tests=flaky_tests)
+        if code == 124:
+            break
+        _, still_failing = failing_test_ids(rerun_output)
+        if still_failing:
+            failing = still_failing
+
+    quarantined = quarantined_only()
+    if quarantined is not None:
+        return quarantined
+    if flaky.passed_before(command, input_hash):
+        # Same inputs passed earlier, so the failure cannot come from the change under test.
+        flaky_tests = failing or [command]
+        flaky.record_flips(command, flaky_tests)
+        return CheckResult(
+            command=command,
+            exit_code=0,
+            output=f"{output}\n\n[flaky] This check passed earlier on identical inputs.",
+            reruns=reruns,
+            flaky_tests=flaky_tests,
+        )
+    flaky.record_command(command, input_hash, passed=False)
+    return CheckResult(command=command, exit_code=result.exit_code, output=output, reruns=reruns)
+
+
+class FlakyTracker:
+    # Per-command outcome history keyed by working-tree hash, plus per-test flip counts.
+    def __init__(self, cwd: Path, config: FlakyCheckConfig):
+        self.path = cwd / FLAKY_TESTS_FILE
+        self.config = config
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            payload = {}
+        self.commands: dict[str, Any] = payload if isinstance(payload, dict) else {}
+        self.run_flaky: dict[str, set[str]] = {}
+        self.run_quarantined: dict[str, set[str]] = {}
+
+    def _entry(self, command: str) -> dict[str, Any]:
+        entry = self.commands.setdefault(command, {})
+        entry.setdefault("inputs", {})
+        entry.setdefault("tests", {})
+        return entry
+
+    def record_command(self, command: str, input_hash: str, passed: bool) -> None:
+        if not input_hash:
+            return
+        inputs = self._entry(command)["inputs"]
+        outcome = inputs.pop(input_hash, {"pass": 0, "fail": 0})
+        outcome["pass" if passed else "fail"] += 1
+        inputs[input_hash] = outcome
+        while len(inputs) > FLAKY_MAX_INPUTS_PER_COMMAND:
+            inputs.pop(next(iter(inputs)))
+
+    def passed_before(self, command: str, input_hash: str) -> bool:
+        outcome = self._entry(command)["inputs"].get(input_hash) if input_hash else None
+        return bool(outcome and outcome.get("pass"))
+
+    def _test(self, command: str, test_id: str) -> dict[str, Any]:
+        return self._entry(command)["tests"].setdefault(test_id, {"failures": 0, "flips": 0, "quarantined": False})
+
+    def record_failures(self, command: str, test_ids: list[str]) -> None:
+        for test_id in test_ids:
+            test = self._test(command, test_id)
+            test["failures"] += 1
+            test["last_failed_at"] = dt.datetime.now().isoformat(timespec="seconds")
+            if self.is_quarantined(command, test_id):
+                self.run_quarantined.setdefault(command, set()).add(test_id)
+
+    def record_flips(self, command: str, test_ids: list[str]) -> None:
+        for test_id in test_ids:
+            test = self._test(command, test_id)
+            test["flips"] += 1
+            if (
+                test_id != command
+                and self.config.quarantine_days
+                and not test["quarantined"]
+                and test["flips"] >= self.config.quarantine_after
+            ):
+                test["quarantined"] = True
+                test["quarantined_at"] = dt.datetime.now().isoformat(timespec="seconds")
+            self.run_flaky.setdefault(command, set()).add(test_id)
+
+    def is_quarantined(self, command: str, test_id: str) -> bool:
+        if test_id in self.config.quarantine:
+            return True
+        test = self.commands.get(command, {}).get("tests", {}).get(test_id)
+        if not test or not test.get("quarantined"):
+            return False
+        # Automatic quarantine expires: the test has to flake quarantine_after times again to return.
+        try:
+            since = dt.datetime.fromisoformat(test.get("quarantined_at", ""))
+        except (TypeError, ValueError):
+            since = None
+        if since is None or dt.datetime.now() - since > dt.timedelta(days=self.config.quarantine_days):
+            test.update(quarantined=False, flips=0)
+            test.pop("quarantined_at", None)
+            return False
+        return True
+
+    def report(self) -> dict[str, Any]:
+        quarantined = sorted(
+            {
+                f"{command} :: {test_id}"
+                for command, entry in self.commands.items()
+                for test_id in list(entry.get("tests", {}))
+                if self.is_quarantined(command, test_id)
+            }
+            | {f"* :: {test_id}" for test_id in self.config.quarantine}
+        )
+        return {
+            "flaky_this_run": {command: sorted(ids) for command, ids in self.run_flaky.items()},
+            "quarantined_failures_this_run": {command: sorted(ids) for command, ids in self.run_quarantined.items()},
+            "quarantined": quarantined,
+        }
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.commands, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def list_test_files(cwd: Path, patterns: list[str]) -> list[str]:
+    # Include untracked files so tests added by the current attempt are sharded too.
+    code, output = run_cmd("git ls-files --cached --others --exclude-standard", cwd=cwd, timeout_seconds=30)
+    if code != 0:
+        raise OrchestratorError(f"Failed to list files for check sharding:\n{output}")
+    files = []
+    for line in output.splitlines():
+        path = line.strip()
+        if not path or path.startswith(RUNS_DIR) or "node_modules/" in path:
+            continue
+        if path_matches(path, patterns):
+            files.append(path)
+    return sorted(set(files))
+
+
+def load_test_durations(cwd: Path, command: str) -> dict[str, float]:
+    path = cwd / TEST_DURATIONS_FILE
+    try:
+        payload = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    durations = payload.get(command, {}) if isinstance(payload, dict) else {}
+    return {key: float(value) for key, value in durations.items() if isinstance(value, (int, float))}
+
+
+def save_test_durations(cwd: Path, command: str, measured: dict[str, float]) -> None:
+    if not measured:
+        return
+    path = cwd / TEST_DURATIONS_FILE
+    try:
+        payload = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(payload, dict):
+            payload = {}
+    except (OSError, json.JSONDecodeError):
+        payload = {}
+    durations = payload.setdefault(command, {})
+    for test_file, seconds in measured.items():
+        previous = durations.get(test_file)
+        if isinstance(previous, (int, float)):
+            seconds = SHARD_DURATION_SMOOTHING * seconds + (1 - SHARD_DURATION_SMOOTHING) * previous
+        durations[test_file] = round(seconds, 4)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(payload, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def vitest_config_includes(cwd: Path) -> list[str] | None:
+    # Best-effort read of test.include from the vitest config; None when it cannot be read plainly.
+    for name in VITEST_CONFIG_FILES:
+        try:
+            text = (cwd / name).read_text(encoding="utf-8")
+        except OSError:
+            continue
+        match = re.search(r"\binclude\s*:\s*\[([^\]]*)\]", text)
+        if match is None:
+            return None
+        patterns = re.findall(r"""["'`]([^"'`]+)["'`]""", match.group(1))
+        if not patterns or any(re.search(r"[?!+@*]\(", pattern) for pattern in patterns):
+            return None
+        return [expanded for pattern in patterns for expanded in expand_braces(pattern)]
+    return None
+
+
+def expand_braces(pattern: str) -> list[str]:
+    match = re.search(r"\{([^{}]*)\}", pattern)
+    if match is None:
+        return [pattern]
+    head, tail = pattern[: match.start()], pattern[match.end() :]
+    return [expanded for option in match.group(1).split(",") for expanded in expand_braces(head + option + tail)]
+
+
+def filter_bundles(test_files: list[str]) -> list[list[str]]:
+    # vitest matches file arguments as substrings, so a.test.ts also selects a.test.tsx.
+    # Files whose path extends another file's path have to run in the same shard.
+    bundles: list[list[str]] = []
+    for path in sorted(test_files):
+        if bundles and path.startswith(bundles[-1][0]):
+            bundles[-1].append(path)
+        else:
+            bundles.append([path])
+    return bundles
+
+
+def balance_shards(test_files: list[str], durations: dict[str, float], shard_count: int) -> list[list[str]]:
+    # Longest-processing-time-first: place the slowest remaining bundle on the least loaded shard.
+    known = sorted(durations[path] for path in test_files if path in durations)
+    default_estimate = known[len(known) // 2] if known else 1.0
+    bundles = filter_bundles(test_files)
+    estimates = [sum(durations.get(path, default_estimate) for path in bundle) for bundle in bundles]
+    shards: list[list[str]] = [[] for _ in range(max(1, min(shard_count, len(bundles))))]
+    loads = [0.0] * len(shards)
+    for index in sorted(range(len(bundles)), key=lambda item: (-estimates[item], bundles[item][0])):
+        target = loads.index(min(loads))
+        shards[target].extend(bundles[index])
+        loads[target] += estimates[index]
+    return [sorted(shard) for shard in shards if shard]
+
+
+def shard_command(command: str, config: ShardConfig, files: list[str], report_path: Path, cwd: Path) -> str:
+    if config.runner == "vitest":
+        # Absolute paths so a filter cannot match the same name in another directory.
+        args = [shell_quote(str((cwd / path).resolve())) for path in files]
+        args += [
+            "--passWithNoTests",
+            "--reporter=default",
+            "--reporter=json",
+            f"--outputFile.json={shell_quote(str(report_path))}",
+        ]
+    else:
+        args = [shell_quote(path) for path in files]
+    return command_with_args(command, args)
+
+
+def command_with_args(command: str, args: list[str]) -> str:
+    # npm scripts need "--" to forward extra arguments to the underlying tool.
+    separator = " -- " if command.split()[:1] == ["npm"] and " -- " not in f" {command} " else " "
+    return command + separator + " ".join(args)
+
+
+def vitest_report_durations(report_path: Path, cwd: Path) -> dict[str, float]:
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        return {}
+    durations: dict[str, float] = {}
+    for entry in report.get("testResults", []) if isinstance(report, dict) else []:
+        name, start, end = entry.get("name"), entry.get("startTime"), entry.get("endTime")
+        if not isinstance(name, str) or not isinstance(start, (int, float)) or not isinstance(end, (int, float)):
+            continue
+        try:
+            rel = Path(name).resolve().relative_to(cwd.resolve()).as_posix()
+        except ValueError:
+            rel = name
+        durations[rel] = max(0.0, (end - start) / 1000)
+    return durations
+
+
+def run_sharded_check(
+    command: str,
+    config: ShardConfig,
+    *,
+    cwd: Path,
+    timeout_seconds: int,
+    logger: RunLogger,
+    log_prefix: str,
+    scheduler: CheckScheduler | None = None,
+) -> tuple[int, str]:
+    test_files = list_test_files(cwd, config.test_patterns)
+    if config.runner == "vitest":
+        includes = vitest_config_includes(cwd)
+        if includes is not None:
+            test_files = [path for path in test_files if path_matches(path, includes)]
+    shard_count = config.shards or (scheduler.slots if scheduler is not None else available_cpus())
+    if len(test_files) < 2 or shard_count < 2:
+        return run_check_command(command, cwd, timeout_seconds, scheduler)
+
+    durations = load_test_durations(cwd, command)
+    shards = balance_shards(test_files, durations, shard_count)
+
+    def run_shard(index: int, files: list[str], report_dir: Path) -> tuple[int, str, float, dict[str, float]]:
+        report_path = report_dir / f"shard-{index}.json"
+        started = time.perf_counter()
+        exit_code, output = run_check_command(
+            shard_command(command, config, files, report_path, cwd), cwd, timeout_seconds, scheduler
+        )
+        elapsed = time.perf_counter() - started
+        measured = vitest_report_durations(report_path, cwd) if config.runner == "vitest" else {}
+        if not measured:
+            # No per-file timings from the runner: split shard wall time by prior estimates.
+            weights = {path: durations.get(path, 1.0) for path in files}
+            total = sum(weights.values()) or 1.0
+            measured = {path: elapsed * weight / total for path, weight in weights.items()}
+        return exit_code, output, elapsed, measured
+
+    with tempfile.TemporaryDirectory(prefix="ai_orchestrator_shards_") as temp_dir:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            futures = [pool.submit(run_shard, index, files, Path(temp_dir)) for index, files in enumerate(shards, start=1)]
+            shard_results = [future.result() for future in futures]
+
+    for index, (files, (shard_exit, shard_output, elapsed, _)) in enumerate(zip(shards, shard_results), start=1):
+        logger.write_text(
+            f"{log_prefix}/shard-{index:02d}.txt",
+            f"$ {shard_command(command, config, files, Path(f'shard-{index}.json'), cwd)}\n\n"
+            f"exit_code={shard_exit}\nelapsed_seconds={elapsed:.2f}\n\n{shard_output}",
+        )
+    exit_code, output, measured_all = merge_shard_results(shards, shard_results)
+    save_test_durations(cwd, command, measured_all)
+    return exit_code, output
+
+
+def merge_shard_results(
+    shards: list[list[str]], shard_results: list[tuple[int, str, float, dict[str, float]]]
+) -> tuple[int, str, dict[str, float]]:
+    measured_all: dict[str, float] = {}
+    sections: list[str] = []
+    exit_code = 0
+    for index, (files, (shard_exit, shard_output, elapsed, measured)) in enumerate(zip(shards, shard_results), start=1):
+        measured_all.update(measured)
+        if shard_exit != 0 and NO_TEST_FILES_PATTERN.search(shard_output):
+            # A shard whose files the runner skipped or excluded has nothing to fail.
+            shard_exit = 0
+        if shard_exit != 0 and exit_code == 0:
+            exit_code = shard_exit
+        sections.append(
+            f"=== shard {index}/{len(shards)} exit_code={shard_exit} elapsed={elapsed:.1f}s files={len(files)} ===\n{shard_output}"
+        )
+    return exit_code, "\n\n".join(sections), measured_all
+
+
 def checks_passed(results: list[CheckResult]) -> bool:
     return all(result.passed for result in results)
 
@@ -805,7 +3684,12 @@ def summarize_check_results(results: list[CheckResult]) -> str:
     lines: list[str] = []
     for result in results:
         status = "PASS" if result.passed else "FAIL"
-        lines.append(f"[{status}] {result.command}")
+        notes = []
+        if result.flaky_tests:
+            notes.append(f"flaky, passed on rerun: {', '.join(result.flaky_tests)}")
+        if result.quarantined_tests:
+            notes.append(f"quarantined failures ignored: {', '.join(result.quarantined_tests)}")
+        lines.append(f"[{status}] {result.command}" + (f" ({'; '.join(notes)})" if notes else ""))
         if not result.passed:
             lines.append(result.output[-4000:] if len(result.output) > 4000 else result.output)
             lines.append("")
@@ -819,13 +3703,24 @@ def git_diff_for_paths(cwd: Path, paths: list[str]) -> str:
     tracked_paths: list[str] = []
     untracked_paths: list[str] = []
     deleted_paths: list[str] = []
+    skipped: list[str] = []
     for path in paths:
         code, _ = run_cmd(f"git ls-files --error-unmatch -- {shell_quote(path)}", cwd=cwd, timeout_seconds=30)
         abs_path = cwd / path
         if code == 0:
-            tracked_paths.append(path)
+            if path_matches(path, REVIEW_SKIPPED_PATTERNS):
+                skipped.append(f"{path} (lockfile or generated; {numstat_summary(cwd, path)})")
+            else:
+                tracked_paths.append(path)
         elif abs_path.exists():
-            untracked_paths.append(path)
+            if abs_path.is_dir():
+                continue
+            if path_matches(path, REVIEW_SKIPPED_PATTERNS):
+                skipped.append(f"{path} (new lockfile or generated file, {abs_path.stat().st_size} bytes)")
+            elif is_binary_file(abs_path):
+                skipped.append(f"{path} (new binary file, {abs_path.stat().st_size} bytes)")
+            else:
+                untracked_paths.append(path)
         else:
             deleted_paths.append(path)
 
@@ -840,14 +3735,10 @@ def git_diff_for_paths(cwd: Path, paths: list[str]) -> str:
 
     for path in untracked_paths:
         abs_path = cwd / path
-        if abs_path.is_dir():
-            continue
         try:
-            content = abs_path.read_text(encoding="utf-8")
+            content = FILE_CACHE.read_text(abs_path)
         except Exception as exc:
             content = f"[unable to read file: {exc}]"
-        if len(content) > MAX_FILE_CHARS:
-            content = content[:MAX_FILE_CHARS] + "\n\n[TRUNCATED]"
         sections.append(
             "\n".join(
                 [
@@ -859,11 +3750,92 @@ def git_diff_for_paths(cwd: Path, paths: list[str]) -> str:
 
     if deleted_paths:
         sections.append("### DELETED PATHS\n" + "\n".join(deleted_paths))
+    if skipped:
+        sections.append("### SKIPPED FROM REVIEW (content not shown)\n" + "\n".join(f"- {item}" for item in skipped))
+
+    # No truncation: review_slice splits large diffs into chunks and caps their number.
+    return "\n\n".join(section for section in sections if section.strip())
 
-    output = "\n\n".join(section for section in sections if section.strip())
-    if len(output) > 80_000:
-        return output[:80_000] + "\n\n[DIFF TRUNCATED]"
-    return output
+
+def numstat_summary(cwd: Path, path: str) -> str:
+    code, output = run_cmd(f"git diff --numstat -- {shell_quote(path)}", cwd=cwd, timeout_seconds=30)
+    parts = output.split("\t", 2) if code == 0 else []
+    if len(parts) == 3 and parts[0].isdigit() and parts[1].isdigit():
+        return f"+{parts[0]} -{parts[1]} lines"
+    return "binary or unchanged"
+
+
+def is_binary_file(path: Path) -> bool:
+    try:
+        with path.open("rb") as handle:
+            return b"\0" in handle.read(8192)
+    except OSError:
+        return False
+
+
+def diff_file_names(diff_text: str) -> list[str]:
+    names = re.findall(r"^(?:diff --git a/(?:\S+) b/(\S+)|### UNTRACKED FILE: (.+))$", diff_text, re.MULTILINE)
+    return dedupe([tracked or untracked for tracked, untracked in names])
+
+
+DIFF_FILE_HEADER_PATTERN = re.compile(
+    r"^(?:diff --git |### UNTRACKED FILE: |### DELETED PATHS|### SKIPPED FROM REVIEW)", re.MULTILINE
+)
+DIFF_HUNK_PATTERN = re.compile(r"^@@ ", re.MULTILINE)
+
+
+def split_at(text: str, pattern: re.Pattern[str]) -> list[str]:
+    starts = [match.start() for match in pattern.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)]) if text[start:end].strip()]
+
+
+def split_lines_bounded(text: str, max_chars: int) -> list[str]:
+    pieces: list[str] = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_diff(diff_text: str, max_chars: int) -> list[str]:
+    # File sections, then hunks of oversized files, then lines of oversized hunks; each
+    # piece of a split file repeats the file header. Pieces are packed in order into chunks.
+    pieces: list[str] = []
+    for section in split_at(diff_text, DIFF_FILE_HEADER_PATTERN):
+        if len(section) <= max_chars:
+            pieces.append(section)
+            continue
+        hunks = split_at(section, DIFF_HUNK_PATTERN)
+        header = hunks.pop(0) if len(hunks) > 1 and not hunks[0].startswith("@@ ") else section.splitlines(keepends=True)[0]
+        if len(hunks) <= 1:
+            hunks = [section[len(header):]]
+        budget = max(1_000, max_chars - len(header) - 40)
+        parts = [part for hunk in hunks for part in (split_lines_bounded(hunk, budget) if len(hunk) > budget else [hunk])]
+        for index, part in enumerate(parts, start=1):
+            pieces.append(f"{header.rstrip()}\n[part {index}/{len(parts)} of this file]\n{part}")
+    chunks: list[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 def shell_quote(text: str) -> str:
@@ -881,53 +3853,141 @@ def review_slice(
     logger: RunLogger,
     slice_dir: str,
     attempt: int,
+    pre_review_flags: list[str] | None = None,
 ) -> ReviewResult:
-    system_prompt = (
-        "You are a strict code reviewer focused on acceptance criteria and regressions. "
-        "Return strict JSON only."
-    )
-    user_prompt = textwrap.dedent(
-        f"""
-        Review this slice attempt.
-
-        Goal:
-        {spec.goal}
+    chunks = split_diff(diff_text, int(spec.review_chunk_tokens * CHARS_PER_TOKEN)) if diff_text else []
+    omitted: list[str] = []
+    if len(chunks) > spec.max_review_chunks:
+        # Past the budget the tail of the diff is not reviewed; the reviewers are told what is missing.
+        dropped = chunks[spec.max_review_chunks :]
+        chunks = chunks[: spec.max_review_chunks]
+        shown = set(diff_file_names("\n".join(chunks)))
+        dropped_names = diff_file_names("\n".join(dropped))
+        missing = [name for name in dropped_names if name not in shown]
+        partial = [name for name in dropped_names if name in shown]
+        omitted.append(
+            f"{len(dropped)} diff chunk(s) over the max_review_chunks budget of {spec.max_review_chunks} were not sent."
+        )
+        if missing:
+            omitted.append(f"Files not shown at all: {', '.join(missing)}")
+        if partial:
+            omitted.append(f"Files shown only in part: {', '.join(partial)}")
+        logger.write_text(f"{slice_dir}/02-attempt-{attempt}/review_omitted.txt", "\n".join(omitted))
+    if len(chunks) <= 1:
+        return review_diff_chunk(
+            client=client,
+            spec=spec,
+            slice_plan=slice_plan,
+            touched_paths=touched_paths,
+            diff_text=diff_text,
+            check_results=check_results,
+            logger=logger,
+            log_path=f"{slice_dir}/02-attempt-{attempt}/raw_reviewer_response.txt",
+            pre_review_flags=pre_review_flags,
+            omitted=omitted,
+        )
 
-        Global acceptance criteria:
-        {json.dumps(spec.acceptance_criteria, ensure_ascii=False)}
+    def review_chunk(index: int, chunk: str) -> ReviewResult:
+        return review_diff_chunk(
+            client=client,
+            spec=spec,
+            slice_plan=slice_plan,
+            touched_paths=touched_paths,
+            diff_text=chunk,
+            check_results=check_results,
+            logger=logger,
+            log_path=f"{slice_dir}/02-attempt-{attempt}/raw_reviewer_response-chunk-{index:02d}.txt",
+            pre_review_flags=pre_review_flags,
+            chunk_label=f"{index}/{len(chunks)}",
+            omitted=omitted,
+        )
 
-        Slice:
-        - id: {slice_plan.id}
-        - title: {slice_plan.title}
-        - objective: {slice_plan.objective}
-        - acceptance: {json.dumps(slice_plan.acceptance, ensure_ascii=False)}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(spec.max_parallel_reviews, len(chunks))) as pool:
+        futures = [pool.submit(review_chunk, index, chunk) for index, chunk in enumerate(chunks, start=1)]
+        results = [future.result() for future in futures]
+    return merge_reviews(results)
 
-        Touched paths:
-        {json.dumps(touched_paths, ensure_ascii=False)}
 
-        Check results:
-        {summarize_check_results(check_results) or "[no checks run]"}
+def merge_reviews(results: list[ReviewResult]) -> ReviewResult:
+    # Chunk order, not completion order, so the merged result is the same on every run.
+    issues: list[str] = []
+    required_fixes: list[str] = []
+    for result in results:
+        issues.extend(issue for issue in result.issues if issue not in issues)
+        required_fixes.extend(fix for fix in result.required_fixes if fix not in required_fixes)
+    return ReviewResult(
+        passed=all(result.passed for result in results),
+        issues=issues,
+        required_fixes=required_fixes,
+        raw_output="\n\n".join(
+            f"=== chunk {index}/{len(results)} ===\n{result.raw_output}" for index, result in enumerate(results, start=1)
+        ),
+    )
 
-        Diff:
-        {diff_text or "[no diff captured]"}
 
-        Reviewer notes:
-        {spec.reviewer_notes or "[none]"}
+def review_diff_chunk(
+    *,
+    client: OpenAIChatClient,
+    spec: Spec,
+    slice_plan: SlicePlan,
+    touched_paths: list[str],
+    diff_text: str,
+    check_results: list[CheckResult],
+    logger: RunLogger,
+    log_path: str,
+    pre_review_flags: list[str] | None = None,
+    chunk_label: str | None = None,
+    omitted: list[str] | None = None,
+) -> ReviewResult:
+    system_prompt = (
+        "You are a strict code reviewer focused on acceptance criteria and regressions. "
+        "Return strict JSON only."
+    )
+    chunk_rules = (
+        f"This is diff chunk {chunk_label}; other chunks are reviewed separately. "
+        "Judge only the changes shown and do not fail for code you cannot see."
+        if chunk_label
+        else ""
+    )
+    instructions = textwrap.dedent(
+        """
+        Review one slice attempt.
 
         Return JSON:
-        {{
+        {
           "pass": true,
           "issues": [],
           "required_fixes": []
-        }}
+        }
 
         Rules:
         - pass=false if acceptance criteria are not met or if a regression risk is obvious.
         - Keep issues concrete and actionable.
         """
-    ).strip()
-    raw = client.complete(system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=2200)
-    logger.write_text(f"{slice_dir}/02-attempt-{attempt}/raw_reviewer_response.txt", raw)
+    )
+    user_prompt = assemble_prompt(
+        static=[
+            instructions,
+            prompt_section("Goal", spec.goal),
+            prompt_section("Global acceptance criteria", spec.acceptance_criteria),
+            prompt_section("Reviewer notes", spec.reviewer_notes),
+        ],
+        per_slice=[slice_prompt_section(slice_plan)],
+        per_attempt=[
+            prompt_section("Touched paths", touched_paths),
+            prompt_section("Check results", summarize_check_results(check_results) or "[no checks run]"),
+            prompt_section("Automated pre-review flags (verify whether each is justified)", pre_review_flags or []),
+            prompt_section(f"Diff (chunk {chunk_label})" if chunk_label else "Diff", diff_text or "[no diff captured]"),
+            prompt_section("Omitted from review (not reviewed by anyone; do not assume it is correct)", omitted) if omitted else "",
+            chunk_rules,
+        ],
+    )
+    raw = client.complete(
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        max_tokens=output_token_budget(spec, "review", 2_000 + len(diff_text) // 20),
+    )
+    logger.write_text(log_path, raw)
 
     try:
         payload = extract_json_object(raw)
@@ -951,6 +4011,99 @@ def review_slice(
     )
 
 
+def pre_review_slice(
+    *,
+    cwd: Path,
+    files_to_read: list[str],
+    files_to_create: list[str],
+    changed_paths: list[str],
+    touched_paths: list[str],
+    content_changed: list[str],
+    check_results: list[CheckResult],
+    files_hint: list[str] | None = None,
+) -> tuple[ReviewResult | None, list[str]]:
+    # Deterministic gate in front of the reviewer model. Returns a final ReviewResult when the
+    # outcome is already known, otherwise None plus advisory flags to include in the review prompt.
+    if not checks_passed(check_results):
+        # format_feedback already carries the check output; no reviewer issues needed.
+        return ReviewResult(passed=False, issues=[], required_fixes=[], raw_output="[pre-review] checks failed"), []
+
+    if not changed_paths:
+        return (
+            ReviewResult(
+                passed=False,
+                issues=["Implementer returned no file changes."],
+                required_fixes=["Return the file changes needed to meet the slice objective."],
+                raw_output="[pre-review] no changes",
+            ),
+            [],
+        )
+    # Judged on this attempt's own changes: the slice diff still shows earlier attempts' edits.
+    if not content_changed:
+        return (
+            ReviewResult(
+                passed=False,
+                issues=["Returned changes are identical to the existing files (no-op)."],
+                required_fixes=["Make the code changes needed to meet the slice objective."],
+                raw_output="[pre-review] no-op diff",
+            ),
+            [],
+        )
+
+    in_scope = set(files_to_read) | set(files_to_create)
+    declared = in_scope | set(files_hint or [])
+    deleted_tests = [path for path in touched_paths if TEST_PATH_PATTERN.search(path) and not (cwd / path).exists()]
+    # Removing or renaming a test the slice declared is the reviewer's call; anything else is not.
+    undeclared_deleted = [path for path in deleted_tests if path not in declared]
+    if undeclared_deleted:
+        return (
+            ReviewResult(
+                passed=False,
+                issues=[f"Deleted test file outside the slice's files: {path}" for path in undeclared_deleted],
+                required_fixes=["Restore deleted tests; update them instead of removing coverage."],
+                raw_output="[pre-review] deleted tests",
+            ),
+            [],
+        )
+
+    flags: list[str] = [
+        f"Deleted test file: {path} (check that its coverage was moved or is obsolete)" for path in deleted_tests
+    ]
+    out_of_scope = [path for path in changed_paths if path not in in_scope]
+    if out_of_scope:
+        flags.append(f"Changed files outside the selected files: {', '.join(out_of_scope)}")
+    flags.extend(large_rewrite_flags(cwd, touched_paths))
+    return None, flags
+
+
+def large_rewrite_flags(cwd: Path, paths: list[str]) -> list[str]:
+    if not paths:
+        return []
+    quoted = " ".join(shell_quote(path) for path in paths)
+    code, output = run_cmd(f"git diff --numstat -- {quoted}", cwd=cwd, timeout_seconds=30)
+    if code != 0:
+        return []
+    flags: list[str] = []
+    for line in output.splitlines():
+        parts = line.split("\t", 2)
+        if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+            continue  # Binary files report "-".
+        added, deleted, path = int(parts[0]), int(parts[1]), parts[2]
+        target = cwd / path
+        if not target.exists():
+            continue
+        try:
+            current_lines = len(split_text_lines(FILE_CACHE.read_text(target)))
+        except (OSError, UnicodeDecodeError):
+            continue
+        original_lines = current_lines - added + deleted
+        if deleted >= PRE_REVIEW_REWRITE_MIN_LINES and original_lines and deleted / original_lines >= PRE_REVIEW_REWRITE_RATIO:
+            flags.append(
+                f"Large rewrite of {path}: {deleted} of {original_lines} original lines removed, {added} added."
+            )
+    return flags
+
+
 def combine_commands(global_commands: list[str], slice_commands: list[str]) -> list[str]:
     combined = []
     seen = set()
@@ -968,7 +4121,7 @@ def format_feedback(check_results: list[CheckResult], review: ReviewResult) -> s
     if check_results and not checks_passed(check_results):
         parts.append("Test/check failures:")
         parts.append(summarize_check_results(check_results))
-    if not review.passed:
+    if not review.passed and (review.issues or review.required_fixes):
         parts.append("Reviewer findings:")
         if review.issues:
             parts.extend(f"- {issue}" for issue in review.issues)
@@ -978,27 +4131,51 @@ def format_feedback(check_results: list[CheckResult], review: ReviewResult) -> s
     return "\n".join(parts).strip()
 
 
-def run(spec: Spec, continue_on_failure: bool) -> int:
+def run(
+    spec: Spec,
+    continue_on_failure: bool,
+    profile: bool = False,
+    client: Any | None = None,
+    plan_from: Path | None = None,
+) -> int:
     cwd = spec.working_directory
     if not cwd.exists():
         raise OrchestratorError(f"Working directory does not exist: {cwd}")
+    if spec.working_directories:
+        return run_fanout(spec, continue_on_failure, profile, client)
 
-    run_dir = cwd / RUNS_DIR / now_stamp()
+    run_dir = new_run_dir(cwd)
     logger = RunLogger(run_dir)
     logger.write_json("spec.json", spec_to_payload(spec))
-
-    repo_files = git_file_list(cwd)
-    context_text = read_context_files(spec, cwd)
-
-    client = create_client(spec)
-    slices = build_plan(client=client, spec=spec, repo_files=repo_files, context_text=context_text, logger=logger)
+    profiler = PhaseProfiler(logger, enabled=profile)
+    file_cache_start = FILE_CACHE.counters()
+
+    with profiler.phase("setup"):
+        repo_files = git_file_list(cwd)
+        context_text = read_context_files(spec, cwd)
+        phase_stats = PhaseStats(cwd)
+        router = ModelRouter(spec, client or create_client(spec), phase_stats)
+        summary_cache = SummaryCache(cwd) if spec.summarize_context_files else None
+        flaky = FlakyTracker(cwd, spec.flaky_checks)
+        scheduler = CheckScheduler(spec.check_resources)
+        logger.write_json("baseline.json", git_baseline(cwd))
+    with profiler.phase("plan"):
+        if plan_from is None:
+            slices = build_plan(client=router.client("plan"), spec=spec, repo_files=repo_files, context_text=context_text, logger=logger)
+        else:
+            slices = shared_plan(plan_from, spec, logger)
 
     baseline_changed = current_changed_paths(cwd)
     summary: dict[str, Any] = {
         "started_at": dt.datetime.now().isoformat(),
         "run_dir": str(run_dir),
+        "spec_path": spec.spec_path,
+        "spec_id": spec_identity(spec),
+        "goal": spec.goal,
         "slices": [],
         "failed": False,
+        "review_model_calls": 0,
+        "review_calls_skipped": 0,
     }
     logger.write_json("summary-progress.json", summary)
 
@@ -1010,67 +4187,165 @@ def run(spec: Spec, continue_on_failure: bool) -> int:
             dataclasses.asdict(slice_plan),
         )
 
-        files_to_read, files_to_create = choose_files_for_slice(
-            client=client,
-            spec=spec,
-            slice_plan=slice_plan,
-            repo_files=repo_files,
-            logger=logger,
-            slice_dir=slice_dir,
-        )
-
-        slice_touched = set()
-        feedback = ""
-        slice_passed = False
-        attempt_summaries: list[dict[str, Any]] = []
-        for attempt in range(1, spec.max_attempts_per_slice + 1):
-            file_context = load_file_context(cwd, files_to_read)
-            payload = ask_for_changes(
-                client=client,
+        with profiler.phase(f"{slice_key}/select"):
+            files_to_read, files_to_create, files_to_modify = choose_files_for_slice(
+                client=router.client("select"),
                 spec=spec,
                 slice_plan=slice_plan,
-                files_to_read=files_to_read,
-                files_to_create=files_to_create,
-                file_context=file_context,
-                feedback=feedback,
+                repo_files=repo_files,
                 logger=logger,
                 slice_dir=slice_dir,
-                attempt=attempt,
             )
-            changed_paths = apply_changes(cwd, payload)
-            slice_touched.update(changed_paths)
-            repo_files = git_file_list(cwd)
 
-            command_list = combine_commands(spec.check_commands, slice_plan.check_commands)
-            check_results = run_checks(
-                command_list,
-                cwd=cwd,
-                timeout_seconds=spec.command_timeout_seconds,
-                logger=logger,
-                log_prefix=f"{slice_dir}/02-attempt-{attempt}",
-            )
-            review = review_slice(
-                client=client,
-                spec=spec,
-                slice_plan=slice_plan,
-                touched_paths=sorted(slice_touched),
-                diff_text=git_diff_for_paths(cwd, sorted(slice_touched)),
-                check_results=check_results,
-                logger=logger,
-                slice_dir=slice_dir,
-                attempt=attempt,
-            )
+        slice_touched = set()
+        refused_outlines: set[str] = set()
+        shown_as: dict[str, str] = {}
+        conversation = SliceConversation(cwd) if spec.multi_turn_retries else None
+        feedback = ""
+        slice_passed = False
+        attempt_summaries: list[dict[str, Any]] = []
+        for attempt in range(1, spec.max_attempts_per_slice + 1):
+            attempt_started = time.perf_counter()
+            attempt_key = f"{slice_key}/attempt-{attempt}"
+            with profiler.phase(f"{attempt_key}/implement"):
+                implement_client = router.client("implement")
+                if not getattr(implement_client, "supports_history", False):
+                    conversation = None
+                prompt_mode = "delta" if conversation is not None and conversation.active else "full"
+                file_context = ""
+                if prompt_mode == "full":
+                    shown_as = {}
+                    # Files the slice may edit (or already edited) get full content; the rest get outlines.
+                    full_content_files = (
+                        set(files_to_modify) | slice_touched | refused_outlines
+                        if summary_cache is not None and files_to_modify is not None
+                        else None
+                    )
+                    file_context = load_file_context(
+                        cwd,
+                        files_to_read,
+                        full_content_files,
+                        summary_cache,
+                        focus_text="\n".join([slice_plan.title, slice_plan.objective, *slice_plan.acceptance, feedback]),
+                        shown_as=shown_as,
+                    )
+                payload = ask_for_changes(
+                    client=implement_client,
+                    spec=spec,
+                    slice_plan=slice_plan,
+                    files_to_read=files_to_read,
+                    files_to_create=files_to_create,
+                    file_context=file_context,
+                    feedback=feedback,
+                    logger=logger,
+                    slice_dir=slice_dir,
+                    attempt=attempt,
+                    files_to_edit=sorted(set(files_to_modify if files_to_modify is not None else files_to_read) | slice_touched),
+                    conversation=conversation,
+                )
+            with profiler.phase(f"{attempt_key}/apply"):
+                applied_at = time.time()
+                before_apply = snapshot_changed_files(cwd, payload)
+                try:
+                    changed_paths = apply_changes(cwd, payload, shown_as)
+                    refusal = None
+                except ChangeRefused as exc:
+                    changed_paths, refusal = [], exc
+                after_apply = snapshot_changed_files(cwd, payload)
+                content_changed = [path for path in changed_paths if before_apply.get(path) != after_apply.get(path)]
+                slice_touched.update(changed_paths)
+                repo_files = git_file_list(cwd)
+
+            if refusal is not None:
+                # Nothing was written, so there is nothing to check or review.
+                check_results = []
+                pre_review_flags = []
+                review_source = "apply"
+                if refusal.view == "outline":
+                    refused_outlines.add(refusal.path)
+                    fix = f"{refusal.path} is included in full in the next prompt; base the change on that content."
+                else:
+                    fix = f"Edit {refusal.path} with replace_lines against the line numbers shown."
+                review = ReviewResult(passed=False, issues=[str(refusal)], required_fixes=[fix], raw_output="[apply] refused")
+                logger.write_text(f"{slice_dir}/02-attempt-{attempt}/apply_refused.txt", str(refusal))
+                if conversation is not None:
+                    # A delta turn would not resend file context; start over with a full prompt.
+                    conversation = SliceConversation(cwd)
+            else:
+                with profiler.phase(f"{attempt_key}/checks"):
+                    command_list = combine_commands(spec.check_commands, slice_plan.check_commands)
+                    check_results = run_checks(
+                        command_list,
+                        cwd=cwd,
+                        timeout_seconds=spec.command_timeout_seconds,
+                        logger=logger,
+                        log_prefix=f"{slice_dir}/02-attempt-{attempt}",
+                        sharded_checks=spec.sharded_checks,
+                        flaky=flaky,
+                        scheduler=scheduler,
+                        warm_checks=spec.warm_checks,
+                        changed_paths=changed_paths,
+                        changed_since=applied_at,
+                    )
+                with profiler.phase(f"{attempt_key}/diff"):
+                    diff_text = git_diff_for_paths(cwd, sorted(slice_touched))
+                with profiler.phase(f"{attempt_key}/review"):
+                    review, pre_review_flags = pre_review_slice(
+                        cwd=cwd,
+                        files_to_read=files_to_read,
+                        files_to_create=files_to_create,
+                        changed_paths=changed_paths,
+                        touched_paths=sorted(slice_touched),
+                        content_changed=content_changed,
+                        check_results=check_results,
+                        files_hint=slice_plan.files_hint,
+                    )
+                    review_source = "pre-review" if review is not None else "model"
+                    if review is not None:
+                        summary["review_calls_skipped"] += 1
+                        logger.write_text(f"{slice_dir}/02-attempt-{attempt}/pre_review.txt", review.raw_output)
+                    else:
+                        summary["review_model_calls"] += 1
+                        review = review_slice(
+                            client=router.client("review"),
+                            spec=spec,
+                            slice_plan=slice_plan,
+                            touched_paths=sorted(slice_touched),
+                            diff_text=diff_text,
+                            check_results=check_results,
+                            logger=logger,
+                            slice_dir=slice_dir,
+                            attempt=attempt,
+                            pre_review_flags=pre_review_flags,
+                        )
             attempt_summary = {
                 "attempt": attempt,
                 "changed_paths": changed_paths,
                 "checks_passed": checks_passed(check_results),
+                "check_reruns": [
+                    {
+                        "command": result.command,
+                        "reruns": result.reruns,
+                        "flaky_tests": result.flaky_tests,
+                        "quarantined_tests": result.quarantined_tests,
+                    }
+                    for result in check_results
+                    if result.reruns or result.flaky_tests or result.quarantined_tests
+                ],
+                "check_usage": [{"command": result.command, **result.usage} for result in check_results],
+                "review_source": review_source,
+                "pre_review_flags": pre_review_flags,
                 "review_passed": review.passed,
                 "review_issues": review.issues,
                 "review_required_fixes": review.required_fixes,
+                "implementer_prompt_mode": prompt_mode,
+                "implementer_prompt_chars": conversation.last_prompt_chars if conversation is not None else None,
+                "duration_seconds": round(time.perf_counter() - attempt_started, 3),
             }
             attempt_summaries.append(attempt_summary)
             logger.write_json(f"{slice_dir}/02-attempt-{attempt}/attempt_summary.json", attempt_summary)
 
+            router.record_outcome("implement", checks_passed(check_results) and review.passed)
             if checks_passed(check_results) and review.passed:
                 slice_passed = True
                 break
@@ -1078,6 +4353,8 @@ def run(spec: Spec, continue_on_failure: bool) -> int:
             feedback = format_feedback(check_results, review)
             logger.write_text(f"{slice_dir}/02-attempt-{attempt}/feedback_for_next_attempt.txt", feedback)
 
+        # A selection is only as good as the slice it fed.
+        router.record_outcome("select", slice_passed)
         slice_summary = {
             "slice": dataclasses.asdict(slice_plan),
             "passed": slice_passed,
@@ -1095,38 +4372,939 @@ def run(spec: Spec, continue_on_failure: bool) -> int:
     summary["ended_at"] = dt.datetime.now().isoformat()
     summary["final_changed_paths"] = sorted(current_changed_paths(cwd))
     summary["initial_changed_paths"] = sorted(baseline_changed)
+    if summary_cache is not None:
+        summary["summary_cache"] = summary_cache.stats()
+    summary["file_cache"] = FILE_CACHE.stats(since=file_cache_start)
+    phase_stats.save()
+    flaky.save()
+    summary["flaky_tests"] = flaky.report()
+    summary["check_resources"] = scheduler.summary()
+    summary["model_routes"] = router.routes_used
+    summary["hedging"] = router.hedge_stats.summary()
+    summary["token_usage"] = router.usage
+    summary["prompt_cache"] = prompt_cache_summary(router.usage)
+    summary["phase_model_stats"] = phase_stats.summary()
+    summary["phase_timings"] = [
+        {"phase": record["phase"], "wall_seconds": record["wall_seconds"]} for record in profiler.phases
+    ]
     logger.write_json("summary-final.json", summary)
+    profiler.write_summary()
+    with HistoryIndex(cwd) as history:
+        history.index_run(run_dir.name, summary, size_bytes=directory_size(run_dir))
+        if spec.retention is not None:
+            archived = apply_retention(cwd, spec.retention, history, exclude={run_dir.name})
+            if archived:
+                print(f"Archived {len(archived)} old run(s) into {cwd / ARCHIVE_DIR}")
 
     print(f"Run directory: {run_dir}")
+    print(f"Reviewer calls: {summary['review_model_calls']} (skipped by pre-review: {summary['review_calls_skipped']})")
+    if summary["prompt_cache"]["prompt_tokens"]:
+        print(
+            f"Prompt cache: {summary['prompt_cache']['cached_prompt_tokens']} of "
+            f"{summary['prompt_cache']['prompt_tokens']} prompt tokens cached ({summary['prompt_cache']['cached_ratio']:.0%})"
+        )
+    if summary["file_cache"]["hits"] + summary["file_cache"]["misses"]:
+        print(
+            f"File cache: {summary['file_cache']['hits']} hits, {summary['file_cache']['misses']} misses "
+            f"({summary['file_cache']['hit_rate']:.0%} hit rate)"
+        )
+    flaky_this_run = sum(len(ids) for ids in summary["flaky_tests"]["flaky_this_run"].values())
+    if flaky_this_run or summary["flaky_tests"]["quarantined"]:
+        print(
+            f"Flaky tests: {flaky_this_run} passed on rerun this run, "
+            f"{len(summary['flaky_tests']['quarantined'])} quarantined (see {FLAKY_TESTS_FILE})"
+        )
+    ignored = summary["flaky_tests"]["quarantined_failures_this_run"]
+    if ignored:
+        print(f"WARNING: {sum(len(ids) for ids in ignored.values())} quarantined test failure(s) were ignored:")
+        for command, ids in ignored.items():
+            for test_id in ids:
+                print(f"  - {command} :: {test_id}")
+    if profile:
+        print(f"Profile summary: {run_dir / PROFILE_DIR / 'summary.txt'}")
     print(f"Failed: {summary['failed']}")
     if summary["failed"]:
         return 1
     return 0
 
 
-def print_plan(spec: Spec) -> int:
+def run_fanout_repo(spec: Spec, continue_on_failure: bool, profile: bool, plan_from: Path) -> dict[str, Any]:
+    # Runs in a worker process. Output is captured so concurrent repos do not interleave.
+    runs_root = spec.working_directory / RUNS_DIR
+    existing = set(runs_root.iterdir()) if runs_root.exists() else set()
+    output = io.StringIO()
+    started = time.perf_counter()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            exit_code = run(spec, continue_on_failure=continue_on_failure, profile=profile, plan_from=plan_from)
+        except OrchestratorError as exc:
+            exit_code, error = 2, str(exc)
+        finally:
+            # atexit handlers do not run in pool workers, and the watchers are in their own sessions.
+            stop_warm_workers()
+    new_runs = sorted(set(runs_root.iterdir()) - existing) if runs_root.exists() else []
+    summary = run_summary_from_dir(new_runs[-1]) if new_runs else None
+    return {
+        "working_directory": str(spec.working_directory),
+        "run_dir": str(new_runs[-1]) if new_runs else None,
+        "exit_code": exit_code,
+        "error": error,
+        "failed": exit_code != 0,
+        "slices": slice_outcomes(summary or {}),
+        "token_usage": (summary or {}).get("token_usage", {}),
+        "duration_seconds": round(time.perf_counter() - started, 3),
+        "output": output.getvalue(),
+    }
+
+
+def run_fanout(spec: Spec, continue_on_failure: bool, profile: bool, client: Any | None) -> int:
+    # One plan against working_directory, then every repo runs its slices in its own process
+    # with its own run directory; checks across repos still share the host-wide slots.
+    missing = [str(path) for path in spec.working_directories if not path.is_dir()]
+    if missing:
+        raise OrchestratorError(f"Working directories do not exist: {', '.join(missing)}")
     cwd = spec.working_directory
-    run_dir = cwd / RUNS_DIR / now_stamp()
-    logger = RunLogger(run_dir)
+    fanout_dir = new_run_dir(cwd, FANOUT_DIR)
+    logger = RunLogger(fanout_dir)
     logger.write_json("spec.json", spec_to_payload(spec))
+    profiler = PhaseProfiler(logger, enabled=profile)
+    started = time.perf_counter()
+    summary: dict[str, Any] = {
+        "started_at": dt.datetime.now().isoformat(),
+        "fanout_dir": str(fanout_dir),
+        "spec_path": spec.spec_path,
+        "spec_id": spec_identity(spec),
+        "goal": spec.goal,
+    }
+
+    with profiler.phase("plan"):
+        router = ModelRouter(spec, client or create_client(spec), PhaseStats(cwd))
+        slices = build_plan(
+            client=router.client("plan"),
+            spec=spec,
+            repo_files=git_file_list(cwd),
+            context_text=read_context_files(spec, cwd),
+            logger=logger,
+        )
+    summary["plan"] = [{"id": item.id, "title": item.title} for item in slices]
+    summary["plan_token_usage"] = router.usage
+
+    repos: list[dict[str, Any]] = []
+    with profiler.phase("repos"):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(spec.working_directories)) as pool:
+            futures = {
+                pool.submit(
+                    run_fanout_repo,
+                    dataclasses.replace(spec, working_directory=path, working_directories=[]),
+                    continue_on_failure,
+                    profile,
+                    fanout_dir,
+                ): path
+                for path in spec.working_directories
+            }
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    result = {
+                        "working_directory": str(path),
+                        "run_dir": None,
+                        "exit_code": 2,
+                        "error": f"{type(exc).__name__}: {exc}",
+                        "failed": True,
+                        "slices": [],
+                        "token_usage": {},
+                        "output": "",
+                    }
+                print(f"==> {path}")
+                print(result.pop("output"), end="")
+                repos.append(result)
+
+    summary["ended_at"] = dt.datetime.now().isoformat()
+    summary["wall_seconds"] = round(time.perf_counter() - started, 3)
+    order = {str(path): index for index, path in enumerate(spec.working_directories)}
+    summary["repos"] = sorted(repos, key=lambda item: order[item["working_directory"]])
+    summary["failed"] = any(item["failed"] for item in repos)
+    logger.write_json("summary-final.json", summary)
+    profiler.write_summary()
+
+    print(f"Fan-out directory: {fanout_dir}")
+    for item in summary["repos"]:
+        passed = sum(1 for outcome in item["slices"] if outcome["passed"])
+        status = "error" if item["error"] else "failed" if item["failed"] else "passed"
+        print(
+            f"  {item['working_directory']}: {status}, {passed}/{len(slices)} slices passed"
+            + (f" ({item['error']})" if item["error"] else f", run directory {item['run_dir']}")
+        )
+    print(f"Failed: {summary['failed']}")
+    return max((item["exit_code"] for item in repos), default=0)
+
 
-    repo_files = git_file_list(cwd)
-    context_text = read_context_files(spec, cwd)
-    client = create_client(spec)
-    slices = build_plan(client=client, spec=spec, repo_files=repo_files, context_text=context_text, logger=logger)
+def print_plan(spec: Spec, profile: bool = False, client: Any | None = None) -> int:
+    cwd = spec.working_directory
+    run_dir = new_run_dir(cwd)
+    logger = RunLogger(run_dir)
+    logger.write_json("spec.json", spec_to_payload(spec))
+    profiler = PhaseProfiler(logger, enabled=profile)
+
+    with profiler.phase("setup"):
+        repo_files = git_file_list(cwd)
+        context_text = read_context_files(spec, cwd)
+        phase_stats = PhaseStats(cwd)
+        router = ModelRouter(spec, client or create_client(spec), phase_stats)
+    with profiler.phase("plan"):
+        slices = build_plan(
+            client=router.client("plan"),
+            spec=spec,
+            repo_files=repo_files,
+            context_text=context_text,
+            logger=logger,
+        )
+    phase_stats.save()
+    profiler.write_summary()
     print(json.dumps([dataclasses.asdict(item) for item in slices], indent=2, ensure_ascii=False))
     print(f"\nPlan logs: {run_dir}")
     return 0
 
 
+def spec_identity(spec: Spec) -> str:
+    # Stable across runs of the same spec file; falls back to the goal text for ad-hoc specs.
+    source = spec.spec_path or spec.goal
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+
+def git_baseline(cwd: Path) -> dict[str, str | None]:
+    # HEAD plus a dangling stash commit of uncommitted tracked changes, so replay can rebuild the tree.
+    code, head = run_cmd("git rev-parse HEAD", cwd=cwd, timeout_seconds=30)
+    stash_code, stash = run_cmd("git stash create", cwd=cwd, timeout_seconds=60)
+    return {
+        "head": head.strip() if code == 0 else None,
+        "stash": stash.strip() if stash_code == 0 and stash.strip() else None,
+    }
+
+
+class ReplayClient:
+    # Serves a run directory's recorded responses, in their original order per phase.
+    supports_history = True
+
+    def __init__(self, run_dir: Path):
+        self.lock = threading.Lock()
+        self.calls = {phase: 0 for phase in MODEL_PHASES}
+        self.queues: dict[str, list[Any]] = {
+            "plan": [run_dir / "01-plan" / "raw_response.txt"],
+            "select": [],
+            "implement": [],
+            "review": [],
+        }
+        for slice_dir in sorted((run_dir / "02-slices").glob("*")) if (run_dir / "02-slices").exists() else []:
+            for name in ("raw_directory_response.txt", "raw_response.txt"):
+                selection = slice_dir / "01-file-selection" / name
+                if selection.exists():
+                    self.queues["select"].append(selection)
+            attempts = sorted(slice_dir.glob("02-attempt-*"), key=lambda path: int(path.name.rsplit("-", 1)[1]))
+            for attempt_dir in attempts:
+                implementer = attempt_dir / "raw_implementer_response.txt"
+                if implementer.exists():
+                    self.queues["implement"].append(implementer)
+                chunks = {
+                    int(path.stem.rsplit("-", 1)[1]): path
+                    for path in attempt_dir.glob("raw_reviewer_response-chunk-*.txt")
+                }
+                if chunks:
+                    self.queues["review"].append(chunks)
+                elif (attempt_dir / "raw_reviewer_response.txt").exists():
+                    self.queues["review"].append({0: attempt_dir / "raw_reviewer_response.txt"})
+        self.queues["plan"] = [path for path in self.queues["plan"] if path.exists()]
+
+    def complete(self, *, system_prompt: str, user_prompt: str, **kwargs: Any) -> str:
+        phase = next((name for marker, name in REPLAY_PHASE_PROMPTS.items() if marker in system_prompt), None)
+        if phase is None:
+            raise OrchestratorError("Replay diverged: unrecognised model call.")
+        with self.lock:
+            pending = self.queues[phase]
+            if not pending:
+                raise OrchestratorError(f"Replay diverged: no recorded {phase} response left (call {self.calls[phase] + 1}).")
+            self.calls[phase] += 1
+            if phase != "review":
+                return pending.pop(0).read_text(encoding="utf-8")
+            chunk_match = REPLAY_CHUNK_PATTERN.search(user_prompt)
+            chunk = int(chunk_match.group(1)) if chunk_match else 0
+            group = pending[0]
+            path = group.pop(chunk, None)
+            if not group:
+                pending.pop(0)
+        if path is None:
+            raise OrchestratorError(f"Replay diverged: no recorded review response for chunk {chunk}.")
+        return path.read_text(encoding="utf-8")
+
+    def unused(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                phase: sum(len(item) if isinstance(item, dict) else 1 for item in pending)
+                for phase, pending in self.queues.items()
+            }
+
+
+def phase_category(name: str) -> str:
+    # "03-S3/attempt-2/checks" -> "checks"; "03-S3/select" -> "select"; "setup" -> "setup".
+    return name.rsplit("/", 1)[-1]
+
+
+def phase_totals(phase_timings: list[dict[str, Any]]) -> dict[str, float]:
+    totals: dict[str, float] = {}
+    for record in phase_timings:
+        category = phase_category(record.get("phase", ""))
+        totals[category] = round(totals.get(category, 0.0) + float(record.get("wall_seconds", 0.0)), 3)
+    return totals
+
+
+def slice_outcomes(summary: dict[str, Any]) -> list[dict[str, Any]]:
+    return [
+        {
+            "slice": item.get("slice", {}).get("id"),
+            "passed": item.get("passed"),
+            "attempts": len(item.get("attempts", [])),
+        }
+        for item in summary.get("slices", [])
+    ]
+
+
+def replay_run(run_dir: Path, continue_on_failure: bool, profile: bool, keep_worktree: bool) -> int:
+    run_dir = run_dir.resolve()
+    spec = load_spec(run_dir / "spec.json")
+    source_cwd = spec.working_directory
+    original_summary = run_summary_from_dir(run_dir) or {}
+    try:
+        baseline = json.loads((run_dir / "baseline.json").read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError):
+        baseline = {}
+    head = baseline.get("head") or "HEAD"
+
+    worktree = Path(tempfile.mkdtemp(prefix="ai_orchestrator_replay_")) / "worktree"
+    code, output = run_cmd(
+        f"git worktree add --detach {shell_quote(str(worktree))} {shell_quote(head)}",
+        cwd=source_cwd,
+        timeout_seconds=300,
+    )
+    if code != 0:
+        raise OrchestratorError(f"Failed to create replay worktree at {head}:\n{output}")
+    try:
+        if baseline.get("stash"):
+            code, output = run_cmd(
+                f"git diff --binary {shell_quote(head)} {shell_quote(baseline['stash'])} | git apply --allow-empty",
+                cwd=worktree,
+                timeout_seconds=300,
+            )
+            if code != 0:
+                raise OrchestratorError(f"Failed to restore the run's uncommitted baseline:\n{output}")
+        for name in REPLAY_SHARED_DIRS:
+            if (source_cwd / name).is_dir() and not (worktree / name).exists():
+                (worktree / name).symlink_to(source_cwd / name)
+
+        replay_spec = dataclasses.replace(
+            spec,
+            working_directory=worktree,
+            phase_models={},
+            auto_route=None,
+            hedging=None,
+            retention=None,
+            warm_checks={},
+        )
+        client = ReplayClient(run_dir)
+        error = None
+        try:
+            exit_code = run(replay_spec, continue_on_failure=continue_on_failure, profile=profile, client=client)
+        except OrchestratorError as exc:
+            exit_code, error = 2, str(exc)
+
+        replay_runs = sorted((worktree / RUNS_DIR).iterdir()) if (worktree / RUNS_DIR).exists() else []
+        if not replay_runs:
+            raise OrchestratorError(f"Replay produced no run directory: {error}")
+        replay_summary = run_summary_from_dir(replay_runs[-1]) or {}
+        destination = source_cwd / REPLAYS_DIR / f"{run_dir.name}--{replay_runs[-1].name}"
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copytree(replay_runs[-1], destination)
+
+        original_totals = phase_totals(original_summary.get("phase_timings", []))
+        replay_totals = phase_totals(replay_summary.get("phase_timings", []))
+        report = {
+            "source_run": str(run_dir),
+            "replay_run": str(destination),
+            "error": error,
+            "unused_responses": client.unused(),
+            "outcomes_match": slice_outcomes(original_summary) == slice_outcomes(replay_summary),
+            "original_outcomes": slice_outcomes(original_summary),
+            "replay_outcomes": slice_outcomes(replay_summary),
+            "phase_seconds": {
+                phase: {"original": original_totals.get(phase), "replay": replay_totals.get(phase)}
+                for phase in sorted(set(original_totals) | set(replay_totals))
+            },
+            "phase_timings": replay_summary.get("phase_timings", []),
+        }
+        (destination / "replay-report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    finally:
+        if keep_worktree:
+            print(f"Replay worktree kept at {worktree}")
+        else:
+            run_cmd(f"git worktree remove --force {shell_quote(str(worktree))}", cwd=source_cwd, timeout_seconds=300)
+            shutil.rmtree(worktree.parent, ignore_errors=True)
+
+    print(f"Replay of {run_dir.name}: {destination}")
+    print(f"{'phase':<12} {'original_s':>11} {'replay_s':>10}")
+    for phase, seconds in report["phase_seconds"].items():
+        original = f"{seconds['original']:.2f}" if seconds["original"] is not None else "-"
+        replayed = f"{seconds['replay']:.2f}" if seconds["replay"] is not None else "-"
+        print(f"{phase:<12} {original:>11} {replayed:>10}")
+    if error:
+        print(f"Replay stopped: {error}")
+    elif not report["outcomes_match"] or any(report["unused_responses"].values()):
+        print(f"Replay diverged from the original run (unused responses: {report['unused_responses']}).")
+    return exit_code
+
+
+class HistoryIndex:
+    # Compact SQLite index of runs, slices and attempts, so history queries never walk run dirs.
+    def __init__(self, cwd: Path):
+        path = cwd / HISTORY_DB_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), timeout=30)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                spec_id TEXT,
+                spec_path TEXT,
+                goal TEXT,
+                started_at TEXT,
+                ended_at TEXT,
+                failed INTEGER,
+                duration_seconds REAL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                bytes INTEGER,
+                archive_path TEXT
+            );
+            CREATE TABLE IF NOT EXISTS slices (
+                run_id TEXT,
+                slice_index INTEGER,
+                slice_id TEXT,
+                title TEXT,
+                passed INTEGER,
+                attempts INTEGER,
+                PRIMARY KEY (run_id, slice_index)
+            );
+            CREATE TABLE IF NOT EXISTS attempts (
+                run_id TEXT,
+                slice_index INTEGER,
+                attempt INTEGER,
+                checks_passed INTEGER,
+                review_passed INTEGER,
+                review_source TEXT,
+                duration_seconds REAL,
+                PRIMARY KEY (run_id, slice_index, attempt)
+            );
+            CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+            """
+        )
+
+    def __enter__(self) -> HistoryIndex:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.db.commit()
+        self.db.close()
+
+    def index_run(self, run_id: str, summary: dict[str, Any], size_bytes: int | None = None) -> None:
+        started, ended = summary.get("started_at"), summary.get("ended_at")
+        duration = None
+        if isinstance(started, str) and isinstance(ended, str):
+            duration = (dt.datetime.fromisoformat(ended) - dt.datetime.fromisoformat(started)).total_seconds()
+        usage = summary.get("token_usage") or {}
+        prompt_tokens = sum(phase.get("prompt_tokens", 0) for phase in usage.values())
+        completion_tokens = sum(phase.get("completion_tokens", 0) for phase in usage.values())
+        self.db.execute("DELETE FROM slices WHERE run_id = ?", (run_id,))
+        self.db.execute("DELETE FROM attempts WHERE run_id = ?", (run_id,))
+        self.db.execute(
+            """
+            INSERT INTO runs (run_id, spec_id, spec_path, goal, started_at, ended_at, failed,
+                              duration_seconds, prompt_tokens, completion_tokens, bytes, archive_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL)
+            ON CONFLICT (run_id) DO UPDATE SET
+                spec_id = excluded.spec_id, spec_path = excluded.spec_path, goal = excluded.goal,
+                started_at = excluded.started_at, ended_at = excluded.ended_at, failed = excluded.failed,
+                duration_seconds = excluded.duration_seconds, prompt_tokens = excluded.prompt_tokens,
+                completion_tokens = excluded.completion_tokens, bytes = COALESCE(excluded.bytes, runs.bytes)
+            """,
+            (
+                run_id,
+                summary.get("spec_id") or hashlib.sha1(str(summary.get("goal", "")).encode("utf-8")).hexdigest()[:12],
+                summary.get("spec_path"),
+                summary.get("goal"),
+                started,
+                ended,
+                int(bool(summary.get("failed"))) if ended else None,
+                duration,
+                prompt_tokens,
+                completion_tokens,
+                size_bytes,
+            ),
+        )
+        for slice_index, slice_summary in enumerate(summary.get("slices", []), start=1):
+            attempts = slice_summary.get("attempts", [])
+            self.db.execute(
+                "INSERT INTO slices VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    run_id,
+                    slice_index,
+                    slice_summary.get("slice", {}).get("id"),
+                    slice_summary.get("slice", {}).get("title"),
+                    int(bool(slice_summary.get("passed"))),
+                    len(attempts),
+                ),
+            )
+            for attempt in attempts:
+                self.db.execute(
+                    "INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run_id,
+                        slice_index,
+                        attempt.get("attempt"),
+                        int(bool(attempt.get("checks_passed"))),
+                        int(bool(attempt.get("review_passed"))),
+                        attempt.get("review_source"),
+                        attempt.get("duration_seconds"),
+                    ),
+                )
+        self.db.commit()
+
+    def mark_archived(self, run_ids: list[str], archive_path: str) -> None:
+        self.db.executemany("UPDATE runs SET archive_path = ? WHERE run_id = ?", [(archive_path, run_id) for run_id in run_ids])
+        self.db.commit()
+
+    def indexed_run_ids(self) -> set[str]:
+        return {row[0] for row in self.db.execute("SELECT run_id FROM runs")}
+
+    def run_sizes(self) -> dict[str, int]:
+        # Sizes of finished, unarchived runs; a finished run directory no longer grows.
+        rows = self.db.execute(
+            "SELECT run_id, bytes FROM runs WHERE bytes IS NOT NULL AND ended_at IS NOT NULL AND archive_path IS NULL"
+        )
+        return {run_id: size for run_id, size in rows}
+
+    def query(self, since: str, group_by: str) -> list[dict[str, Any]]:
+        group_expr = {"spec": "r.spec_id", "day": "substr(r.started_at, 1, 10)"}[group_by]
+        rows = self.db.execute(
+            f"""
+            SELECT {group_expr} AS grp,
+                   MAX(r.spec_path), MAX(r.goal),
+                   COUNT(*),
+                   SUM(CASE WHEN r.failed = 0 THEN 1 ELSE 0 END),
+                   AVG(r.duration_seconds),
+                   SUM(r.prompt_tokens), SUM(r.completion_tokens),
+                   (SELECT COUNT(*) FROM slices s JOIN runs r2 ON s.run_id = r2.run_id
+                     WHERE {group_expr.replace("r.", "r2.")} = {group_expr} AND r2.started_at >= ? AND r2.ended_at IS NOT NULL),
+                   (SELECT SUM(s.passed) FROM slices s JOIN runs r2 ON s.run_id = r2.run_id
+                     WHERE {group_expr.replace("r.", "r2.")} = {group_expr} AND r2.started_at >= ? AND r2.ended_at IS NOT NULL),
+                   (SELECT COUNT(*) FROM attempts a JOIN runs r2 ON a.run_id = r2.run_id
+                     WHERE {group_expr.replace("r.", "r2.")} = {group_expr} AND r2.started_at >= ? AND r2.ended_at IS NOT NULL)
+            FROM runs r
+            WHERE r.started_at >= ? AND r.ended_at IS NOT NULL
+            GROUP BY grp
+            ORDER BY grp
+            """,
+            (since, since, since, since),
+        ).fetchall()
+        results = []
+        for grp, spec_path, goal, runs, passed, avg_duration, prompt_tokens, completion_tokens, slices, slices_passed, attempts in rows:
+            results.append(
+                {
+                    group_by: grp,
+                    "spec_path": spec_path,
+                    "goal": (goal or "")[:80],
+                    "runs": runs,
+                    "runs_passed": passed or 0,
+                    "pass_rate": round((passed or 0) / runs, 3) if runs else 0.0,
+                    "slices": slices,
+                    "slice_pass_rate": round((slices_passed or 0) / slices, 3) if slices else 0.0,
+                    "attempts": attempts,
+                    "avg_duration_seconds": round(avg_duration, 1) if avg_duration is not None else None,
+                    "prompt_tokens": prompt_tokens or 0,
+                    "completion_tokens": completion_tokens or 0,
+                }
+            )
+        return results
+
+
+def directory_size(path: Path) -> int:
+    return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+
+
+def run_summary_from_dir(run_dir: Path) -> dict[str, Any] | None:
+    for name in ("summary-final.json", "summary-progress.json"):
+        try:
+            return json.loads((run_dir / name).read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return None
+
+
+def reindex_runs(cwd: Path, history: HistoryIndex) -> int:
+    runs_root = cwd / RUNS_DIR
+    count = 0
+    for run_dir in sorted(runs_root.iterdir()) if runs_root.exists() else []:
+        summary = run_summary_from_dir(run_dir) if run_dir.is_dir() else None
+        if summary is None:
+            continue
+        history.index_run(run_dir.name, summary, size_bytes=directory_size(run_dir))
+        count += 1
+    return count
+
+
+def apply_retention(
+    cwd: Path,
+    policy: RetentionPolicy,
+    history: HistoryIndex,
+    exclude: set[str] | None = None,
+) -> list[str]:
+    runs_root = cwd / RUNS_DIR
+    if not runs_root.exists():
+        return []
+    now = time.time()
+    runs = []
+    sizes = history.run_sizes()
+    for run_dir in sorted(runs_root.iterdir()):
+        if not run_dir.is_dir():
+            continue
+        size = sizes.get(run_dir.name)
+        if size is None:
+            # Only runs the index has no size for are walked; finished ones are indexed once.
+            size = directory_size(run_dir)
+            summary = run_summary_from_dir(run_dir) if (run_dir / "summary-final.json").exists() else None
+            if summary is not None:
+                history.index_run(run_dir.name, summary, size_bytes=size)
+        runs.append((run_dir, run_dir.stat().st_mtime, size))
+
+    # Oldest first; the newest keep_recent runs, excluded runs and runs that may
+    # still be in progress are never archived, but still count towards the limits.
+    candidates = [
+        (run_dir, mtime, size)
+        for run_dir, mtime, size in runs[: max(0, len(runs) - policy.keep_recent)]
+        if run_dir.name not in (exclude or set())
+        and ((run_dir / "summary-final.json").exists() or now - mtime >= ARCHIVE_MIN_IDLE_SECONDS)
+    ]
+    selected: list[tuple[Path, int]] = []
+    total_bytes = sum(size for _, _, size in runs)
+    remaining = len(runs)
+    for run_dir, mtime, size in candidates:
+        too_old = policy.max_age_days is not None and now - mtime > policy.max_age_days * 86_400
+        too_many = policy.max_runs is not None and remaining > policy.max_runs
+        too_big = policy.max_bytes is not None and total_bytes > policy.max_bytes
+        if not (too_old or too_many or too_big):
+            continue
+        selected.append((run_dir, size))
+        remaining -= 1
+        total_bytes -= size
+    if not selected:
+        return []
+
+    indexed = history.indexed_run_ids()
+    for run_dir, size in selected:
+        summary = run_summary_from_dir(run_dir) if run_dir.name not in indexed else None
+        if summary is not None:
+            history.index_run(run_dir.name, summary, size_bytes=size)
+    selected_dirs = [run_dir for run_dir, _ in selected]
+
+    archive_root = cwd / ARCHIVE_DIR
+    archive_root.mkdir(parents=True, exist_ok=True)
+    base_name = f"runs-{selected_dirs[0].name}--{selected_dirs[-1].name}"
+    archive_path = archive_root / f"{base_name}.tar.xz"
+    suffix = 2
+    while archive_path.exists():
+        archive_path = archive_root / f"{base_name}-{suffix}.tar.xz"
+        suffix += 1
+    temp_path = archive_path.with_suffix(".tmp")
+    with tarfile.open(temp_path, "w:xz") as archive:
+        for run_dir in selected_dirs:
+            archive.add(str(run_dir), arcname=run_dir.name)
+    temp_path.replace(archive_path)
+    relative_archive = str(archive_path.relative_to(cwd))
+    history.mark_archived([run_dir.name for run_dir in selected_dirs], relative_archive)
+    for run_dir in selected_dirs:
+        shutil.rmtree(run_dir)
+    return [run_dir.name for run_dir in selected_dirs]
+
+
+def print_history(cwd: Path, days: int, group_by: str, as_json: bool, reindex: bool) -> int:
+    with HistoryIndex(cwd) as history:
+        if reindex:
+            print(f"Indexed {reindex_runs(cwd, history)} run(s).", file=sys.stderr)
+        since = (dt.datetime.now() - dt.timedelta(days=days)).isoformat()
+        rows = history.query(since, group_by)
+    if as_json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return 0
+    if not rows:
+        print(f"No runs in the last {days} day(s).")
+        return 0
+    label = "spec" if group_by == "spec" else "day"
+    print(f"{label:<14} {'runs':>5} {'pass':>6} {'slices':>7} {'slice%':>7} {'avg_s':>8} {'tokens':>10}  goal")
+    for row in rows:
+        key = row[group_by] or "-"
+        tokens = row["prompt_tokens"] + row["completion_tokens"]
+        avg = f"{row['avg_duration_seconds']:.0f}" if row["avg_duration_seconds"] is not None else "-"
+        print(
+            f"{key:<14} {row['runs']:>5} {row['pass_rate']:>6.0%} {row['slices']:>7} "
+            f"{row['slice_pass_rate']:>7.0%} {avg:>8} {tokens:>10}  {row['goal']}"
+        )
+    return 0
+
+
+class DaemonState:
+    # Warm state shared by all jobs in one `serve` process. Repo file lists and context files
+    # live in the module-level caches; clients (and their keep-alive HTTP pools) live here.
+    def __init__(self) -> None:
+        self.clients: dict[tuple[str, str, str, str], Any] = {}
+        self.jobs: dict[str, dict[str, Any]] = {}
+        self.queue: queue.Queue[str | None] = queue.Queue()
+        self.lock = threading.Lock()
+        self.next_job_number = 1
+
+    def client_for(self, spec: Spec) -> Any:
+        key = (spec.model_backend, spec.model, spec.api_base_url, str(spec.working_directory))
+        client = self.clients.get(key)
+        if client is None:
+            client = create_client(spec)
+            self.clients[key] = client
+        return client
+
+    def submit(self, request: dict[str, Any]) -> dict[str, Any]:
+        job_type = request.get("job")
+        spec_path = request.get("spec")
+        if job_type not in {"plan", "run"} or not isinstance(spec_path, str):
+            raise OrchestratorError("Job requires 'job' (plan|run) and an absolute 'spec' path.")
+        cwd = str(request.get("cwd") or Path.cwd())
+        # Validate eagerly so a bad spec is reported to the submitter, not buried in the job log.
+        load_spec(Path(spec_path), base_dir=Path(cwd))
+        with self.lock:
+            job_id = f"{now_stamp()}-{self.next_job_number:04d}"
+            self.next_job_number += 1
+            self.jobs[job_id] = {
+                "id": job_id,
+                "job": job_type,
+                "spec": spec_path,
+                "cwd": cwd,
+                "continue_on_failure": bool(request.get("continue_on_failure", False)),
+                "profile": bool(request.get("profile", False)),
+                "status": "queued",
+                "submitted_at": dt.datetime.now().isoformat(),
+            }
+            self._forget_old_jobs()
+        self.queue.put(job_id)
+        return {"ok": True, "job_id": job_id, "status": "queued", "queued_jobs": self.queue.qsize()}
+
+    def _forget_old_jobs(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in {"done", "failed"}]
+        for job_id in finished[: max(0, len(finished) - DAEMON_MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def status(self, job_id: str | None) -> dict[str, Any]:
+        with self.lock:
+            if job_id:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    raise OrchestratorError(f"Unknown job id: {job_id}")
+                return {"ok": True, "job": dict(job)}
+            jobs = [{key: value for key, value in job.items() if key != "output"} for job in self.jobs.values()]
+        return {"ok": True, "jobs": jobs, "cached_clients": len(self.clients)}
+
+    def work_forever(self) -> None:
+        while True:
+            job_id = self.queue.get()
+            if job_id is None:
+                return
+            with self.lock:
+                job = self.jobs[job_id]
+                job["status"] = "running"
+                job["started_at"] = dt.datetime.now().isoformat()
+            output = io.StringIO()
+            try:
+                # Relative spec fields (working_directory) resolve against the submitter's cwd;
+                # the daemon's own cwd never changes, so its socket path stays valid.
+                spec = load_spec(Path(job["spec"]), base_dir=Path(job["cwd"]))
+                client = self.client_for(spec)
+                # Jobs run one at a time on this thread, so redirecting stdout is safe here.
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    if job["job"] == "plan":
+                        exit_code = print_plan(spec, profile=job["profile"], client=client)
+                    else:
+                        exit_code = run(
+                            spec,
+                            continue_on_failure=job["continue_on_failure"],
+                            profile=job["profile"],
+                            client=client,
+                        )
+                status, error = "done", None
+            except Exception as exc:
+                exit_code, status, error = 2, "failed", f"{type(exc).__name__}: {exc}"
+            with self.lock:
+                job.update(
+                    status=status,
+                    exit_code=exit_code,
+                    error=error,
+                    output=output.getvalue(),
+                    ended_at=dt.datetime.now().isoformat(),
+                )
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        state: DaemonState = self.server.state  # type: ignore[attr-defined]
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8") or "{}")
+            action = request.get("action")
+            if action == "submit":
+                response = state.submit(request)
+            elif action == "status":
+                response = state.status(request.get("job_id"))
+            elif action == "shutdown":
+                state.queue.put(None)
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                response = {"ok": True, "status": "shutting down"}
+            else:
+                raise OrchestratorError(f"Unknown daemon action: {action!r}")
+        except (OrchestratorError, json.JSONDecodeError) as exc:
+            response = {"ok": False, "error": str(exc)}
+        self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, state: DaemonState):
+        self.state = state
+        super().__init__(socket_path, DaemonRequestHandler)
+
+
+def serve(socket_path: Path) -> int:
+    socket_path = socket_path.resolve()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        try:
+            send_daemon_request(socket_path, {"action": "status"})
+        except OrchestratorError:
+            socket_path.unlink()  # Stale socket left by a crashed daemon.
+        else:
+            raise OrchestratorError(f"A daemon is already listening on {socket_path}")
+
+    state = DaemonState()
+    worker = threading.Thread(target=state.work_forever, name="orchestrator-jobs", daemon=True)
+    worker.start()
+    with DaemonServer(str(socket_path), state) as server:
+        print(f"Serving on {socket_path}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            state.queue.put(None)
+        finally:
+            socket_path.unlink(missing_ok=True)
+    worker.join()
+    for client in state.clients.values():
+        pool = getattr(client, "pool", None)
+        if pool is not None:
+            pool.close()
+    return 0
+
+
+def send_daemon_request(socket_path: Path, request: dict[str, Any]) -> dict[str, Any]:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(30)
+            sock.connect(str(socket_path))
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as stream:
+                line = stream.readline()
+    except OSError as exc:
+        raise OrchestratorError(f"Could not reach orchestrator daemon at {socket_path}: {exc}") from exc
+    try:
+        response = json.loads(line.decode("utf-8"))
+    except json.JSONDecodeError as exc:
+        raise OrchestratorError(f"Invalid daemon response: {line!r}") from exc
+    if not response.get("ok"):
+        raise OrchestratorError(f"Daemon rejected request: {response.get('error')}")
+    return response
+
+
 def main() -> int:
     try:
         args = parse_args()
+        if args.command == "serve":
+            return serve(Path(args.socket))
+        if args.command == "submit":
+            response = send_daemon_request(
+                Path(args.socket),
+                {
+                    "action": "submit",
+                    "job": args.job,
+                    "spec": str(Path(args.spec).resolve()),
+                    "cwd": str(Path.cwd()),
+                    "continue_on_failure": bool(args.continue_on_failure),
+                    "profile": bool(args.profile),
+                },
+            )
+            print(json.dumps(response, indent=2, ensure_ascii=False))
+            return 0
+        if args.command == "replay":
+            return replay_run(
+                Path(args.run_dir),
+                continue_on_failure=bool(args.continue_on_failure),
+                profile=bool(args.profile),
+                keep_worktree=bool(args.keep_worktree),
+            )
+        if args.command == "history":
+            return print_history(
+                Path(args.cwd).resolve(),
+                days=args.days,
+                group_by=args.group_by,
+                as_json=bool(args.json),
+                reindex=bool(args.reindex),
+            )
+        if args.command == "archive":
+            policy = parse_retention(
+                {
+                    key: value
+                    for key, value in {
+                        "max_age_days": args.max_age_days,
+                        "max_runs": args.max_runs,
+                        "max_bytes": args.max_bytes,
+                        "keep_recent": args.keep_recent,
+                    }.items()
+                    if value is not None
+                },
+                "archive options",
+            )
+            cwd = Path(args.cwd).resolve()
+            assert policy is not None
+            with HistoryIndex(cwd) as history:
+                archived = apply_retention(cwd, policy, history)
+            print(f"Archived {len(archived)} run(s) into {cwd / ARCHIVE_DIR}")
+            return 0
+        if args.command == "status":
+            request: dict[str, Any] = {"action": "shutdown" if args.shutdown else "status"}
+            if args.job:
+                request["job_id"] = args.job
+            print(json.dumps(send_daemon_request(Path(args.socket), request), indent=2, ensure_ascii=False))
+            return 0
         spec = load_spec(Path(args.spec))
         if args.command == "plan":
-            return print_plan(spec)
+            return print_plan(spec, profile=bool(args.profile))
         if args.command == "run":
-            return run(spec, continue_on_failure=bool(args.continue_on_failure))
+            return run(
+                spec,
+                continue_on_failure=bool(args.continue_on_failure),
+                profile=bool(args.profile),
+            )
         raise OrchestratorError(f"Unknown command: {args.command}")
     except OrchestratorError as exc:
         print(f"error: {exc}", file=sys.stderr)
@@ -0,0 +1,810 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import runner  # noqa: E402
+
+
+PLAN = {"slices": [{"id": "S1", "title": "t", "objective": "o", "acceptance": ["x"], "files_hint": ["src/a.ts"]}]}
+
+
+class FakeClient:
+    # Answers each phase from its system prompt; enough for plan and single-slice runs.
+    def __init__(self, changes: list[dict] | None = None):
+        self.changes = changes or [{"path": "src/a.ts", "action": "upsert", "content": "export const a = 2;\n"}]
+
+    def complete(self, *, system_prompt: str, user_prompt: str, **_: object) -> str:
+        if "planning" in system_prompt:
+            return json.dumps(PLAN)
+        if "selecting" in system_prompt:
+            return json.dumps({"files_to_read": ["src/a.ts"], "files_to_create": [], "files_to_modify": ["src/a.ts"]})
+        if "implementing" in system_prompt:
+            return json.dumps({"summary": "s", "changes": self.changes})
+        return json.dumps({"pass": True, "issues": [], "required_fixes": []})
+
+
+def git(cwd: Path, *args: str) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src/a.ts").write_text("export const a = 1;\n")
+    (tmp_path / "src/a.test.ts").write_text("test('a', () => {});\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "-c", "user.email=t@t", "-c", "user.name=t", "commit", "-qm", "init")
+    return tmp_path
+
+
+def write_spec(path: Path, **fields: object) -> Path:
+    spec = {"goal": "g", "check_commands": ["true"], "working_directory": ".", **fields}
+    path.write_text(json.dumps(spec))
+    return path
+
+
+def test_daemon_job_resolves_spec_against_submitter_cwd_without_chdir(repo: Path, tmp_path_factory, monkeypatch):
+    monkeypatch.setattr(runner, "create_client", lambda spec: FakeClient())
+    elsewhere = tmp_path_factory.mktemp("daemon")
+    monkeypatch.chdir(elsewhere)
+    spec_path = write_spec(repo / "spec.json")
+    state = runner.DaemonState()
+    job_id = state.submit({"job": "plan", "spec": str(spec_path), "cwd": str(repo)})["job_id"]
+    state.queue.put(None)
+    state.work_forever()
+
+    job = state.status(job_id)["job"]
+    assert job["status"] == "done", job
+    assert Path.cwd() == elsewhere
+    assert any((repo / runner.RUNS_DIR).iterdir())
+
+
+def test_balance_shards_spreads_by_duration_and_keeps_filter_prefixes_together():
+    durations = {"a.test.ts": 8.0, "b.test.ts": 5.0, "c.test.ts": 4.0, "d.test.ts": 1.0}
+    shards = runner.balance_shards([*durations, "a.test.tsx"], durations, 2)
+
+    assert sorted(map(sorted, shards)) == [["a.test.ts", "a.test.tsx"], ["b.test.ts", "c.test.ts", "d.test.ts"]]
+    assert runner.balance_shards(["x.test.ts"], {}, 4) == [["x.test.ts"]]
+
+
+def test_vitest_shards_pass_absolute_paths_within_config_include(tmp_path: Path):
+    (tmp_path / "vitest.config.ts").write_text('export default { test: { include: ["src/**/*.test.{ts,tsx}"] } };\n')
+    config = runner.ShardConfig(shards=2, runner="vitest", test_patterns=runner.DEFAULT_SHARD_TEST_PATTERNS)
+
+    includes = runner.vitest_config_includes(tmp_path)
+    command = runner.shard_command("npx vitest run", config, ["src/a.test.ts"], tmp_path / "r.json", tmp_path)
+
+    assert includes == ["src/**/*.test.ts", "src/**/*.test.tsx"]
+    assert not runner.path_matches("e2e/a.test.ts", includes)
+    assert runner.shell_quote(str(tmp_path.resolve() / "src/a.test.ts")) in command
+    assert "--passWithNoTests" in command
+
+
+def test_vitest_report_durations_are_relative_seconds(tmp_path: Path):
+    report = tmp_path / "report.json"
+    report.write_text(
+        json.dumps(
+            {
+                "testResults": [
+                    {"name": str(tmp_path / "src/a.test.ts"), "startTime": 1000, "endTime": 3500},
+                    {"name": "src/b.test.ts", "startTime": 0},
+                ]
+            }
+        )
+    )
+
+    assert runner.vitest_report_durations(report, tmp_path) == {"src/a.test.ts": 2.5}
+    assert runner.vitest_report_durations(tmp_path / "missing.json", tmp_path) == {}
+
+
+def test_merge_shard_results_reports_first_failure_and_passes_empty_shards():
+    shards = [["a.test.ts"], ["b.test.ts"], ["c.test.ts"]]
+    results = [
+        (1, "No test files found, exiting with code 1", 0.1, {}),
+        (0, "ok", 1.0, {"b.test.ts": 1.0}),
+        (2, "FAIL c.test.ts", 2.0, {"c.test.ts": 2.0}),
+    ]
+
+    exit_code, output, measured = runner.merge_shard_results(shards, results)
+
+    assert exit_code == 2
+    assert "=== shard 1/3 exit_code=0" in output and "=== shard 3/3 exit_code=2" in output
+    assert measured == {"b.test.ts": 1.0, "c.test.ts": 2.0}
+    assert runner.merge_shard_results(shards[:1], results[:1])[0] == 0
+
+
+def test_manifest_expands_breadth_first_within_the_line_budget():
+    files = [f"pkg/d{d}/sub{s}/f{f}.ts" for d in range(20) for s in range(10) for f in range(8)]
+    manifest = runner.RepoManifest(files, {path: 100 for path in files})
+
+    rendered = manifest.render()
+    lines = rendered.splitlines()
+
+    assert rendered == manifest.render()
+    assert lines[0] == "./  (1600 files, 156.2KiB)"
+    assert len(lines) - 1 <= runner.MANIFEST_MAX_LINES
+    # Every directory one level down is listed (expanded) before deeper ones are collapsed.
+    assert all(not line.endswith("…") for line in lines if line.startswith("    d"))
+    assert any(line.strip().startswith("sub") and line.endswith("…") for line in lines)
+    small = runner.RepoManifest(files[:16], {})
+    assert not any(line.endswith("…") for line in small.render().splitlines())
+
+
+class SelectionClient:
+    def __init__(self) -> None:
+        self.prompts: dict[str, str] = {}
+
+    def complete(self, *, system_prompt: str, user_prompt: str, **_: object) -> str:
+        if "selecting directories" in system_prompt:
+            self.prompts["directories"] = user_prompt
+            return json.dumps({"directories": ["pkg/d1", "not/a/dir"]})
+        self.prompts["files"] = user_prompt
+        return json.dumps({"files_to_read": ["pkg/d1/f0.ts"], "files_to_create": [], "files_to_modify": []})
+
+
+def test_large_repos_select_directories_before_files(repo: Path, tmp_path_factory):
+    files = [f"pkg/d{d}/f{f}.ts" for d in range(20) for f in range(40)] + ["lib/x.ts"]
+    assert len(files) > runner.MAX_REPO_FILES
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo)))
+    plan = runner.SlicePlan(id="S1", title="t", objective="o", acceptance=[], check_commands=[], files_hint=["lib/x.ts"])
+    logger = runner.RunLogger(tmp_path_factory.mktemp("run"))
+    client = SelectionClient()
+
+    files_to_read, _, _ = runner.choose_files_for_slice(
+        client=client, spec=spec, slice_plan=plan, repo_files=files, logger=logger, slice_dir="s"
+    )
+
+    assert files_to_read == ["pkg/d1/f0.ts", "lib/x.ts"]
+    assert "d19/  (40 files" in client.prompts["directories"]
+    listing = client.prompts["files"]
+    assert '"pkg/d1/f39.ts"' in listing and '"lib/x.ts"' in listing
+    assert '"pkg/d2/f0.ts"' not in listing
+    selected = json.loads((logger.run_dir / "s/01-file-selection/selected_directories.json").read_text())
+    assert selected == ["pkg/d1", "lib"]
+
+
+def pre_review(repo: Path, touched: list[str], **declared: list[str]):
+    return runner.pre_review_slice(
+        cwd=repo,
+        files_to_read=declared.get("files_to_read", []),
+        files_to_create=[],
+        changed_paths=touched,
+        touched_paths=touched,
+        content_changed=declared.get("content_changed", touched),
+        check_results=[runner.CheckResult(command="true", exit_code=0, output="")],
+        files_hint=declared.get("files_hint", []),
+    )
+
+
+def test_pre_review_flags_declared_test_deletion_for_the_reviewer(repo: Path):
+    (repo / "src/a.test.ts").unlink()
+    review, flags = pre_review(repo, ["src/a.test.ts"], files_hint=["src/a.test.ts"])
+    assert review is None
+    assert any("src/a.test.ts" in flag for flag in flags)
+
+
+def test_pre_review_fails_undeclared_test_deletion(repo: Path):
+    (repo / "src/a.test.ts").unlink()
+    review, _ = pre_review(repo, ["src/a.test.ts"], files_to_read=["src/a.ts"])
+    assert review is not None and not review.passed
+
+
+def test_pre_review_flags_attempt_that_repeats_earlier_edit_as_noop(repo: Path):
+    payload = {"changes": [{"path": "src/a.ts", "action": "upsert", "content": "export const a = 2;\n"}]}
+    runner.apply_changes(repo, payload)  # An earlier attempt of the slice.
+    before = runner.snapshot_changed_files(repo, payload)
+    changed = runner.apply_changes(repo, payload)
+    after = runner.snapshot_changed_files(repo, payload)
+    content_changed = [path for path in changed if before.get(path) != after.get(path)]
+
+    review, _ = pre_review(repo, changed, content_changed=content_changed)
+
+    assert runner.git_diff_for_paths(repo, changed).strip()
+    assert review is not None and review.raw_output == "[pre-review] no-op diff"
+
+
+def test_apply_changes_refuses_writes_to_outline_only_files(repo: Path):
+    payload = {"changes": [
+        {"path": "src/b.ts", "action": "upsert", "content": "export const b = 1;\n"},
+        {"path": "src/a.ts", "action": "upsert", "content": "x"},
+    ]}
+    with pytest.raises(runner.ChangeRefused, match="outline"):
+        runner.apply_changes(repo, payload, {"src/a.ts": "outline"})
+    assert (repo / "src/a.ts").read_text() == "export const a = 1;\n"
+    assert not (repo / "src/b.ts").exists()
+
+
+class OutlineClient(FakeClient):
+    # Selects src/b.ts as read-only context, then edits it anyway.
+    def __init__(self) -> None:
+        super().__init__([{"path": "src/b.ts", "action": "upsert", "content": "export const b = 0;\n"}])
+        self.implement_prompts: list[str] = []
+
+    def complete(self, *, system_prompt: str, user_prompt: str, **kw: object) -> str:
+        if "selecting" in system_prompt:
+            return json.dumps({"files_to_read": ["src/a.ts", "src/b.ts"], "files_to_create": [], "files_to_modify": ["src/a.ts"]})
+        if "implementing" in system_prompt:
+            self.implement_prompts.append(user_prompt)
+        return super().complete(system_prompt=system_prompt, user_prompt=user_prompt)
+
+
+def test_outline_refusal_fails_the_attempt_and_resends_the_file_in_full(repo: Path):
+    (repo / "src/b.ts").write_text("".join(f"export function b{index}() {{\n  return {index};\n}}\n\n" for index in range(300)))
+    git(repo, "add", "-A")
+    git(repo, "-c", "user.email=t@t", "-c", "user.name=t", "commit", "-qm", "b")
+    client = OutlineClient()
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo), max_attempts_per_slice=2))
+
+    assert runner.run(spec, continue_on_failure=False, client=client) == 0
+
+    first, second = client.implement_prompts
+    assert "reference outline only, full content omitted; do not rewrite this file): src/b.ts" in first
+    assert "### FILE: src/b.ts\nexport function b0()" in second
+    assert "Refusing to change src/b.ts" in second
+    summary = json.loads(next((repo / runner.RUNS_DIR).iterdir()).joinpath("summary-final.json").read_text())
+    assert [attempt["review_source"] for attempt in summary["slices"][0]["attempts"]] == ["apply", "model"]
+    assert (repo / "src/b.ts").read_text() == "export const b = 0;\n"
+
+
+def test_review_diff_summarizes_lockfiles_and_binaries(repo: Path):
+    (repo / "package-lock.json").write_text('{"lockfileVersion": 3}\n')
+    git(repo, "add", "-A")
+    git(repo, "-c", "user.email=t@t", "-c", "user.name=t", "commit", "-qm", "lock")
+    (repo / "package-lock.json").write_text('{"lockfileVersion": 3, "packages": {}}\n')
+    (repo / "src/logo.png").write_bytes(b"\x89PNG\0\0data")
+    (repo / "src/new.ts").write_text("export const n = 1;\n")
+
+    diff = runner.git_diff_for_paths(repo, ["package-lock.json", "src/logo.png", "src/new.ts"])
+
+    assert "### UNTRACKED FILE: src/new.ts" in diff
+    assert "lockfileVersion" not in diff and "PNG" not in diff
+    assert "- package-lock.json (lockfile or generated; +1 -1 lines)" in diff
+    assert "- src/logo.png (new binary file, 10 bytes)" in diff
+
+
+class ReviewClient:
+    def __init__(self) -> None:
+        self.prompts: list[str] = []
+
+    def complete(self, *, user_prompt: str, **_: object) -> str:
+        self.prompts.append(user_prompt)
+        return json.dumps({"pass": True, "issues": [], "required_fixes": []})
+
+
+def test_review_caps_chunks_and_tells_the_reviewer_what_was_dropped(repo: Path, tmp_path_factory):
+    spec = runner.load_spec(write_spec(repo / "spec.json", review_chunk_tokens=2000, max_review_chunks=2))
+    diff = "\n\n".join(f"### UNTRACKED FILE: src/f{index}.ts\n" + "x\n" * 3000 for index in range(4))
+    client = ReviewClient()
+    plan = runner.SlicePlan(id="S1", title="t", objective="o", acceptance=[], check_commands=[], files_hint=[])
+
+    runner.review_slice(
+        client=client,
+        spec=spec,
+        slice_plan=plan,
+        touched_paths=[],
+        diff_text=diff,
+        check_results=[],
+        logger=runner.RunLogger(tmp_path_factory.mktemp("run")),
+        slice_dir="s",
+        attempt=1,
+    )
+
+    assert len(client.prompts) == 2
+    assert all("Files not shown at all: src/f2.ts, src/f3.ts" in prompt for prompt in client.prompts)
+
+
+def test_load_file_context_outlines_only_large_source_files(repo: Path):
+    source = "".join(f"export const v{index} = {index};\n" for index in range(400))
+    (repo / "src/big.ts").write_text(source)
+    (repo / "src/data.json").write_text(json.dumps({"values": list(range(2000))}))
+    git(repo, "add", "-A")
+    shown_as: dict[str, str] = {}
+    context = runner.load_file_context(
+        repo,
+        ["src/a.ts", "src/a.test.ts", "src/big.ts", "src/data.json"],
+        {"src/a.ts"},
+        runner.SummaryCache(repo),
+        shown_as=shown_as,
+    )
+    assert shown_as == {"src/big.ts": "outline"}
+    assert "### FILE: src/a.test.ts\ntest('a'" in context
+    assert "### FILE: src/data.json\n{" in context
+
+
+def big_module(tmp: Path, separator: str = "") -> Path:
+    # Over MAX_FILE_CHARS, with line-break look-alikes that str.splitlines would split on.
+    body = "".join(
+        f"export function fn{index}() {{\n  // {separator}filler{separator}\n  return {index};\n}}\n\n"
+        for index in range(1200)
+    )
+    path = tmp / "src/big.ts"
+    path.write_text("import { a } from './a';\n\n" + body)
+    return path
+
+
+@pytest.mark.parametrize("separator", ["", "\f", "\v", "\x85", " ", " "])
+def test_symbol_anchors_match_file_lines(tmp_path: Path, separator: str):
+    (tmp_path / "src").mkdir()
+    path = big_module(tmp_path, separator)
+    lines = path.read_text().split("\n")
+    data = path.read_bytes()
+    for symbol in runner.build_file_symbols("src/big.ts", path):
+        assert lines[symbol["line"] - 1].startswith(f"export function {symbol['name']}(")
+        region = data[symbol["start_byte"] : symbol["end_byte"]].decode()
+        assert region == "\n".join(lines[symbol["line"] - 1 : symbol["end_line"]]) + "\n"
+
+
+def test_windowed_excerpt_anchors_and_upsert_guard(repo: Path):
+    big_module(repo, " ")
+    shown_as: dict[str, str] = {}
+    context = runner.load_file_context(repo, ["src/big.ts"], focus_text="fn500", shown_as=shown_as)
+    assert shown_as == {"src/big.ts": "windowed"}
+    lines = (repo / "src/big.ts").read_text().split("\n")
+    anchor = next(line for line in context.splitlines() if line.endswith("function fn500]"))
+    start, end = (int(part) for part in anchor.split(":")[0].removeprefix("[lines ").split("-"))
+    assert lines[start - 1] == "export function fn500() {" and lines[end - 1] == "}"
+
+    with pytest.raises(runner.OrchestratorError, match="replace_lines"):
+        runner.apply_changes(repo, {"changes": [{"path": "src/big.ts", "action": "upsert", "content": "x"}]}, shown_as)
+    edit = {"path": "src/big.ts", "action": "replace_lines", "start_line": start + 2, "end_line": start + 2, "content": "  return -1;"}
+    assert runner.apply_changes(repo, {"changes": [edit]}, shown_as) == ["src/big.ts"]
+    updated = (repo / "src/big.ts").read_text().split("\n")
+    assert updated[start + 1] == "  return -1;"
+    assert len(updated) == len(lines)
+
+
+def test_apply_line_edits_applies_bottom_up_and_rejects_overlaps(tmp_path: Path):
+    target = tmp_path / "f.txt"
+    target.write_text("one\ntwo\fhalf\nthree\nfour\n")
+    runner.apply_line_edits(target, "f.txt", [(1, 1, "ONE"), (3, 4, "THREE-FOUR\n"), (2, 1, "inserted\n")])
+    assert target.read_text() == "ONE\ninserted\ntwo\fhalf\nTHREE-FOUR\n"
+    with pytest.raises(runner.OrchestratorError, match="overlapping"):
+        runner.apply_line_edits(target, "f.txt", [(1, 2, "x"), (2, 3, "y")])
+
+
+def test_retention_uses_indexed_sizes_instead_of_walking_runs(tmp_path: Path, monkeypatch):
+    runs_root = tmp_path / runner.RUNS_DIR
+    for index in range(4):
+        run_dir = runs_root / f"2026010{index}-000000"
+        run_dir.mkdir(parents=True)
+        summary = {"started_at": "2026-01-01T00:00:00", "ended_at": "2026-01-01T00:01:00", "goal": "g", "slices": []}
+        (run_dir / "summary-final.json").write_text(json.dumps(summary))
+    with runner.HistoryIndex(tmp_path) as history:
+        runner.reindex_runs(tmp_path, history)
+        walked: list[str] = []
+        real_size = runner.directory_size
+        monkeypatch.setattr(runner, "directory_size", lambda path: walked.append(path.name) or real_size(path))
+        (runs_root / "20260104-000000").mkdir()  # Unindexed, e.g. a run still in progress.
+        policy = runner.RetentionPolicy(max_age_days=None, max_runs=3, max_bytes=None, keep_recent=1)
+        archived = runner.apply_retention(tmp_path, policy, history)
+    assert walked == ["20260104-000000"]
+    assert archived == ["20260100-000000", "20260101-000000"]
+
+
+def test_file_cache_sees_same_size_rewrite_within_one_mtime_tick(tmp_path: Path):
+    cache = runner.FileCache(1_000)
+    path = tmp_path / "f.ts"
+    path.write_text("aaaa")
+    stamp = path.stat().st_mtime_ns
+    assert cache.read_text(path) == "aaaa"
+
+    path.write_text("bbbb")
+    os.utime(path, ns=(stamp, stamp))  # Same size, same mtime: only the content hash can tell.
+
+    assert cache.read_text(path) == "bbbb"
+    assert cache.counters()["misses"] == 2
+
+
+def test_file_cache_evicts_least_recently_used_past_max_chars(tmp_path: Path):
+    cache = runner.FileCache(10)
+    paths = []
+    for name in "abc":
+        paths.append(tmp_path / name)
+        paths[-1].write_text(name * 4)
+    cache.read_text(paths[0])
+    cache.read_text(paths[1])
+    cache.read_text(paths[0])
+    cache.read_text(paths[2])  # 12 chars > 10: evicts b, the least recently used.
+
+    assert list(cache.entries) == [paths[0], paths[2]]
+    assert (cache.chars, cache.counters()["evictions"]) == (8, 1)
+    (tmp_path / "big").write_text("x" * 11)
+    cache.read_text(tmp_path / "big")
+    assert tmp_path / "big" not in cache.entries
+
+
+def test_apply_changes_invalidates_cached_files(repo: Path, monkeypatch):
+    cache = runner.FileCache(1_000)
+    monkeypatch.setattr(runner, "FILE_CACHE", cache)
+    target = repo / "src/a.ts"
+    cache.read_text(target)
+
+    runner.apply_changes(repo, {"changes": [{"path": "src/a.ts", "action": "upsert", "content": "export const a = 9;\n"}]})
+
+    assert target not in cache.entries
+    assert cache.counters()["invalidations"] == 1
+    assert cache.read_text(target) == "export const a = 9;\n"
+
+
+def test_working_tree_hash_ignores_orchestrator_state(repo: Path):
+    (repo / "src/new.ts").write_text("export const n = 1;\n")
+    before = runner.working_tree_hash(repo)
+    log_dir = repo / runner.RUNS_DIR / "20260101-000000"
+    log_dir.mkdir(parents=True)
+    (log_dir / "check.log").write_text("PASS\n")
+    assert runner.working_tree_hash(repo) == before
+
+    (repo / "src/new.ts").write_text("export const n = 2;\n")
+    assert runner.working_tree_hash(repo) not in {"", before}
+
+
+def flaky_config(**overrides: object) -> runner.FlakyCheckConfig:
+    return runner.parse_flaky_checks({"flaky_checks": {"runners": {"sh check.sh": "pytest"}, **overrides}})
+
+
+@pytest.mark.parametrize("lint_exit, expected", [(1, 1), (0, 0)])
+def test_targeted_rerun_pass_is_confirmed_by_the_full_command(tmp_path: Path, lint_exit: int, expected: int):
+    # Targeted reruns (with test IDs) pass; the full command also runs a lint step.
+    (tmp_path / "check.sh").write_text(
+        f'if [ $# -gt 0 ]; then exit 0; fi\necho lint; exit {lint_exit}\n'
+    )
+    flaky = runner.FlakyTracker(tmp_path, flaky_config())
+    failed = runner.CheckResult(command="sh check.sh", exit_code=1, output="FAILED tests/test_x.py::test_a")
+
+    result = runner.recheck_failed(failed, flaky, "", cwd=tmp_path, timeout_seconds=30)
+
+    assert result.exit_code == expected
+    assert "=== full rerun 1/1" in result.output
+    assert result.flaky_tests == ([] if expected else ["tests/test_x.py::test_a"])
+
+
+def test_automatic_quarantine_expires(tmp_path: Path):
+    flaky = runner.FlakyTracker(tmp_path, flaky_config(quarantine_after=2, quarantine_days=7))
+    for _ in range(2):
+        flaky.record_flips("sh check.sh", ["t::a"])
+    assert flaky.is_quarantined("sh check.sh", "t::a")
+
+    test = flaky.commands["sh check.sh"]["tests"]["t::a"]
+    test["quarantined_at"] = (runner.dt.datetime.now() - runner.dt.timedelta(days=8)).isoformat()
+    assert not flaky.is_quarantined("sh check.sh", "t::a")
+    assert (test["quarantined"], test["flips"]) == (False, 0)
+    assert flaky.report()["quarantined"] == []
+
+    off = runner.FlakyTracker(tmp_path / "off", flaky_config(quarantine_after=1, quarantine_days=0))
+    off.record_flips("sh check.sh", ["t::a"])
+    assert not off.is_quarantined("sh check.sh", "t::a")
+
+
+def check_resources(**overrides: object) -> runner.CheckResourceConfig:
+    return runner.parse_check_resources({"check_resources": {"min_free_memory_mb": 0, "max_load_per_cpu": 0, **overrides}})
+
+
+def test_check_slots_fall_back_when_slot_dir_is_not_ours(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(runner.tempfile, "gettempdir", lambda: str(tmp_path))
+    foreign = tmp_path / f"{runner.CHECK_SLOTS_DIR}-{os.getuid()}"
+    foreign.mkdir(mode=0o777)
+    foreign.chmod(0o777)
+    scheduler = runner.CheckScheduler(check_resources())
+    assert scheduler.slot_dir is None
+    assert scheduler.run("echo ok", tmp_path, 30) == (0, "ok")
+    assert scheduler.records[0]["admitted_by"] == "no-slot-dir"
+
+
+def test_check_slots_use_private_per_user_dir(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(runner.tempfile, "gettempdir", lambda: str(tmp_path))
+    scheduler = runner.CheckScheduler(check_resources(max_concurrent_checks=1))
+    assert scheduler.slot_dir == tmp_path / f"{runner.CHECK_SLOTS_DIR}-{os.getuid()}"
+    assert scheduler.slot_dir.stat().st_mode & 0o777 == 0o700
+    assert scheduler.run("echo ok", tmp_path, 30) == (0, "ok")
+    assert scheduler.records[0]["admitted_by"] == "slot"
+
+
+def test_check_admission_is_off_unless_check_resources_is_set(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(runner.tempfile, "gettempdir", lambda: str(tmp_path))
+    scheduler = runner.CheckScheduler(runner.parse_check_resources({}))
+    monkeypatch.setattr(scheduler, "host_has_room", lambda: pytest.fail("admission should be skipped"))
+    assert scheduler.slot_dir is None
+    assert scheduler.run("echo ok", tmp_path, 30) == (0, "ok")
+    assert scheduler.records[0]["admitted_by"] == "disabled"
+    assert runner.parse_check_resources({"check_resources": {}}).admission
+
+
+def test_check_process_joins_cgroup_and_is_niced_before_exec(tmp_path: Path):
+    # A plain file stands in for cgroup.procs: the child writes "0" (move self) before exec.
+    cgroup = tmp_path / "cg"
+    cgroup.mkdir()
+    (cgroup / "cgroup.procs").write_text("")
+    scheduler = runner.CheckScheduler(check_resources(nice=5))
+    with open(tmp_path / "out", "wb") as stdout:
+        command = f"{sys.executable} -c 'import os; print(os.nice(0))'"
+        process = scheduler.spawn(command, tmp_path, cgroup, stdout, subprocess.DEVNULL)
+        assert process.wait() == 0
+    assert (cgroup / "cgroup.procs").read_text() == "0"
+    assert int((tmp_path / "out").read_text()) == os.nice(0) + 5
+
+
+def warm_config(watch_command: str, **overrides: object) -> runner.WarmCheckConfig:
+    fields = {
+        "watch_command": watch_command,
+        "done_pattern": "DONE",
+        "fail_pattern": "FAIL",
+        "paths": ["**/*"],
+        "cycle_timeout_seconds": 3,
+        "settle_seconds": 0.2,
+        "full_cycles": True,
+        **overrides,
+    }
+    return runner.WarmCheckConfig(**fields)
+
+
+def test_warm_cycle_must_start_after_the_change(tmp_path: Path):
+    worker = runner.WarmWorker(tmp_path, warm_config("echo building; sleep 1; echo DONE; sleep 60"))
+    try:
+        time.sleep(0.5)
+        since = time.time()  # The edit lands while the only cycle is already running.
+        assert worker.cycle_after(since) is None
+        assert worker.latest() is not None and worker.latest()[1] > since
+    finally:
+        worker.stop()
+
+
+def test_partial_warm_cycles_only_fail_fast(tmp_path: Path):
+    for output, expected in (("PASS related", None), ("FAIL related", 1)):
+        config = warm_config(f"sleep 0.3; echo '{output}'; echo DONE; echo 'press h for help'; sleep 60", full_cycles=False)
+        result = runner.run_warm_check(f"check {output}", config, tmp_path, None, time.time())
+        assert (result[0] if result else None) == expected
+    runner.stop_warm_workers()
+
+
+def test_fanout_repo_run_stops_its_warm_workers(repo: Path, monkeypatch):
+    started: list[runner.WarmWorker] = []
+
+    def fake_run(spec: runner.Spec, **_: object) -> int:
+        worker = runner.WarmWorker(repo, warm_config("sleep 60"))
+        runner._WARM_WORKERS[(repo, "check")] = worker
+        started.append(worker)
+        return 0
+
+    monkeypatch.setattr(runner, "run", fake_run)
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo)))
+
+    assert runner.run_fanout_repo(spec, False, False, repo / "plan.json")["exit_code"] == 0
+    assert runner._WARM_WORKERS == {}
+    assert started[0].process.wait(timeout=5) is not None
+
+
+def test_spec_round_trips_through_run_log(repo: Path, tmp_path_factory):
+    spec_path = write_spec(
+        repo / "spec.json",
+        retention={"max_runs": 0},
+        warm_checks={"npm run lint": {"preset": "tsc"}},
+        working_directories=[str(repo)],
+        phase_models={"review": {"backend": "openai", "model": "gpt-4.1-mini"}},
+        auto_route={"fast_model": "gpt-4.1-mini"},
+        hedging={"phases": ["select"]},
+        sharded_checks={"npm run test": {"runner": "vitest"}},
+        flaky_checks={"runners": {"npm run test": "vitest"}},
+    )
+    spec = runner.load_spec(spec_path)
+    logged = tmp_path_factory.mktemp("run") / "spec.json"
+    logged.write_text(json.dumps(runner.spec_to_payload(spec)))
+    reloaded = runner.load_spec(logged)
+    assert reloaded.retention == spec.retention
+    assert reloaded == runner.dataclasses.replace(spec, spec_path=str(logged.resolve()))
+
+
+def test_auto_route_scores_select_by_slice_outcome(repo: Path, monkeypatch):
+    monkeypatch.setattr(runner, "create_client", lambda spec, **_: FakeClient())
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo), auto_route={"fast_model": "fast"}))
+    assert spec.auto_route is not None and spec.auto_route.phases == ["select"]
+
+    assert runner.run(spec, continue_on_failure=False, client=FakeClient()) == 0
+
+    stats = json.loads((repo / runner.PHASE_STATS_FILE).read_text())
+    select = next(entry for key, entry in stats.items() if key.startswith("select|") and key.endswith("|fast"))
+    assert select["outcomes"] == [True]
+    assert not any(key.startswith("review|") and key.endswith("|fast") for key in stats)
+
+
+class LegClient:
+    # One hedge leg: answers (or raises) after a delay, or as soon as it is cancelled.
+    supports_cancel = True
+
+    def __init__(self, delay: float, raw: str | None = '{"ok": true}'):
+        self.delay = delay
+        self.raw = raw
+        self.calls = 0
+        self.cancelled = False
+
+    def complete(self, *, cancel_event=None, **_: object) -> str:
+        self.calls += 1
+        if cancel_event is not None and cancel_event.wait(self.delay):
+            self.cancelled = True
+            raise runner.OrchestratorError("cancelled")
+        if cancel_event is None:
+            time.sleep(self.delay)
+        if self.raw is None:
+            raise runner.OrchestratorError("leg failed")
+        return self.raw
+
+
+def hedged(primary: LegClient, secondary: LegClient) -> tuple[runner.HedgedClient, runner.HedgeStats]:
+    stats = runner.HedgeStats()
+    return runner.HedgedClient(primary, secondary, 0.2, "select", stats), stats
+
+
+def test_hedged_client_primary_answers_before_the_delay():
+    primary, secondary = LegClient(0.0, '{"leg": 0}'), LegClient(0.0)
+    client, stats = hedged(primary, secondary)
+
+    assert client.complete(system_prompt="s", user_prompt="u") == '{"leg": 0}'
+    assert secondary.calls == 0
+    assert stats.summary()["select"] == {"calls": 1, "hedged": 0, "secondary_won": 0, "cancelled": 0, "hedge_rate": 0.0}
+
+
+def test_hedged_client_secondary_wins_and_primary_is_cancelled():
+    primary, secondary = LegClient(5.0, '{"leg": 0}'), LegClient(0.0, '{"leg": 1}')
+    client, stats = hedged(primary, secondary)
+
+    started = time.perf_counter()
+    assert client.complete(system_prompt="s", user_prompt="u") == '{"leg": 1}'
+    assert time.perf_counter() - started < 2
+    deadline = time.time() + 2
+    while not primary.cancelled and time.time() < deadline:
+        time.sleep(0.01)
+    assert primary.cancelled
+    counters = stats.summary()["select"]
+    assert (counters["hedged"], counters["secondary_won"], counters["cancelled"]) == (1, 1, 1)
+
+
+def test_hedged_client_raises_when_both_legs_fail():
+    client, stats = hedged(LegClient(0.4, None), LegClient(0.0, None))
+
+    with pytest.raises(runner.OrchestratorError, match="leg failed"):
+        client.complete(system_prompt="s", user_prompt="u")
+    assert stats.summary()["select"]["hedged"] == 1
+
+
+def test_router_does_not_hedge_below_min_samples(repo: Path):
+    spec = runner.load_spec(write_spec(repo / "spec.json", hedging={"phases": ["select"], "min_samples": 3}))
+    stats = runner.PhaseStats(repo)
+    router = runner.ModelRouter(spec, FakeClient(), stats)
+    key = runner.PhaseStats.key("select", spec.model_backend, spec.model)
+
+    for _ in range(2):
+        stats.record_call(key, 1.0, True)
+    assert isinstance(router.client("select").inner, FakeClient)
+    stats.record_call(key, 1.0, True)
+    assert isinstance(router.client("select").inner, runner.HedgedClient)
+    assert isinstance(router.client("review").inner, FakeClient)
+
+
+def test_output_token_budget_respects_phase_floor_and_spec_ceiling(repo: Path):
+    spec = runner.load_spec(write_spec(repo / "spec.json", max_output_tokens=8000))
+
+    assert runner.output_token_budget(spec, "select", 0) == runner.MIN_OUTPUT_TOKENS["select"]
+    assert runner.output_token_budget(spec, "implement", 100) == runner.MIN_OUTPUT_TOKENS["implement"]
+    assert runner.output_token_budget(spec, "implement", 10_000_000) == 8000
+    middle = runner.output_token_budget(spec, "implement", 16_000)
+    assert runner.MIN_OUTPUT_TOKENS["implement"] < middle < 8000
+
+
+def scripted_openai(monkeypatch, finish_reasons: list[str]) -> tuple[runner.OpenAIChatClient, list[dict]]:
+    client = runner.OpenAIChatClient("key", "model", "http://127.0.0.1:9")
+    payloads: list[dict] = []
+
+    def post_chat(payload: dict, cancel_event: object) -> dict:
+        payloads.append(payload)
+        reason = finish_reasons[min(len(payloads), len(finish_reasons)) - 1]
+        return {"choices": [{"message": {"content": f"part{len(payloads)};"}, "finish_reason": reason}], "usage": {}}
+
+    monkeypatch.setattr(client, "_post_chat", post_chat)
+    return client, payloads
+
+
+def test_openai_client_joins_parts_cut_off_by_length(monkeypatch):
+    client, payloads = scripted_openai(monkeypatch, ["length", "stop"])
+    usage: dict[str, int] = {}
+
+    assert client.complete(system_prompt="s", user_prompt="u", usage=usage) == "part1;part2;"
+    assert payloads[1]["messages"][-2:] == [
+        {"role": "assistant", "content": "part1;"},
+        {"role": "user", "content": runner.CONTINUATION_PROMPT},
+    ]
+    assert usage == {"requests": 2, "continuations": 1}
+
+
+def test_openai_client_stops_after_max_continuations(monkeypatch):
+    client, payloads = scripted_openai(monkeypatch, ["length"])
+
+    raw = client.complete(system_prompt="s", user_prompt="u")
+
+    assert len(payloads) == runner.MAX_CONTINUATIONS + 1 == 4
+    assert raw == "part1;part2;part3;part4;"
+
+
+class HistoryClient(FakeClient):
+    # Upserts a large src/a.ts that differs by one line per attempt; the third review passes.
+    supports_history = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.implement_requests: list[int] = []
+        self.reviews = 0
+
+    def complete(self, *, system_prompt: str, user_prompt: str, history: list | None = None, **kw: object) -> str:
+        if "implementing" in system_prompt:
+            sent = len(system_prompt) + len(user_prompt) + sum(len(message["content"]) for message in history or [])
+            self.implement_requests.append(sent)
+            body = "".join(f"export const v{index} = {index};\n" for index in range(400))
+            body += f"export const attempt = {len(self.implement_requests)};\n"
+            self.changes = [{"path": "src/a.ts", "action": "upsert", "content": body}]
+        if "reviewer" in system_prompt:
+            self.reviews += 1
+            return json.dumps({"pass": self.reviews >= 3, "issues": ["x"], "required_fixes": ["y"]})
+        return super().complete(system_prompt=system_prompt, user_prompt=user_prompt)
+
+
+class PromptClient(FakeClient):
+    # Records implementer prompts; the first review fails so the slice takes two attempts.
+    def __init__(self) -> None:
+        super().__init__()
+        self.implement_prompts: list[str] = []
+        self.reviews = 0
+
+    def complete(self, *, system_prompt: str, user_prompt: str, **kw: object) -> str:
+        if "implementing" in system_prompt:
+            self.implement_prompts.append(user_prompt)
+            self.changes = [{"path": "src/a.ts", "action": "upsert", "content": f"export const a = {len(self.implement_prompts) + 1};\n"}]
+        if "reviewer" in system_prompt:
+            self.reviews += 1
+            return json.dumps({"pass": self.reviews >= 2, "issues": ["x"], "required_fixes": ["y"]})
+        return super().complete(system_prompt=system_prompt, user_prompt=user_prompt)
+
+
+def test_attempts_of_one_slice_share_a_byte_identical_prompt_prefix(repo: Path):
+    client = PromptClient()
+    spec = runner.load_spec(
+        write_spec(repo / "spec.json", working_directory=str(repo), max_attempts_per_slice=2, multi_turn_retries=False)
+    )
+    assert runner.run(spec, continue_on_failure=False, client=client) == 0
+
+    first, second = client.implement_prompts
+    boundary = first.index("Current file context:")
+    assert first[:boundary].encode() == second[:boundary].encode()
+    assert first != second
+
+
+def test_retry_turns_do_not_resend_earlier_responses(repo: Path):
+    client = HistoryClient()
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo), max_attempts_per_slice=3))
+    assert runner.run(spec, continue_on_failure=False, client=client) == 0
+
+    first, second, third = client.implement_requests
+    response_chars = 400 * len("export const v000 = 000;\n")
+    assert third - second < response_chars / 2
+    summary = json.loads(next((repo / runner.RUNS_DIR).iterdir()).joinpath("summary-final.json").read_text())
+    attempts = summary["slices"][0]["attempts"]
+    assert [attempt["implementer_prompt_mode"] for attempt in attempts] == ["full", "delta", "delta"]
+    assert [attempt["implementer_prompt_chars"] for attempt in attempts] == client.implement_requests
+
+
+def test_profile_writes_phase_reports(repo: Path):
+    spec = runner.load_spec(write_spec(repo / "spec.json", working_directory=str(repo), max_attempts_per_slice=1))
+    assert runner.run(spec, continue_on_failure=False, profile=True, client=FakeClient()) == 0
+    profile_dir = next((repo / runner.RUNS_DIR).iterdir()) / runner.PROFILE_DIR
+    names = {path.name for path in profile_dir.iterdir()}
+    assert {"summary.txt", "summary.json", "001-setup.pstats", "001-setup-alloc.txt", "002-plan.pstats"} <= names
+    summary = json.loads((profile_dir / "summary.json").read_text())
+    assert [phase["phase"] for phase in summary["phases"]][:2] == ["setup", "plan"]
+    assert all((profile_dir / phase["pstats_file"]).name in names for phase in summary["phases"])
+    assert (profile_dir / "summary.txt").read_text().startswith(runner.PROFILE_THREAD_NOTE)